@@ -1,38 +1,498 @@
 #cython: language_level=3
 
-from libc.stdint cimport int16_t, int32_t, uint32_t, uint64_t
-from libc.math cimport sin, pi, floor
-from libc.stdlib cimport rand, abs
+from libc.stdint cimport int16_t, int32_t, int64_t, uint8_t, uint32_t, uint64_t
+from libc.math cimport sin, cos, pi, floor, pow
+from libc.stdlib cimport abs
 from libc.string cimport memcpy, memset
+from libc.stdio cimport FILE, fopen, fwrite, fclose
+from libc.errno cimport errno
+
+from itertools import islice
+from numbers import Real
+from time import perf_counter_ns
 
 cimport cython
-from cpython.mem cimport PyMem_Malloc, PyMem_Free
-from cpython.buffer cimport PyObject_GetBuffer
+from cython cimport floating
+from cpython.array cimport array
+from cpython.mem cimport PyMem_Malloc, PyMem_Realloc, PyMem_Free
+from cpython.pythread cimport (
+    PyThread_type_lock, PyThread_allocate_lock, PyThread_free_lock,
+    PyThread_acquire_lock, PyThread_release_lock, WAIT_LOCK
+)
+from cpython.buffer cimport (
+    PyObject_GetBuffer, PyBuffer_Release, PyBUF_WRITABLE, PyBUF_C_CONTIGUOUS,
+    PyBUF_FORMAT, PyBUF_ND, PyBUF_STRIDES
+)
 
 
 cdef float AMPLITUDE = (1 << 15) - 1
 cdef uint32_t SAMPLE_RATE = 44100
 
+#: The version of the synthesis engine. This must be incremented whenever a
+#: change causes the same parameters to generate different samples, as it
+#: invalidates persistent caches of rendered sounds.
+ENGINE_VERSION = 4
+
+
+cdef enum:
+    K_SFX, K_TONE, K_PLUCK, K_MIX, K_CHORD, K_SEQUENCE, N_KERNELS
+
+cdef tuple KERNEL_NAMES = ('sfx', 'tone', 'pluck', 'mix', 'chord', 'sequence')
+
+
+cdef struct KernelStats:
+    uint64_t renders, samples, ns
+
+
+# Render statistics. These are only updated with the GIL held.
+cdef KernelStats kernel_stats[N_KERNELS]
+cdef uint64_t cache_hits = 0, cache_misses = 0
+cdef object render_hook = None
+
+
+cdef int64_t record_render(
+    int kernel,
+    int64_t start,
+    size_t n_samples,
+    size_t renders=1
+) except? -1:
+    """Count renders that began at perf_counter_ns() time start.
+
+    Return the time they took in nanoseconds.
+    """
+    cdef int64_t ns = perf_counter_ns() - start
+    add_render_stats(kernel, renders, n_samples, ns)
+    return ns
+
+
+cdef void add_render_stats(
+    int kernel,
+    size_t renders,
+    size_t n_samples,
+    int64_t ns
+) noexcept:
+    """Count renders that took ns nanoseconds in total."""
+    kernel_stats[kernel].renders += renders
+    kernel_stats[kernel].samples += n_samples
+    kernel_stats[kernel].ns += ns
+
+
+cdef extern from *:
+    """
+    /* A monotonic clock in nanoseconds that can be read without the GIL */
+    #ifdef _WIN32
+    #include <windows.h>
+    static int64_t pyfxr_monotonic_ns(void) {
+        static LARGE_INTEGER freq;
+        LARGE_INTEGER now;
+        if (!freq.QuadPart) {
+            QueryPerformanceFrequency(&freq);
+        }
+        QueryPerformanceCounter(&now);
+        return (int64_t) ((double) now.QuadPart * 1e9 / freq.QuadPart);
+    }
+    #else
+    #include <time.h>
+    static int64_t pyfxr_monotonic_ns(void) {
+        struct timespec ts;
+        clock_gettime(CLOCK_MONOTONIC, &ts);
+        return (int64_t) ts.tv_sec * 1000000000 + ts.tv_nsec;
+    }
+    #endif
+    """
+    int64_t monotonic_ns "pyfxr_monotonic_ns" () noexcept nogil
+
+
+cdef void call_render_hook(
+    int kernel,
+    int64_t ns,
+    size_t n_samples,
+    dict params
+) noexcept:
+    """Pass the details of a render to the render hook.
+
+    Exceptions raised by the hook are reported with sys.unraisablehook
+    rather than propagated, so that a faulty hook cannot lose a sound.
+    """
+    render_hook(KERNEL_NAMES[kernel], ns, n_samples, params)
+
+
+def count_cache_lookup(bint hit):
+    """Count a lookup of a cached sound in the render statistics."""
+    global cache_hits, cache_misses
+    if hit:
+        cache_hits += 1
+    else:
+        cache_misses += 1
+
+
+def render_stats() -> dict:
+    """Get statistics about the sounds rendered so far.
+
+    Return a dict with an entry for each kernel (``sfx``, ``tone``,
+    ``pluck``, ``mix``, ``chord`` and ``sequence``), giving the number of
+    ``renders``, the number of ``samples`` they generated, and the total
+    time they took in nanoseconds (``ns``). The ``cache`` entry gives the
+    number of ``hits`` and ``misses`` when looking up the sounds of SFX and
+    other cached sounds.
+    """
+    stats = {
+        KERNEL_NAMES[k]: kernel_stats[k]
+        for k in range(N_KERNELS)
+    }
+    stats['cache'] = {'hits': cache_hits, 'misses': cache_misses}
+    return stats
+
+
+def reset_render_stats():
+    """Reset all the render statistics to zero."""
+    global cache_hits, cache_misses
+    memset(kernel_stats, 0, sizeof(kernel_stats))
+    cache_hits = cache_misses = 0
 
-cdef int16_t samp(float v) nogil:
+
+cdef enum:
+    # Origins of sound memory, in addition to the kernels
+    O_USER = N_KERNELS, O_ARENA, N_ORIGINS
+
+cdef tuple ORIGIN_NAMES = KERNEL_NAMES + ('user', 'arena')
+
+
+cdef struct MemoryStats:
+    uint64_t count, bytes
+
+
+# Accounting of the memory allocated for sounds. This is only updated with
+# the GIL held.
+cdef MemoryStats memory[N_ORIGINS]
+cdef uint64_t live_bytes = 0, peak_bytes = 0
+cdef uint64_t alert_bytes = 0
+cdef bint alerted = False
+cdef object memory_alert = None
+
+
+cdef int track_alloc(int origin, size_t size) except -1:
+    """Account size bytes of sound memory allocated for origin."""
+    global live_bytes, peak_bytes, alerted
+    memory[origin].count += 1
+    memory[origin].bytes += size
+    live_bytes += size
+    peak_bytes = max(peak_bytes, live_bytes)
+    if memory_alert is not None and live_bytes > alert_bytes and not alerted:
+        alerted = True
+        call_memory_alert()
+    return 0
+
+
+cdef void call_memory_alert() noexcept:
+    """Pass the memory statistics to the memory alert callback.
+
+    As with the render hook, exceptions raised by the callback are reported
+    with sys.unraisablehook rather than propagated, so that the allocation
+    that crossed the limit still succeeds.
+    """
+    memory_alert(memory_stats())
+
+
+cdef void track_free(int origin, size_t size) noexcept:
+    """Account the release of sound memory allocated for origin."""
+    global live_bytes, alerted
+    memory[origin].count -= 1
+    memory[origin].bytes -= size
+    live_bytes -= size
+    if alerted and live_bytes <= alert_bytes:
+        alerted = False
+
+
+def memory_stats() -> dict:
+    """Get the amount of memory used by sounds that are currently alive.
+
+    Return a dict with an entry for each origin of sounds, giving the
+    ``count`` of sounds and their size in ``bytes``. The origins are the
+    kernels that generated the sounds (as for :func:`render_stats`),
+    ``user`` for SoundBuffers created directly or by
+    :meth:`SoundBuffer.convert`, and ``arena`` for :class:`SoundArena`
+    blocks, whose sounds are not counted separately.
+
+    The ``total`` entry also gives the ``peak`` number of bytes allocated
+    at once.
+
+    Sounds whose memory belongs to another object, such as slices and
+    sounds wrapping other buffers or loaded files, are not counted.
+    """
+    stats = {
+        ORIGIN_NAMES[o]: memory[o]
+        for o in range(N_ORIGINS)
+    }
+    stats['total'] = {
+        'count': sum(memory[o].count for o in range(N_ORIGINS)),
+        'bytes': live_bytes,
+        'peak': peak_bytes,
+    }
+    return stats
+
+
+def set_memory_alert(limit, callback):
+    """Call callback when the memory used by sounds exceeds limit bytes.
+
+    callback is called with the result of :func:`memory_stats` when the
+    total crosses the limit; it is not called again until the total falls
+    back to the limit or below. Exceptions raised by callback are reported
+    as unraisable exceptions (see :func:`sys.unraisablehook`) and otherwise
+    ignored. Pass None as callback to remove the alert.
+    """
+    global alert_bytes, alerted, memory_alert
+    if callback is not None and not callable(callback):
+        raise TypeError("callback must be callable or None")
+    alert_bytes = limit if callback is not None else 0
+    alerted = False
+    memory_alert = callback
+
+
+def set_render_hook(hook):
+    """Set a function to be called after every render, or None to remove it.
+
+    The hook is called as ``hook(kernel, ns, n_samples, params)``, where
+    kernel is the name of the kernel as in :func:`render_stats`, ns the
+    time taken in nanoseconds, n_samples the number of samples generated,
+    and params a dict describing the sound; for ``sfx``, params can be
+    passed to :class:`SFX` to reconstruct the sound. The hook may be called
+    from any thread. Exceptions raised by the hook are reported as
+    unraisable exceptions (see :func:`sys.unraisablehook`) and otherwise
+    ignored.
+
+    Return the previous hook.
+    """
+    global render_hook
+    if hook is not None and not callable(hook):
+        raise TypeError("hook must be callable or None")
+    previous = render_hook
+    render_hook = hook
+    return previous
+
+
+cdef int16_t samp(float v) noexcept nogil:
     """Convert a float in [-1, 1] to an int16_t sample."""
     return <int16_t> floor(v * AMPLITUDE)
 
 
+cdef struct Rng:
+    uint64_t state
+
+
+cdef void rng_seed(Rng *rng, uint64_t seed) noexcept nogil:
+    """Seed a random number generator.
+
+    The seed is scrambled with a splitmix64 step, so that similar seeds give
+    unrelated sequences and the state is never zero.
+    """
+    seed += 0x9E3779B97F4A7C15ULL
+    seed = (seed ^ (seed >> 30)) * 0xBF58476D1CE4E5B9ULL
+    seed = (seed ^ (seed >> 27)) * 0x94D049BB133111EBULL
+    seed ^= seed >> 31
+    rng.state = seed if seed else 1
+
+
+cdef inline uint32_t rng_next(Rng *rng) noexcept nogil:
+    """Get the next 32-bit random number, using xorshift64*.
+
+    Unlike rand(), this has no global state, so it is reentrant and
+    threads rendering in parallel don't contend for it.
+    """
+    cdef uint64_t x = rng.state
+    x ^= x >> 12
+    x ^= x << 25
+    x ^= x >> 27
+    rng.state = x
+    return <uint32_t> ((x * 0x2545F4914F6CDD1DULL) >> 32)
+
+
+cdef int check_rate(uint32_t sample_rate) except -1:
+    """Validate a sample rate."""
+    if sample_rate == 0:
+        raise ValueError("sample_rate must be positive")
+    return 0
+
+
+cdef uint64_t random_seed() except? 0:
+    """Pick a seed at random, for renders where no seed is given."""
+    import random
+    return random.getrandbits(64)
+
+
+cdef void clamp(floating *v, floating min, floating max) noexcept nogil:
+    """Clamp the given value v to between min and max."""
+    if v[0] < min:
+        v[0] = min
+    elif v[0] > max:
+        v[0] = max
+
+
+# Sample formats are identified by their buffer protocol format codes:
+# 'h' for int16_t, 'f' for float and 'B' for uint8_t. Kernels are written
+# over the sample_t fused type, and the *_any() functions dispatch a void
+# pointer to the specialisation for its format.
+ctypedef fused sample_t:
+    int16_t
+    float
+    uint8_t
+
+
+ctypedef fused out_t:
+    int16_t
+    float
+    uint8_t
+
+
+cdef char parse_format(str format) except 0:
+    """Validate a sample format code, and return it as a char."""
+    if format not in ('h', 'f', 'B'):
+        raise ValueError(
+            f"Invalid sample format {format!r}; must be 'h', 'f' or 'B'"
+        )
+    return ord(format)
+
+
+cdef str native_format(const Py_buffer *view):
+    """Get the struct format code of a buffer exported with PyBUF_FORMAT.
+
+    Byte order prefixes that denote the native byte order are removed.
+    """
+    import sys
+
+    cdef bytes code = view.format if view.format else b'B'
+    if code[:1] in (b'@', b'='):
+        code = code[1:]
+    elif code[:1] == (b'<' if sys.byteorder == 'little' else b'>'):
+        code = code[1:]
+    return code.decode('ascii', 'replace')
+
+
+cdef char buffer_format(const Py_buffer *view) except 0:
+    """Get the sample format of a buffer exported with PyBUF_FORMAT."""
+    return parse_format(native_format(view))
+
+
+cdef inline size_t format_size(char fmt) noexcept nogil:
+    """Get the size in bytes of a sample in the given format."""
+    if fmt == c'h':
+        return sizeof(int16_t)
+    elif fmt == c'f':
+        return sizeof(float)
+    return sizeof(uint8_t)
+
+
+cdef char *format_string(char fmt) noexcept:
+    """Get a format string to export through the buffer protocol."""
+    if fmt == c'h':
+        return 'h'
+    elif fmt == c'f':
+        return 'f'
+    return 'B'
+
+
+cdef inline void store(sample_t *out, size_t i, float v) noexcept nogil:
+    """Store a float in [-1, 1] as a sample."""
+    if sample_t is int16_t:
+        out[i] = samp(v)
+    elif sample_t is float:
+        out[i] = v
+    else:
+        out[i] = <uint8_t> (floor(v * 127.0 + 0.5) + 128.0)
+
+
+cdef inline float to_units(sample_t v) noexcept nogil:
+    """Convert a sample to a float on the scale of 16-bit samples."""
+    if sample_t is int16_t:
+        return v
+    elif sample_t is float:
+        return v * AMPLITUDE
+    else:
+        return (<float> v - 128.0) * (AMPLITUDE / 127.0)
+
+
+cdef inline void put_units(sample_t *out, size_t i, float v) noexcept nogil:
+    """Round and clip a float on the scale of 16-bit samples into out[i]."""
+    if sample_t is int16_t:
+        v = floor(v + 0.5)
+        clamp(&v, -32768.0, 32767.0)
+        out[i] = <int16_t> v
+    elif sample_t is float:
+        v = v / AMPLITUDE
+        clamp(&v, -1.0, 1.0)
+        out[i] = v
+    else:
+        v = floor(v * (127.0 / AMPLITUDE) + 0.5)
+        clamp(&v, -128.0, 127.0)
+        out[i] = <uint8_t> (v + 128.0)
+
+
+cdef void fill_silence(void *data, char fmt, size_t n) noexcept nogil:
+    """Fill n samples of data with silence."""
+    memset(data, 128 if fmt == c'B' else 0, n * format_size(fmt))
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void convert_into(sample_t *src, out_t *dst, size_t n) noexcept nogil:
+    cdef size_t i
+    for i in range(n):
+        put_units(dst, i, to_units(src[i]))
+
+
+cdef void convert_from(sample_t *src, void *dst, char dst_fmt, size_t n) noexcept nogil:
+    if dst_fmt == c'h':
+        convert_into(src, <int16_t*> dst, n)
+    elif dst_fmt == c'f':
+        convert_into(src, <float*> dst, n)
+    else:
+        convert_into(src, <uint8_t*> dst, n)
+
+
+cdef void convert_any(
+    void *src,
+    char src_fmt,
+    void *dst,
+    char dst_fmt,
+    size_t n
+) noexcept nogil:
+    """Convert n samples from src to dst, which may be in any formats."""
+    if src_fmt == dst_fmt:
+        memcpy(dst, src, n * format_size(src_fmt))
+    elif src_fmt == c'h':
+        convert_from(<int16_t*> src, dst, dst_fmt, n)
+    elif src_fmt == c'f':
+        convert_from(<float*> src, dst, dst_fmt, n)
+    else:
+        convert_from(<uint8_t*> src, dst, dst_fmt, n)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void wavetable_from_floats(
+    int16_t *wavetable,
+    const floating *values
+) noexcept nogil:
+    """Convert 1024 values in [-1, 1] to wavetable samples, clipping them."""
+    cdef size_t i
+    cdef floating v
+    for i in range(1024):
+        v = values[i]
+        clamp(&v, -1.0, 1.0)
+        wavetable[i] = samp(v)
+
+
 cdef class Wavetable:
     cdef int16_t[1024] wavetable
 
     def __init__(self, gen):
-        cdef int i
-        for i, val in enumerate(gen):
-            self.wavetable[i] = samp(val)
-            if i == 1023:
-                return
-
-        if i != 1023:
+        cdef double[::1] values = array('d', islice(gen, 1024))
+        if values.shape[0] != 1024:
             raise ValueError(
                 "Wavetable generator generated too few values."
             )
+        with nogil:
+            wavetable_from_floats(self.wavetable, &values[0])
 
     @staticmethod
     def from_function(f):
@@ -41,13 +501,81 @@ cdef class Wavetable:
         f should take a single float argument between 0 and tau (pi * 2) and
         return values in [-1, 1].
         """
-        cdef Wavetable w
-        cdef double t
+        return Wavetable(f(i * pi / 512) for i in range(1024))
 
-        w = Wavetable.__new__(Wavetable)
-        for i in range(1024):
-            t = i * pi / 512
-            w.wavetable[i] = samp(f(t))
+    @staticmethod
+    def from_buffer(obj):
+        """Construct a wavetable from a buffer of 1024 samples.
+
+        obj may be any contiguous buffer, such as a NumPy array or an
+        :class:`array.array`, of floats or doubles in [-1, 1], or of
+        16-bit samples. Values are converted without calling back into
+        Python.
+        """
+        cdef Wavetable w = Wavetable.__new__(Wavetable)
+        cdef Py_buffer view
+        cdef str code
+
+        PyObject_GetBuffer(obj, &view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT)
+        try:
+            code = native_format(&view)
+            if code not in ('d', 'f', 'h'):
+                raise ValueError(
+                    f"Unsupported format {code!r} for a wavetable; "
+                    "must be 'd', 'f' or 'h'"
+                )
+            if view.len != 1024 * view.itemsize:
+                raise ValueError("A wavetable must have exactly 1024 samples")
+            with nogil:
+                if code == 'd':
+                    wavetable_from_floats(w.wavetable, <double*> view.buf)
+                elif code == 'f':
+                    wavetable_from_floats(w.wavetable, <float*> view.buf)
+                else:
+                    memcpy(w.wavetable, view.buf, sizeof(w.wavetable))
+        finally:
+            PyBuffer_Release(&view)
+        return w
+
+    @staticmethod
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def from_harmonics(amplitudes, phases=None):
+        """Construct a wavetable by additive synthesis.
+
+        The waveform is the sum of sine waves at multiples of the
+        fundamental frequency: amplitudes[0] is the amplitude of the
+        fundamental, amplitudes[1] that of the second harmonic, and so on.
+        phases optionally gives the phase offset of each, in radians.
+
+        If the sum would exceed [-1, 1], it is scaled down to fit.
+        """
+        cdef Wavetable w = Wavetable.__new__(Wavetable)
+        cdef double[::1] amps = array('d', amplitudes)
+        cdef size_t n = amps.shape[0], i, k
+        cdef double[::1] offsets = array(
+            'd', [0.0] * n if phases is None else phases
+        )
+        cdef double values[1024]
+        cdef double a, peak = 0.0
+
+        if offsets.shape[0] != n:
+            raise ValueError("phases must have one entry per harmonic")
+
+        with nogil:
+            memset(values, 0, sizeof(values))
+            for k in range(n):
+                a = amps[k]
+                if a == 0.0:
+                    continue
+                for i in range(1024):
+                    values[i] += a * sin((k + 1) * i * pi / 512 + offsets[k])
+            for i in range(1024):
+                peak = max(peak, values[i] if values[i] > 0 else -values[i])
+            if peak > 1.0:
+                for i in range(1024):
+                    values[i] /= peak
+            wavetable_from_floats(w.wavetable, values)
         return w
 
     @staticmethod
@@ -136,66 +664,397 @@ cdef class Wavetable:
         pass
 
 
+cpdef Wavetable as_wavetable(obj):
+    """Get a Wavetable from either a Wavetable or a sequence of 1024 samples."""
+    cdef Wavetable w
+    cdef size_t i
+    if isinstance(obj, Wavetable):
+        return obj
+    samples = list(obj)
+    if len(samples) != 1024:
+        raise ValueError("A wavetable must have exactly 1024 samples")
+    w = Wavetable.__new__(Wavetable)
+    for i in range(1024):
+        w.wavetable[i] = samples[i]
+    return w
+
+
+@cython.cdivision(True)
+cdef inline float wavetable_at(const int16_t *wavetable, float t) noexcept nogil:
+    """Sample a 1024-entry wavetable at t in [0, 1), interpolating linearly."""
+    cdef float pos = t * 1024.0
+    cdef int i = <int> pos
+    cdef float a = wavetable[i & 1023], b = wavetable[(i + 1) & 1023]
+    return (a + (b - a) * (pos - i)) / AMPLITUDE
+
+
+# A high-resolution table of one cycle of a sine wave, used in place of
+# sin() for oscillators. It has an extra entry at the end so that
+# interpolation never has to wrap around.
+cdef enum:
+    SINE_SIZE = 4096
+
+cdef float sine_table[SINE_SIZE + 1]
+
+
+cdef void init_sine_table() noexcept:
+    cdef size_t i
+    for i in range(SINE_SIZE + 1):
+        sine_table[i] = sin(2.0 * pi * i / SINE_SIZE)
+
+
+init_sine_table()
+
+
+cdef inline float sine_turns(double turns) noexcept nogil:
+    """Get sin(2 pi turns), by interpolation in the sine table.
+
+    The error is less than 1e-6, which is well below the resolution of a
+    16-bit sample.
+    """
+    cdef double pos = turns * SINE_SIZE
+    cdef double whole = floor(pos)
+    cdef size_t i = (<int64_t> whole) & (SINE_SIZE - 1)
+    return sine_table[i] + (sine_table[i + 1] - sine_table[i]) * <float> (pos - whole)
+
+
+cdef inline float sine_phase(float t) noexcept nogil:
+    """Get sin(2 pi t) for t in [0, 1].
+
+    t may round to exactly 1.0, so the index is wrapped to stay in the table.
+    """
+    cdef float pos = t * SINE_SIZE
+    cdef int i = <int> pos
+    cdef float frac = pos - i
+    i &= SINE_SIZE - 1
+    return sine_table[i] + (sine_table[i + 1] - sine_table[i]) * frac
+
+
 cdef class SoundBuffer:
+    # The total number of samples; channels are interleaved, so this is the
+    # number of frames times the number of channels
     cdef size_t n_samples
-    cdef int16_t *samples
+    cdef void *data
+    cdef char fmt
+
+    # Shape and strides exported through the buffer protocol. Entry 0 is
+    # the 1D layout of samples, and entries 1 and 2 the 2D layout of frames
+    # x channels. They are only set by set_length(), so they never change
+    # under buffers that have been exported.
+    cdef Py_ssize_t shape[3]
+    cdef Py_ssize_t strides[3]
+
+    # If has_view is set, data points into memory owned by another object,
+    # which we hold a buffer view of, rather than memory we allocated
+    cdef Py_buffer view
+    cdef bint has_view
+
+    # Set if the memory must not be written, because it is a read-only
+    # buffer of another object
+    cdef bint read_only
+
+    cdef readonly uint32_t sample_rate
+    cdef readonly uint32_t channels
+
+    # The origin that allocated memory is accounted to
+    cdef uint8_t origin
+
+    def __cinit__(
+        self,
+        size_t n_samples,
+        str format='h',
+        uint32_t sample_rate=SAMPLE_RATE,
+        uint32_t channels=1,
+        *,
+        bint uninitialised=False
+    ):
+        """Allocate a sound of n_samples frames of silence.
+
+        If uninitialised is True, the memory is not cleared, for callers
+        that will immediately overwrite every sample.
+        """
+        check_rate(sample_rate)
+        if channels == 0:
+            raise ValueError("channels must be at least 1")
+        self.fmt = parse_format(format)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.set_length(n_samples * channels)
+        if not self.n_samples:
+            # Also used for views, which get their memory elsewhere
+            return
+        self.allocate(O_USER)
+        if not uninitialised:
+            fill_silence(self.data, self.fmt, self.n_samples)
+
+    cdef void set_length(self, size_t n_samples) noexcept:
+        """Set the number of samples, and the layout exported for them."""
+        cdef Py_ssize_t itemsize = format_size(self.fmt)
+        self.n_samples = n_samples
+        self.shape[0] = n_samples
+        self.shape[1] = n_samples // self.channels
+        self.shape[2] = self.channels
+        self.strides[0] = itemsize
+        self.strides[1] = itemsize * self.channels
+        self.strides[2] = itemsize
 
-    sample_rate: int = SAMPLE_RATE
-    channels: int = 1
+    cdef int allocate(self, int origin) except -1:
+        """Allocate uninitialised memory for n_samples samples.
 
-    def __cinit__(self, size_t n_samples):
-        self.samples = <int16_t*> PyMem_Malloc(n_samples * sizeof(int16_t))
-        self.n_samples = n_samples
-        if not self.samples:
+        The memory is accounted to origin in memory_stats().
+        """
+        cdef size_t size = self.n_samples * format_size(self.fmt)
+        self.data = PyMem_Malloc(size)
+        if not self.data:
             raise MemoryError()
-        for i in range(n_samples):
-            self.samples[i] = 0
+        self.origin = origin
+        track_alloc(origin, size)
+        return 0
 
     def __dealloc__(self):
-        PyMem_Free(self.samples)
+        if self.has_view:
+            PyBuffer_Release(&self.view)
+        elif self.data:
+            PyMem_Free(self.data)
+            track_free(self.origin, self.n_samples * format_size(self.fmt))
+
+    @staticmethod
+    def from_buffer(
+        obj,
+        format=None,
+        uint32_t sample_rate=SAMPLE_RATE,
+        channels=None,
+    ) -> SoundBuffer:
+        """Construct a SoundBuffer that uses the memory of obj, without copying.
+
+        obj may be any object that exports a contiguous buffer of samples in
+        native byte order, such as a NumPy array or an :class:`array.array`.
+        It is kept alive for as long as the SoundBuffer. If obj is read-only,
+        so is the SoundBuffer.
+
+        The sample format is taken from the buffer unless *format* is given,
+        in which case the raw memory is interpreted in that format. A 2D
+        buffer is taken to be frames x channels; otherwise the channels are
+        interleaved and *channels* (default 1) gives how many there are.
+
+        """
+        cdef SoundBuffer buf
+        cdef Py_buffer view
+        cdef bint read_only = False
+        cdef int flags = PyBUF_C_CONTIGUOUS | PyBUF_FORMAT
+        cdef size_t itemsize, n_channels
+
+        try:
+            PyObject_GetBuffer(obj, &view, flags | PyBUF_WRITABLE)
+        except BufferError:
+            PyObject_GetBuffer(obj, &view, flags)
+            read_only = True
+
+        try:
+            if format is None:
+                format = chr(buffer_format(&view))
+            if channels is None:
+                if view.ndim > 2:
+                    raise ValueError("Buffer has more than two dimensions")
+                channels = view.shape[1] if view.ndim == 2 else 1
+            n_channels = channels
+            buf = SoundBuffer.__new__(
+                SoundBuffer, 0, format, sample_rate, n_channels
+            )
+            itemsize = format_size(buf.fmt)
+            if view.len % (itemsize * n_channels):
+                raise ValueError(
+                    "Buffer length is not a whole number of frames"
+                )
+        except BaseException:
+            PyBuffer_Release(&view)
+            raise
+
+        buf.view = view
+        buf.has_view = True
+        buf.read_only = read_only
+        buf.data = view.buf
+        buf.set_length(view.len // itemsize)
+        return buf
+
+    @property
+    def __array_interface__(self) -> dict:
+        """Describe the memory of this sound to NumPy, for numpy.asarray()."""
+        import sys
+        cdef tuple shape = (len(self),)
+        if self.channels > 1:
+            shape += (self.channels,)
+        order = '<' if sys.byteorder == 'little' else '>'
+        return {
+            'version': 3,
+            'shape': shape,
+            'typestr': {
+                c'h': f'{order}i2',
+                c'f': f'{order}f4',
+                c'B': '|u1',
+            }[self.fmt],
+            'data': (<size_t> self.data, bool(self.read_only)),
+        }
+
+    @property
+    def format(self) -> str:
+        """The sample format, as a :mod:`struct` format code.
+
+        This is ``'h'`` for 16-bit signed integers (the default), ``'f'`` for
+        32-bit floats in [-1, 1], or ``'B'`` for 8-bit unsigned integers.
+        """
+        return chr(self.fmt)
+
+    def convert(self, str format) -> SoundBuffer:
+        """Get a copy of this sound with the given sample format."""
+        cdef SoundBuffer s = SoundBuffer(
+            len(self), format, self.sample_rate, self.channels,
+            uninitialised=True
+        )
+        with nogil:
+            convert_any(self.data, self.fmt, s.data, s.fmt, self.n_samples)
+        return s
 
     def __len__(self):
-        return self.n_samples
+        """Get the number of frames (samples per channel) in the sound."""
+        return self.n_samples // self.channels
+
+    cdef object sample(self, size_t i):
+        if self.fmt == c'h':
+            return (<int16_t*> self.data)[i]
+        elif self.fmt == c'f':
+            return (<float*> self.data)[i]
+        return (<uint8_t*> self.data)[i]
+
+    def __getitem__(self, index):
+        """Get the sample at frame i.
 
-    def __getitem__(self, ssize_t i):
+        For sounds with more than one channel, this is a tuple with a sample
+        for each channel.
+
+        Slicing returns a SoundBuffer that is a view of a range of frames of
+        this sound, sharing its memory.
+        """
+        cdef ssize_t n = len(self), i
+        cdef size_t ch
+        if isinstance(index, slice):
+            return self.slice(index)
+
+        i = index
         if i >= 0:
-            if i >= self.n_samples:
+            if i >= n:
                 raise IndexError("index out of range")
         else:
-            i = self.n_samples + i
+            i = n + i
             if i < 0:
                 raise IndexError("index out of range")
-        return self.samples[i]
+        if self.channels == 1:
+            return self.sample(i)
+        return tuple([
+            self.sample(i * self.channels + ch)
+            for ch in range(self.channels)
+        ])
+
+    cdef SoundBuffer slice(self, slice s):
+        """Get a view of the frames in the slice s, which must have step 1."""
+        cdef Py_ssize_t start, stop, step
+        cdef SoundBuffer buf
+        cdef size_t frame_size = format_size(self.fmt) * self.channels
+
+        start, stop, step = s.indices(len(self))
+        if step != 1:
+            raise ValueError("SoundBuffer slices must have a step of 1")
+        stop = max(start, stop)
+
+        buf = SoundBuffer.__new__(
+            SoundBuffer, 0, chr(self.fmt), self.sample_rate, self.channels
+        )
+        PyObject_GetBuffer(self, &buf.view, 0)
+        buf.has_view = True
+        buf.read_only = self.read_only
+        buf.data = <char*> self.data + start * frame_size
+        buf.set_length((stop - start) * self.channels)
+        return buf
+
+    @property
+    def base(self):
+        """The object whose memory this sound uses, or None if it owns it.
+
+        For a slice of a sound, this is the sound that was sliced.
+        """
+        return self.view.obj if self.has_view else None
 
     @property
     def duration(SoundBuffer self) -> float:
         """Get the duration of this sound in seconds, as a float."""
-        return self.n_samples / <float> SAMPLE_RATE
+        return len(self) / <float> self.sample_rate
 
     def save(self, filename: str):
-        """Save this sound to a .wav file."""
-        import wave
+        """Save this sound to a .wav file.
+
+        Float sounds are saved as 16-bit samples.
+        """
+        write_wav(filename, self)
+
+    @staticmethod
+    def load(filename: str, mmap=True) -> SoundBuffer:
+        """Load a sound from a .wav file.
 
-        with wave.open(filename, 'wb') as wav:
-            wav.setframerate(SAMPLE_RATE)
-            wav.setnchannels(1)
-            wav.setnframes(self.n_samples)
-            wav.setsampwidth(2)
-            wav.writeframesraw(self)
+        The file must contain 8-bit or 16-bit PCM or 32-bit float samples.
+        If mmap is True, the file is memory-mapped copy-on-write and used as
+        the memory of the sound directly, so loading is almost free;
+        otherwise the samples are read into memory.
+        """
+        import sys
+        import mmap as mmap_module
+
+        with open(filename, 'rb') as f:
+            offset, size, format, sample_rate, channels = read_wav_header(f)
+            if not mmap or not size:
+                f.seek(offset)
+                data = bytearray(size)
+                if f.readinto(data) != size:
+                    raise ValueError(f"{filename} is truncated")
+            else:
+                mapping = mmap_module.mmap(
+                    f.fileno(), 0, access=mmap_module.ACCESS_COPY
+                )
+                if offset + size > len(mapping):
+                    raise ValueError(f"{filename} is truncated")
+                data = memoryview(mapping)[offset:offset + size]
+        buf = SoundBuffer.from_buffer(data, format, sample_rate, channels)
+        if sys.byteorder != 'little':
+            # The data is a private copy, so it can be swapped in place
+            swap_bytes(buf)
+        return buf
 
     def __getbuffer__(self, Py_buffer *buffer, int flags):
-        cdef Py_ssize_t itemsize = sizeof(int16_t)
+        cdef Py_ssize_t itemsize = format_size(self.fmt)
 
-        buffer.buf = self.samples
-        buffer.format = 'h'                     # double
+        if self.read_only and flags & PyBUF_WRITABLE:
+            raise BufferError("SoundBuffer is read-only")
+
+        buffer.buf = self.data
+        buffer.format = format_string(self.fmt)
         buffer.internal = NULL                  # see References
         buffer.itemsize = itemsize
-        buffer.len = sizeof(int16_t) * self.n_samples
-        buffer.ndim = 1
+        buffer.len = itemsize * self.n_samples
         buffer.obj = self
-        buffer.readonly = 0
+        buffer.readonly = self.read_only
+        buffer.ndim = 1
         buffer.shape = NULL
         buffer.strides = NULL
+        if flags & PyBUF_ND == PyBUF_ND:
+            if self.channels > 1:
+                # Export as a 2D array of frames x channels
+                buffer.ndim = 2
+                buffer.shape = &self.shape[1]
+                if flags & PyBUF_STRIDES == PyBUF_STRIDES:
+                    buffer.strides = &self.strides[1]
+            else:
+                buffer.shape = &self.shape[0]
+                if flags & PyBUF_STRIDES == PyBUF_STRIDES:
+                    buffer.strides = &self.strides[0]
         buffer.suboffsets = NULL                # for pointer arrays only
 
     def __releasebuffer__(self, Py_buffer *buffer):
@@ -206,6 +1065,205 @@ cdef class SoundBuffer:
         return PygletSource(self)
 
 
+cdef int write_file(
+    const char *path,
+    const char *header,
+    size_t header_size,
+    const void *data,
+    size_t size
+) noexcept nogil:
+    """Write a header and data to the file at path.
+
+    Return 0 on success, or an errno value on failure.
+    """
+    cdef FILE *f = fopen(path, "wb")
+    cdef int err = 0
+    if f == NULL:
+        return errno or -1
+    if (
+        fwrite(header, 1, header_size, f) != header_size
+        or fwrite(data, 1, size, f) != size
+    ):
+        err = errno or -1
+    if fclose(f) != 0 and not err:
+        err = errno or -1
+    return err
+
+
+# WAV format tags for the sample formats
+WAV_PCM = 1
+WAV_FLOAT = 3
+WAV_EXTENSIBLE = 0xFFFE
+
+
+def read_wav_header(f):
+    """Read the header of a .wav file from the binary file object f.
+
+    Return the offset and size of the sample data, and the sample format,
+    sample rate and number of channels.
+    """
+    import struct
+
+    def read(n):
+        data = f.read(n)
+        if len(data) != n:
+            raise ValueError("WAV file is truncated")
+        return data
+
+    riff, _, wave = struct.unpack('<4sI4s', read(12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise ValueError("Not a WAV file")
+
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise ValueError("WAV file has no data chunk")
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            if chunk_size < 16:
+                raise ValueError("WAV fmt chunk is too short")
+            tag, channels, sample_rate, _, _, bits = struct.unpack(
+                '<HHIIHH', read(16)
+            )
+            f.seek(chunk_size - 16 + (chunk_size & 1), 1)
+            if tag == WAV_EXTENSIBLE:
+                raise ValueError(
+                    "WAVE_FORMAT_EXTENSIBLE files are not supported"
+                )
+            fmt = {
+                (WAV_PCM, 8): 'B',
+                (WAV_PCM, 16): 'h',
+                (WAV_FLOAT, 32): 'f',
+            }.get((tag, bits))
+            if fmt is None:
+                raise ValueError(
+                    f"Unsupported WAV sample format {tag} ({bits} bits)"
+                )
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("WAV data chunk comes before fmt chunk")
+            return f.tell(), chunk_size, fmt, sample_rate, channels
+        else:
+            f.seek(chunk_size + (chunk_size & 1), 1)
+
+
+cdef bytes wav_header(SoundBuffer buf):
+    """Get the header of a .wav file containing buf."""
+    import struct
+
+    cdef size_t itemsize = format_size(buf.fmt)
+    cdef size_t size = buf.n_samples * itemsize
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF',
+        36 + size,
+        b'WAVE',
+        b'fmt ',
+        16,
+        WAV_PCM,
+        buf.channels,
+        buf.sample_rate,
+        buf.sample_rate * buf.channels * itemsize,
+        buf.channels * itemsize,
+        8 * itemsize,
+        b'data',
+        size,
+    )
+
+
+cdef void swap_bytes(SoundBuffer buf) noexcept nogil:
+    """Reverse the byte order of each sample of buf, in place."""
+    cdef size_t i, itemsize = format_size(buf.fmt)
+    cdef uint8_t *p = <uint8_t *> buf.data
+    cdef uint8_t tmp
+
+    if itemsize == 2:
+        for i in range(buf.n_samples):
+            tmp = p[0]
+            p[0] = p[1]
+            p[1] = tmp
+            p += 2
+    elif itemsize == 4:
+        for i in range(buf.n_samples):
+            tmp = p[0]
+            p[0] = p[3]
+            p[3] = tmp
+            tmp = p[1]
+            p[1] = p[2]
+            p[2] = tmp
+            p += 4
+
+
+def write_wav(path, SoundBuffer buf):
+    """Write buf to a .wav file at path, with the GIL released.
+
+    Float sounds are written as 16-bit samples.
+    """
+    import os
+    import sys
+
+    if buf.fmt == c'f' or (sys.byteorder != 'little' and buf.fmt == c'h'):
+        # WAV files are little-endian, so on big-endian platforms we swap
+        # the bytes of a copy of the samples
+        buf = buf.convert('h')
+        if sys.byteorder != 'little':
+            swap_bytes(buf)
+    cdef bytes header = wav_header(buf)
+    cdef bytes c_path = os.fsencode(path)
+    cdef const char *c_path_ptr = c_path
+    cdef const char *header_ptr = header
+    cdef size_t header_size = len(header)
+    cdef int err
+
+    with nogil:
+        err = write_file(
+            c_path_ptr,
+            header_ptr,
+            header_size,
+            buf.data,
+            buf.n_samples * format_size(buf.fmt)
+        )
+    if err:
+        raise OSError(
+            err, os.strerror(err) if err > 0 else "Write failed", path
+        )
+
+
+def save_many(files, workers=None):
+    """Save many sounds to .wav files concurrently.
+
+    files is a dict mapping paths to sounds (SoundBuffers or SFX objects).
+    The files are written with the GIL released on a pool of up to
+    *workers* threads (default: the number of CPUs).
+
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    files = dict(files)
+    paths = list(files)
+    sounds = as_buffers(files.values())
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        for path, buf in zip(paths, sounds):
+            write_wav(path, buf)
+        return
+
+    with ThreadPoolExecutor(workers) as pool:
+        for f in [
+            pool.submit(write_wav, path, buf)
+            for path, buf in zip(paths, sounds)
+        ]:
+            f.result()
+
+
 cdef class CachedSound:
     cdef SoundBuffer buf
 
@@ -219,6 +1277,7 @@ cdef class CachedSound:
         self.buf = sound
 
     def _get(self):
+        count_cache_lookup(self.buf is not None)
         if self.buf is None:
             self.buf = <SoundBuffer?> self._build()
         return self.buf
@@ -246,7 +1305,8 @@ cdef class PygletSource:
     cdef size_t pos
 
     def __init__(self, SoundBuffer buf):
-        self.buf = buf
+        # Pyglet doesn't support float samples
+        self.buf = buf.convert('h') if buf.fmt == c'f' else buf
         self.pos = 0
 
     video_format = None
@@ -255,8 +1315,8 @@ cdef class PygletSource:
     def audio_format(self):
         from pyglet.media.codecs import AudioFormat
         return AudioFormat(
-            channels=1,
-            sample_size=16,
+            channels=self.buf.channels,
+            sample_size=8 * format_size(self.buf.fmt),
             sample_rate=self.buf.sample_rate
         )
 
@@ -265,130 +1325,1020 @@ cdef class PygletSource:
         if self.pos != 0:
             return None
 
-        self.pos = self.buf.n_samples * sizeof(int16_t)
+        self.pos = self.buf.n_samples * format_size(self.buf.fmt)
         return AudioData(
             self.buf,
             self.pos,
-            self.buf.n_samples / <float> SAMPLE_RATE,
+            self.buf.duration,
             self.buf.duration,
             ()
         )
 
 
-def tone(
-    Wavetable wavetable,
-    double pitch=440.0,  # Hz, default = A
-    uint32_t attack=4000,
-    uint32_t decay=4000,
-    uint32_t sustain=30000,
-    uint32_t release=20000
-):
-    cdef uint64_t time = 0
-    cdef size_t n_samples, i
-    cdef SoundBuffer t
-    cdef int16_t *samples
-    cdef uint64_t omega   # angular velocity
-    cdef int16_t v
-    cdef float amplitude
-
-    # time and omega will be fixed point with a 32-bit fractional part so
-    # that we can track time within the sample with simple integer addition.
-    #
-    # High accuracy is needed because single-bit rounding errors add up
-    # over tens of thousands of samples.
-    time = 0
-    omega = <uint64_t> (pitch * 1024.0 / SAMPLE_RATE * (1 << 32))
-
-    n_samples = attack + decay + sustain + release
-    t = SoundBuffer(n_samples)
-    samples = t.samples
+cdef class SoundArena:
+    """A single block of memory from which many sounds can be allocated.
 
-    with nogil:
-        for i in range(n_samples):
-            time += omega
-            v = wavetable.wavetable[(time >> 32) & 1023]
-
-            if i < attack:
-                amplitude = (i / <float> attack)
-            elif i < attack + decay:
-                amplitude = (1.0 - (i - attack) / <float> decay * 0.3)
-            elif i < attack + decay + sustain:
-                amplitude = 0.7
-            else:
-                amplitude = (n_samples - i) / release * 0.7
+    Allocating sounds from an arena avoids the cost of allocating and
+    freeing each one separately. The sounds are SoundBuffers that are views
+    of the arena, and keep it alive; its memory is freed all at once when
+    the arena and all its sounds are no longer used.
 
-            samples[i] = <int16_t> (amplitude * v)
+    The arena cannot grow beyond the capacity (in bytes) it was created
+    with.
 
-    return t
+    The arena exports the used part of its memory as bytes through the
+    buffer protocol, so a bank of sounds can be written out in one go.
 
+    """
+    cdef char *data
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
-@cython.nonecheck(False)
-@cython.cdivision(True)
-cdef void reset_sample(
-    float p_base_freq,
-    float p_freq_limit,
-    float p_freq_ramp,
-    float p_freq_dramp,
-    float p_duty,
-    float p_duty_ramp,
-    float p_arp_mod,
-    float p_arp_speed,
-    double *fperiod,
-    int *period,
-    double *fmaxperiod,
-    double *fslide,
-    double *fdslide,
-    float *square_duty,
-    float *square_slide,
-    double *arp_mod,
+    #: The size of the arena in bytes
+    cdef readonly size_t capacity
+
+    #: The number of bytes allocated so far
+    cdef readonly size_t used
+
+    cdef Py_ssize_t shape[1]
+
+    def __cinit__(self, size_t capacity):
+        self.used = 0
+        if not capacity:
+            return
+        self.data = <char*> PyMem_Malloc(capacity)
+        if not self.data:
+            raise MemoryError()
+        self.capacity = capacity
+        track_alloc(O_ARENA, capacity)
+
+    def __dealloc__(self):
+        if self.capacity:
+            PyMem_Free(self.data)
+            track_free(O_ARENA, self.capacity)
+
+    cdef SoundBuffer take(
+        self,
+        size_t n_frames,
+        char fmt,
+        uint32_t sample_rate,
+        uint32_t channels=1
+    ):
+        """Allocate an uninitialised sound from the arena."""
+        cdef SoundBuffer buf
+        cdef size_t size = n_frames * channels * format_size(fmt)
+        # Keep every sound aligned for any sample format
+        cdef size_t offset = (self.used + 15) & ~(<size_t> 15)
+
+        if offset + size > self.capacity:
+            raise MemoryError(
+                f"SoundArena is full ({size} bytes requested, "
+                f"{self.capacity - min(offset, self.capacity)} free)"
+            )
+
+        buf = SoundBuffer.__new__(
+            SoundBuffer, 0, chr(fmt), sample_rate, channels
+        )
+        PyObject_GetBuffer(self, &buf.view, 0)
+        buf.has_view = True
+        buf.data = self.data + offset
+        buf.set_length(n_frames * channels)
+        self.used = offset + size
+        return buf
+
+    def alloc(
+        self,
+        size_t n_frames,
+        str format='h',
+        uint32_t sample_rate=SAMPLE_RATE,
+        uint32_t channels=1
+    ) -> SoundBuffer:
+        """Allocate a sound of n_frames frames of silence from the arena."""
+        check_rate(sample_rate)
+        if channels == 0:
+            raise ValueError("channels must be at least 1")
+        cdef SoundBuffer buf = self.take(
+            n_frames, parse_format(format), sample_rate, channels
+        )
+        fill_silence(buf.data, buf.fmt, buf.n_samples)
+        return buf
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        buffer.buf = self.data
+        buffer.format = 'B'
+        buffer.internal = NULL
+        buffer.itemsize = 1
+        buffer.len = self.used
+        buffer.ndim = 1
+        buffer.obj = self
+        buffer.readonly = 0
+        self.shape[0] = self.used
+        buffer.shape = self.shape
+        buffer.strides = NULL
+        buffer.suboffsets = NULL
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+
+cdef SoundBuffer new_buffer(
+    int origin,
+    SoundArena arena,
+    size_t n_frames,
+    char fmt,
+    uint32_t sample_rate,
+    uint32_t channels=1
+):
+    """Allocate an uninitialised sound, from arena if it is not None.
+
+    Otherwise, the memory is accounted to origin in memory_stats().
+    """
+    cdef SoundBuffer buf
+    if arena is not None:
+        return arena.take(n_frames, fmt, sample_rate, channels)
+    buf = SoundBuffer.__new__(
+        SoundBuffer, 0, chr(fmt), sample_rate, channels
+    )
+    buf.set_length(n_frames * channels)
+    if buf.n_samples:
+        buf.allocate(origin)
+    return buf
+
+
+cdef struct ADSR:
+    # Durations of each phase of the envelope, in samples
+    uint32_t attack, decay, sustain, release
+
+
+cdef inline uint64_t tone_omega(double pitch, uint32_t sample_rate) noexcept nogil:
+    """Get the angular velocity for a tone of the given pitch.
+
+    time and omega are fixed point with a 32-bit fractional part so that we
+    can track time within the sample with simple integer addition.
+
+    High accuracy is needed because single-bit rounding errors add up over
+    tens of thousands of samples.
+    """
+    return <uint64_t> (pitch * 1024.0 / sample_rate * 4294967296.0)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline void tone_segment(
+    const int16_t *wavetable,
+    uint64_t *time,
+    uint64_t omega,
+    sample_t *out,
+    uint32_t n,
+    float amplitude,
+    float slope,
+    bint add,
+) noexcept nogil:
+    """Render n samples of a tone whose amplitude changes linearly.
+
+    If add is true, out must be a float accumulator; the tone is added to it
+    on the scale of 16-bit samples.
+    """
+    cdef uint64_t t = time[0]
+    cdef uint32_t i
+    cdef float v
+    if sample_t is float and add:
+        for i in range(n):
+            t += omega
+            out[i] += (amplitude + i * slope) * wavetable[(t >> 32) & 1023]
+        time[0] = t
+        return
+    for i in range(n):
+        t += omega
+        v = (amplitude + i * slope) * wavetable[(t >> 32) & 1023]
+        if sample_t is int16_t:
+            out[i] = <int16_t> v
+        else:
+            store(out, i, v / AMPLITUDE)
+    time[0] = t
+
+
+@cython.cdivision(True)
+cdef void tone_render(
+    const int16_t *wavetable,
+    uint64_t omega,
+    const ADSR *env,
+    sample_t *out,
+    bint add=False,
+) noexcept nogil:
+    """Render a tone into out, which must have space for the whole envelope.
+
+    Each phase of the envelope is rendered as a separate loop, so that the
+    inner loops don't branch.
+    """
+    cdef uint64_t time = 0
+
+    if env.attack:
+        tone_segment(
+            wavetable, &time, omega, out, env.attack,
+            0.0, 1.0 / env.attack, add
+        )
+    out += env.attack
+    if env.decay:
+        tone_segment(
+            wavetable, &time, omega, out, env.decay,
+            1.0, -0.3 / env.decay, add
+        )
+    out += env.decay
+    tone_segment(wavetable, &time, omega, out, env.sustain, 0.7, 0.0, add)
+    out += env.sustain
+    if env.release:
+        tone_segment(
+            wavetable, &time, omega, out, env.release,
+            0.7, -0.7 / env.release, add
+        )
+
+
+cdef void tone_render_any(
+    const int16_t *wavetable,
+    uint64_t omega,
+    const ADSR *env,
+    void *out,
+    char fmt,
+) noexcept nogil:
+    if fmt == c'h':
+        tone_render(wavetable, omega, env, <int16_t*> out)
+    elif fmt == c'f':
+        tone_render(wavetable, omega, env, <float*> out)
+    else:
+        tone_render(wavetable, omega, env, <uint8_t*> out)
+
+
+def tone(
+    Wavetable wavetable,
+    double pitch=440.0,  # Hz, default = A
+    uint32_t attack=4000,
+    uint32_t decay=4000,
+    uint32_t sustain=30000,
+    uint32_t release=20000,
+    str format='h',
+    uint32_t sample_rate=SAMPLE_RATE,
+    SoundArena arena=None,
+):
+    cdef ADSR env = ADSR(attack, decay, sustain, release)
+    cdef uint64_t omega
+    cdef SoundBuffer t
+
+    cdef int64_t start = perf_counter_ns(), ns
+
+    check_rate(sample_rate)
+    t = new_buffer(
+        K_TONE,
+        arena,
+        attack + decay + sustain + release,
+        parse_format(format),
+        sample_rate
+    )
+    omega = tone_omega(pitch, sample_rate)
+    with nogil:
+        tone_render_any(wavetable.wavetable, omega, &env, t.data, t.fmt)
+
+    ns = record_render(K_TONE, start, t.n_samples)
+    if render_hook is not None:
+        call_render_hook(K_TONE, ns, t.n_samples, {
+            'pitch': pitch,
+            'attack': attack,
+            'decay': decay,
+            'sustain': sustain,
+            'release': release,
+            'sample_rate': sample_rate,
+        })
+    return t
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def tones(
+    Wavetable wavetable,
+    pitches,
+    uint32_t attack=4000,
+    uint32_t decay=4000,
+    uint32_t sustain=30000,
+    uint32_t release=20000,
+    str format='h',
+    uint32_t sample_rate=SAMPLE_RATE,
+    SoundArena arena=None,
+):
+    """Generate tones at several pitches, with the same envelope.
+
+    This is equivalent to calling tone() for each pitch, but renders all the
+    tones in a single pass without the GIL. Return a list of SoundBuffers.
+    """
+    cdef ADSR env = ADSR(attack, decay, sustain, release)
+    cdef size_t n_samples = attack + decay + sustain + release
+    cdef double[::1] freqs = array('d', pitches)
+    cdef size_t n = freqs.shape[0], i
+    cdef uint64_t *omegas
+    cdef void **outputs
+    cdef char fmt = parse_format(format)
+    cdef SoundBuffer t
+    cdef int64_t start = perf_counter_ns(), ns
+
+    check_rate(sample_rate)
+    if n == 0:
+        return []
+
+    omegas = <uint64_t*> PyMem_Malloc(n * sizeof(uint64_t))
+    outputs = <void**> PyMem_Malloc(n * sizeof(void*))
+    try:
+        if not (omegas and outputs):
+            raise MemoryError()
+
+        buffers = []
+        for i in range(n):
+            omegas[i] = tone_omega(freqs[i], sample_rate)
+            t = new_buffer(K_TONE, arena, n_samples, fmt, sample_rate)
+            outputs[i] = t.data
+            buffers.append(t)
+
+        with nogil:
+            for i in range(n):
+                tone_render_any(
+                    wavetable.wavetable, omegas[i], &env, outputs[i], fmt
+                )
+    finally:
+        PyMem_Free(omegas)
+        PyMem_Free(outputs)
+
+    ns = record_render(K_TONE, start, n * n_samples, n)
+    if render_hook is not None:
+        call_render_hook(K_TONE, ns, n * n_samples, {
+            'pitches': list(freqs),
+            'attack': attack,
+            'decay': decay,
+            'sustain': sustain,
+            'release': release,
+            'sample_rate': sample_rate,
+        })
+    return buffers
+
+
+cdef struct Note:
+    size_t start
+    uint64_t omega
+    ADSR env
+    const int16_t *wavetable
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def sequence(
+    notes,
+    Wavetable wavetable,
+    str format='h',
+    uint32_t sample_rate=SAMPLE_RATE,
+    float gain=1.0,
+):
+    """Render a sequence of notes into a single sound.
+
+    notes is a list of (start, pitch, attack, decay, sustain, release,
+    wavetable) tuples, with the start time and envelope in samples. A note
+    whose wavetable is None uses the given wavetable.
+
+    All the notes are rendered into one accumulator without the GIL, so
+    overlapping notes are summed; the result is scaled by gain and clipped
+    only once.
+    """
+    cdef size_t n, i, n_frames = 0
+    cdef Note *c_notes = NULL
+    cdef float *acc = NULL
+    cdef Wavetable w
+    cdef SoundBuffer s
+    cdef int64_t start = perf_counter_ns(), ns
+
+    check_rate(sample_rate)
+    notes = list(notes)  # keep the wavetables alive while we render
+    n = len(notes)
+    try:
+        c_notes = <Note*> PyMem_Malloc(n * sizeof(Note))
+        if not c_notes and n:
+            raise MemoryError()
+        for i, (offset, pitch, attack, decay, sustain, release, w) in (
+            enumerate(notes)
+        ):
+            if w is None:
+                w = wavetable
+            c_notes[i].start = offset
+            c_notes[i].omega = tone_omega(pitch, sample_rate)
+            c_notes[i].env = ADSR(attack, decay, sustain, release)
+            c_notes[i].wavetable = w.wavetable
+            n_frames = max(
+                n_frames,
+                c_notes[i].start + c_notes[i].env.attack
+                + c_notes[i].env.decay + c_notes[i].env.sustain
+                + c_notes[i].env.release
+            )
+
+        s = new_buffer(
+            K_SEQUENCE, None, n_frames, parse_format(format), sample_rate
+        )
+        acc = <float*> PyMem_Malloc(n_frames * sizeof(float))
+        if not acc and n_frames:
+            raise MemoryError()
+
+        with nogil:
+            memset(acc, 0, n_frames * sizeof(float))
+            for i in range(n):
+                tone_render(
+                    c_notes[i].wavetable,
+                    c_notes[i].omega,
+                    &c_notes[i].env,
+                    acc + c_notes[i].start,
+                    True
+                )
+            if gain != 1.0:
+                for i in range(n_frames):
+                    acc[i] *= gain
+            quantise_any(acc, s.data, s.fmt, n_frames)
+    finally:
+        PyMem_Free(c_notes)
+        PyMem_Free(acc)
+
+    ns = record_render(K_SEQUENCE, start, n_frames)
+    if render_hook is not None:
+        call_render_hook(K_SEQUENCE, ns, n_frames, {
+            'notes': n,
+            'sample_rate': sample_rate,
+        })
+    return s
+
+
+cdef struct SFXParams:
+    int wave_type
+    float base_freq
+    float freq_limit
+    float freq_ramp
+    float freq_dramp
+    float duty
+    float duty_ramp
+    float vib_strength
+    float vib_speed
+    float vib_delay
+    float env_attack
+    float env_sustain
+    float env_decay
+    float env_punch
+    float lpf_resonance
+    float lpf_freq
+    float lpf_ramp
+    float hpf_freq
+    float hpf_ramp
+    float pha_offset
+    float pha_ramp
+    float repeat_speed
+    float arp_speed
+    float arp_mod
+    uint64_t seed
+    uint32_t sample_rate
+    uint32_t oversample
+
+
+cdef inline double sfx_timescale(const SFXParams *p) noexcept nogil:
+    """Get the duration of a sample, relative to a sample at 44100Hz.
+
+    The sfxr algorithm was designed for 44100Hz; its time constants are
+    scaled by this factor to render at other sample rates.
+    """
+    return <double> SAMPLE_RATE / p.sample_rate
+
+
+cdef inline double sfx_subscale(const SFXParams *p) noexcept nogil:
+    """Get the duration of a supersample, relative to one of 8x at 44100Hz."""
+    return sfx_timescale(p) * 8.0 / p.oversample
+
+
+cdef inline bint sfx_rescaled(const SFXParams *p) noexcept nogil:
+    """Return True if time constants need scaling to render with params p."""
+    return p.sample_rate != SAMPLE_RATE or p.oversample != 8
+
+
+cdef int check_sfx_params(const SFXParams *p) except -1:
+    """Validate the render settings in p."""
+    check_rate(p.sample_rate)
+    if p.oversample not in (1, 2, 4, 8):
+        raise ValueError("oversample must be 1, 2, 4 or 8")
+    return 0
+
+
+cdef enum:
+    # A packed SFX parameter vector has the float parameters in the order
+    # of SFXParams, then wave_type, seed, sample_rate and oversample as
+    # 64-bit unsigned ints
+    N_FLOAT_PARAMS = 23
+    N_INT_PARAMS = 4
+
+
+cdef void unpack_params(
+    SFXParams *p,
+    const double **floats,
+    const uint64_t **ints,
+    size_t i
+) noexcept nogil:
+    """Fill p from entry i of columns of packed parameters."""
+    p.base_freq = floats[0][i]
+    p.freq_limit = floats[1][i]
+    p.freq_ramp = floats[2][i]
+    p.freq_dramp = floats[3][i]
+    p.duty = floats[4][i]
+    p.duty_ramp = floats[5][i]
+    p.vib_strength = floats[6][i]
+    p.vib_speed = floats[7][i]
+    p.vib_delay = floats[8][i]
+    p.env_attack = floats[9][i]
+    p.env_sustain = floats[10][i]
+    p.env_decay = floats[11][i]
+    p.env_punch = floats[12][i]
+    p.lpf_resonance = floats[13][i]
+    p.lpf_freq = floats[14][i]
+    p.lpf_ramp = floats[15][i]
+    p.hpf_freq = floats[16][i]
+    p.hpf_ramp = floats[17][i]
+    p.pha_offset = floats[18][i]
+    p.pha_ramp = floats[19][i]
+    p.repeat_speed = floats[20][i]
+    p.arp_speed = floats[21][i]
+    p.arp_mod = floats[22][i]
+    p.wave_type = <int> ints[0][i]
+    p.seed = ints[1][i]
+    p.sample_rate = <uint32_t> ints[2][i]
+    p.oversample = <uint32_t> ints[3][i]
+
+
+cdef inline double rescale_decay(double x, double k) noexcept nogil:
+    """Rescale a coefficient x that decays a value each step.
+
+    Return the coefficient that has the same effect over a step that is k
+    times as long.
+    """
+    return 1.0 - pow(1.0 - x, k)
+
+
+cdef inline int env_samples(float x, const SFXParams *p) noexcept nogil:
+    """Get the length in samples of an envelope stage with duration param x."""
+    cdef int n = <int> (x * x * 100000.0)
+    if p.sample_rate != SAMPLE_RATE:
+        n = <int> (n / sfx_timescale(p))
+    return n
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+@cython.cdivision(True)
+cdef void reset_sample(
+    const SFXParams *p,
+    double *fperiod,
+    int *period,
+    double *fmaxperiod,
+    double *fslide,
+    double *fdslide,
+    float *square_duty,
+    float *square_slide,
+    double *arp_mod,
     int *arp_time,
     int *arp_limit
-) nogil:
-    fperiod[0] = 100.0 / (p_base_freq * p_base_freq + 0.001)
+) noexcept nogil:
+    fperiod[0] = 100.0 / (p.base_freq * p.base_freq + 0.001)
     period[0] = <int> fperiod[0]
-    fmaxperiod[0] = 100.0 / (p_freq_limit * p_freq_limit + 0.001)
-    fslide[0] = 1.0 - p_freq_ramp ** 3.0 * 0.01
-    fdslide[0] = p_freq_dramp ** 3.0 * -0.000001;
-    square_duty[0] = 0.5 - p_duty * 0.5;
-    square_slide[0] = p_duty_ramp * -0.00005;
-    if p_arp_mod >= 0.0:
-        arp_mod[0] = 1.0 - p_arp_mod ** 2.0 * 0.9
+    fmaxperiod[0] = 100.0 / (p.freq_limit * p.freq_limit + 0.001)
+    fslide[0] = 1.0 - p.freq_ramp ** 3.0 * 0.01
+    fdslide[0] = p.freq_dramp ** 3.0 * -0.000001;
+    square_duty[0] = 0.5 - p.duty * 0.5;
+    square_slide[0] = p.duty_ramp * -0.00005;
+    if p.arp_mod >= 0.0:
+        arp_mod[0] = 1.0 - p.arp_mod ** 2.0 * 0.9
     else:
-        arp_mod[0] = 1.0 + p_arp_mod ** 2.0 * 10.0
+        arp_mod[0] = 1.0 + p.arp_mod ** 2.0 * 10.0
     arp_time[0] = 0
-    arp_limit[0] = <int> (((1.0 - p_arp_speed) ** 2.0) * 20000 + 32)
-    if p_arp_speed == 1.0:
+    arp_limit[0] = <int> (((1.0 - p.arp_speed) ** 2.0) * 20000 + 32)
+    if p.arp_speed == 1.0:
         arp_limit[0] = 0
 
+    cdef double k, ks
+    if sfx_rescaled(p):
+        # Periods are measured in supersamples
+        k = sfx_timescale(p)
+        ks = sfx_subscale(p)
+        fperiod[0] /= ks
+        period[0] = <int> fperiod[0]
+        fmaxperiod[0] /= ks
+        fslide[0] = pow(fslide[0], k)
+        fdslide[0] *= k * k
+        square_slide[0] *= k
+        arp_limit[0] = <int> (arp_limit[0] / k)
 
-from cython cimport floating
 
+@cython.boundscheck(False)
+cdef void fill_noise(Rng *rng, float *noise_buffer) noexcept nogil:
+    for i in range(32):
+        noise_buffer[i] = frnd(rng, 2.0) - 1.0
 
-cdef void clamp(floating *v, floating min, floating max) nogil:
-    """Clamp the given value v to between min and max."""
-    if v[0] < min:
-        v[0] = min
-    elif v[0] > max:
-        v[0] = max
 
+@cython.cdivision(True)
+cdef float frnd(Rng *rng, float range_) noexcept nogil:
+    return <float> (rng_next(rng) % 10001) / 10000 * range_
 
-@cython.boundscheck(False)
-cdef void fill_noise(float *noise_buffer) nogil:
-    for i in range(32):
-        noise_buffer[i] = frnd(2.0) - 1.0
+
+cdef struct SFXState:
+    # Oscillator
+    int phase, period
+    double fperiod, fmaxperiod, fslide, fdslide, arp_mod
+    float square_duty, square_slide
+    float noise_buffer[32]
+    Rng rng
+
+    # The wavetable for wave type 4, or NULL
+    const int16_t *wavetable
+
+    # Envelope
+    int env_stage, env_time
+    int env_length[3]
+    float env_vol
+
+    # Filters
+    float fltp, fltdp, fltphp
+    float fltw, fltw_d, fltdmp, flthp, flthp_d
+    float fltw_max, flthp_min, flthp_max
+
+    # Vibrato
+    float vib_phase, vib_speed, vib_amp
+
+    # Phaser
+    float fphase, fdphase
+    int iphase, ipp
+    float phaser_buffer[1024]
+
+    # Repeat and arpeggio
+    int rep_time, rep_limit, arp_time, arp_limit
+
+    # Position in the output, and the maximum length of the output
+    size_t pos, length
+    bint done
+
+
+cdef size_t sfx_length(const SFXParams *p) noexcept nogil:
+    """Get the maximum number of samples that sfx_render() will generate."""
+    return (
+        env_samples(p.env_attack, p)
+        + env_samples(p.env_sustain, p)
+        + env_samples(p.env_decay, p)
+    )
 
 
 @cython.cdivision(True)
-cdef float frnd(float range_) nogil:
-    return <float> (rand() % 10001) / 10000 * range_
+cdef void sfx_reset(
+    SFXState *s,
+    const SFXParams *p,
+    const int16_t *wavetable
+) noexcept nogil:
+    """Initialise the synthesis state s to render a sound with params p.
+
+    wavetable is the waveform for wave type 4; it must remain valid while
+    the sound is rendered.
+    """
+    cdef size_t i
+    cdef double k = sfx_timescale(p), ks = sfx_subscale(p)
+
+    s.phase = 0
+    s.wavetable = wavetable
+    reset_sample(
+        p,
+        &s.fperiod,
+        &s.period,
+        &s.fmaxperiod,
+        &s.fslide,
+        &s.fdslide,
+        &s.square_duty,
+        &s.square_slide,
+        &s.arp_mod,
+        &s.arp_time,
+        &s.arp_limit
+    )
+
+    # reset filter
+    s.fltp = s.fltdp = s.fltphp = 0.0
+    s.fltw = 0.1 * p.lpf_freq ** 3.0
+    s.fltw_d = 1.0 + p.lpf_ramp * 0.0001
+    s.fltdmp = 5.0 / (1.0 + p.lpf_resonance ** 2.0 * 20.0) * (0.01 + s.fltw)
+    clamp(&s.fltdmp, 0.0, 0.8)
+
+    s.fltw_max = 0.1
+
+    s.flthp = 0.1 * p.hpf_freq ** 2.0
+    s.flthp_d = 1.0 + p.hpf_ramp * 0.0003;
+    s.flthp_min = 0.00001
+    s.flthp_max = 0.1
+
+    # reset vibrato
+    s.vib_phase = 0.0;
+    s.vib_speed = p.vib_speed ** 2.0 * 0.01;
+    s.vib_amp = p.vib_strength * 0.5;
+
+    # reset envelope
+    s.env_vol = 0.0;
+    s.env_stage = 0;
+    s.env_time = 0;
+    s.env_length[0] = env_samples(p.env_attack, p)
+    s.env_length[1] = env_samples(p.env_sustain, p)
+    s.env_length[2] = env_samples(p.env_decay, p)
+
+    s.fphase = p.pha_offset ** 2.0 * 1020.0;
+    if p.pha_offset < 0.0:
+        s.fphase = -s.fphase
+    s.fdphase = p.pha_ramp ** 2.0
+    if p.pha_ramp < 0.0:
+        s.fdphase = -s.fdphase
+    s.ipp = 0
+    for i in range(1024):
+        s.phaser_buffer[i] = 0.0
+
+    # Fill noise buffer
+    rng_seed(&s.rng, p.seed)
+    fill_noise(&s.rng, s.noise_buffer)
+
+    # reset repeats
+    s.rep_time = 0
+    s.rep_limit = <int> ((1.0 - p.repeat_speed) ** 2.0) * 20000 + 32
+    if p.repeat_speed == 0.0:
+        s.rep_limit = 0
+
+    if sfx_rescaled(p):
+        # Each sample covers k times as much time as at 44100Hz, and each
+        # supersample ks times as much as at 8x supersampling. The filters
+        # step once per supersample, except for the high-pass ramp. The
+        # phaser offset is measured in supersamples, but ramps per sample.
+        s.fltw *= ks
+        s.fltw_max *= ks
+        s.fltw_d = pow(s.fltw_d, ks)
+        s.fltdmp = rescale_decay(s.fltdmp, ks)
+        s.flthp = rescale_decay(s.flthp, ks)
+        s.flthp_d = pow(s.flthp_d, k)
+        s.flthp_min = rescale_decay(s.flthp_min, ks)
+        s.flthp_max = rescale_decay(s.flthp_max, ks)
+        s.vib_speed *= k
+        s.fphase /= ks
+        s.fdphase *= k / ks
+        s.rep_limit = <int> (s.rep_limit / k)
+    s.iphase = abs(<int> s.fphase)
+
+    s.pos = 0
+    s.length = sfx_length(p)
+    s.done = s.length == 0
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
 @cython.cdivision(True)
+cdef size_t sfx_render(
+    SFXState *s,
+    const SFXParams *p,
+    sample_t *out,
+    size_t n_samples
+) noexcept nogil:
+    """Continue rendering a sound effect with parameters p into out.
+
+    Up to n_samples samples are written to out; the number written is
+    returned. If this is fewer than n_samples then the sound has finished and
+    s.done is set; the rest of out is left untouched.
+
+    The state is loaded into locals for the duration of the call so that the
+    compiler can keep it in registers.
+
+    """
+    cdef int phase = s.phase, period = s.period
+    cdef double fperiod = s.fperiod, fmaxperiod = s.fmaxperiod
+    cdef double fslide = s.fslide, fdslide = s.fdslide, arp_mod = s.arp_mod
+    cdef float square_duty = s.square_duty, square_slide = s.square_slide
+    cdef int env_stage = s.env_stage, env_time = s.env_time
+    cdef float env_vol = s.env_vol
+    cdef float fltp = s.fltp, fltdp = s.fltdp, fltphp = s.fltphp
+    cdef float fltw = s.fltw, fltw_d = s.fltw_d, fltdmp = s.fltdmp
+    cdef float flthp = s.flthp, flthp_d = s.flthp_d
+    cdef float fltw_max = s.fltw_max
+    cdef float flthp_min = s.flthp_min, flthp_max = s.flthp_max
+    cdef float vib_phase = s.vib_phase
+    cdef float vib_speed = s.vib_speed, vib_amp = s.vib_amp
+    cdef float fphase = s.fphase, fdphase = s.fdphase
+    cdef int iphase = s.iphase, ipp = s.ipp
+    cdef int rep_time = s.rep_time, rep_limit = s.rep_limit
+    cdef int arp_time = s.arp_time, arp_limit = s.arp_limit
+    cdef int *env_length = s.env_length
+    cdef float *phaser_buffer = s.phaser_buffer
+    cdef float *noise_buffer = s.noise_buffer
+    cdef const int16_t *wavetable = s.wavetable
+    cdef float rfperiod
+    cdef float ssample = 0.0, sample = 0.0, fp, pp
+    cdef int si, oversample = p.oversample
+    cdef float gain = 1.0 / oversample
+    cdef size_t i = 0
+
+    if s.done:
+        return 0
+
+    n_samples = min(n_samples, s.length - s.pos)
+    while i < n_samples:
+        rep_time += 1
+
+        if rep_limit and rep_time >= rep_limit:
+            rep_time = 0
+            reset_sample(
+                p,
+                &fperiod,
+                &period,
+                &fmaxperiod,
+                &fslide,
+                &fdslide,
+                &square_duty,
+                &square_slide,
+                &arp_mod,
+                &arp_time,
+                &arp_limit
+            )
+
+        # frequency envelopes/arpeggios
+        arp_time += 1
+        if 0 != arp_limit < arp_time:
+            arp_limit = 0
+            fperiod *= arp_mod
+
+        fslide += fdslide
+        fperiod *= fslide
+        if fperiod > fmaxperiod:
+            fperiod = fmaxperiod
+            if p.freq_limit > 0.0:
+                s.done = True
+                break
+
+        rfperiod = fperiod
+        if vib_amp > 0.0:
+            vib_phase += vib_speed
+            rfperiod = fperiod * (
+                1.0 + sine_turns(vib_phase * (0.5 / pi)) * vib_amp
+            )
+
+        period = <int> rfperiod
+        if period < oversample:
+            period = oversample
+        square_duty += square_slide
+        clamp(&square_duty, 0.0, 0.5)
+
+        # volume envelope
+        env_time += 1
+        if env_time > env_length[env_stage]:
+            env_time = 0
+            env_stage += 1
+            if env_stage == 3:
+                s.done = True
+                break
+
+        if env_stage == 0:
+            env_vol = <float> env_time / env_length[0]
+        elif env_stage == 1:
+            # TODO: removed a pow(1.0 - x / y, 1.0) here. Why?
+            env_vol = 1.0 + (1.0 - <float> env_time / env_length[1]) * 2.0 * p.env_punch
+        elif env_stage == 2:
+            env_vol = 1.0 - <float> env_time / env_length[2]
+
+        # phaser step
+        fphase += fdphase;
+        iphase = abs(<int> fphase)
+        if iphase > 1023:
+            iphase = 1023
+
+        if flthp_d != 0.0:
+            flthp *= flthp_d
+            clamp(&flthp, flthp_min, flthp_max)
+
+        ssample = 0.0
+        for si in range(oversample):  # supersampling, 8x by default
+            sample = 0.0
+            phase += 1
+            if phase >= period:
+                phase %= period
+                if p.wave_type == 3:
+                    fill_noise(&s.rng, noise_buffer)
+
+            # base waveform
+            fp = <float> phase / period;
+            if p.wave_type == 0:  # square
+                sample = 0.5 if fp < square_duty else -0.5
+            elif p.wave_type == 1:  # sawtooth
+                sample = 1.0 - fp * 2
+            elif p.wave_type == 2:  # sine
+                sample = sine_phase(fp)
+            elif p.wave_type == 3:  # noise
+                sample = noise_buffer[<size_t> (phase * 32 / period)]
+            elif p.wave_type == 4:  # wavetable
+                sample = wavetable_at(wavetable, fp)
+
+            # lp filter
+            pp = fltp
+            fltw *= fltw_d
+            clamp(&fltw, 0.0, fltw_max)
+            if p.lpf_freq != 1.0:
+                fltdp += (sample - fltp) * fltw;
+                fltdp -= fltdp * fltdmp;
+                fltp += fltdp
+            else:
+                fltp = sample
+                fltdp = 0.0
+
+            # hp filter
+            fltphp += fltp - pp;
+            fltphp -= fltphp * flthp;
+            sample = fltphp;
+
+            # phaser
+            phaser_buffer[ipp & 1023] = sample
+            sample += phaser_buffer[(ipp - iphase + 1024) & 1023]
+            ipp = (ipp + 1) & 1023
+
+            # final accumulation and envelope application
+            ssample += sample * env_vol
+
+        ssample *= gain
+        clamp(&ssample, -1.0, 1.0)
+        store(out, i, ssample)
+        i += 1
+
+    s.phase = phase
+    s.period = period
+    s.fperiod = fperiod
+    s.fmaxperiod = fmaxperiod
+    s.fslide = fslide
+    s.fdslide = fdslide
+    s.arp_mod = arp_mod
+    s.square_duty = square_duty
+    s.square_slide = square_slide
+    s.env_stage = env_stage
+    s.env_time = env_time
+    s.env_vol = env_vol
+    s.fltp = fltp
+    s.fltdp = fltdp
+    s.fltphp = fltphp
+    s.fltw = fltw
+    s.flthp = flthp
+    s.vib_phase = vib_phase
+    s.fphase = fphase
+    s.iphase = iphase
+    s.ipp = ipp
+    s.rep_time = rep_time
+    s.arp_time = arp_time
+    s.arp_limit = arp_limit
+
+    s.pos += i
+    if s.pos >= s.length:
+        s.done = True
+    return i
+
+
+cdef size_t sfx_render_any(
+    SFXState *s,
+    const SFXParams *p,
+    void *out,
+    char fmt,
+    size_t n_samples
+) noexcept nogil:
+    if fmt == c'h':
+        return sfx_render(s, p, <int16_t*> out, n_samples)
+    elif fmt == c'f':
+        return sfx_render(s, p, <float*> out, n_samples)
+    else:
+        return sfx_render(s, p, <uint8_t*> out, n_samples)
+
+
+cdef size_t sfx_render_padded(
+    SFXState *s,
+    const SFXParams *p,
+    void *out,
+    char fmt,
+    size_t n_samples
+) noexcept nogil:
+    """Render n_samples samples, filling with silence after the sound ends.
+
+    Return the number of samples of the sound that were written.
+    """
+    cdef size_t written = sfx_render_any(s, p, out, fmt, n_samples)
+    fill_silence(
+        <char*> out + written * format_size(fmt), fmt, n_samples - written
+    )
+    return written
+
+
+cdef Wavetable sfx_wavetable(int wave_type, wavetable):
+    """Get the wavetable to render a sound effect of the given wave type."""
+    if wave_type != 4:
+        return None
+    if wavetable is None:
+        raise ValueError("wave_type 4 requires a wavetable")
+    return as_wavetable(wavetable)
+
+
 def sfx(
     int wave_type=0,
     float p_base_freq=0.3,
@@ -414,312 +2364,1325 @@ def sfx(
     float p_repeat_speed=0.0,
     float p_arp_speed=0.0,
     float p_arp_mod=0.0,
+    seed=None,
+    str format='h',
+    uint32_t sample_rate=SAMPLE_RATE,
+    SoundArena arena=None,
+    wavetable=None,
+    uint32_t oversample=8,
 ):
-    cdef int phase=0, period, env_stage, env_time, iphase, ipp
-    cdef double fperiod, fmaxperiod, fslide, fdslide, arp_mod
-    cdef float square_duty, square_slide, env_vol, fphase, fdphase
-    cdef int env_length[3]
-    cdef float phaser_buffer[1024]
-    cdef float noise_buffer[32]
-    cdef float fltp = 0.0, fltdp = 0.0, fltphp = 0.0
-    cdef float fltw, fltw_d, fltdmp, flthp, flthp_d, vib_phase, vib_speed, vib_amp
-    cdef int rep_time, rep_limit, arp_time, arp_limit
-    cdef float rfperiod
-    cdef float ssample = 0.0, sample = 0.0, fp, pp
-    cdef int si, ni
+    """Generate a sound effect using the sfxr algorithm.
 
-    reset_sample(
-        p_base_freq,
-        p_freq_limit,
-        p_freq_ramp,
-        p_freq_dramp,
-        p_duty,
-        p_duty_ramp,
-        p_arp_mod,
-        p_arp_speed,
-
-        &fperiod,
-        &period,
-        &fmaxperiod,
-        &fslide,
-        &fdslide,
-        &square_duty,
-        &square_slide,
-        &arp_mod,
-        &arp_time,
-        &arp_limit
-    )
+    seed seeds the random number generator used for noise; the same
+    parameters and seed always generate the same sound. If it is None, a
+    random seed is used.
 
-    # reset filter
-    fltw = 0.1 * p_lpf_freq ** 3.0
-    fltw_d = 1.0 + p_lpf_ramp * 0.0001
-    fltdmp = 5.0 / (1.0 + p_lpf_resonance ** 2.0 * 20.0) * (0.01 + fltw)
-    clamp(&fltdmp, 0.0, 0.8)
+    format is the sample format of the generated SoundBuffer, and
+    sample_rate its sample rate. The sound has the same duration and
+    pitch at any sample rate. If arena is given, the sound is allocated from
+    it.
 
-    flthp = 0.1 * p_hpf_freq ** 2.0
-    flthp_d = 1.0 + p_hpf_ramp * 0.0003;
+    wavetable is the waveform for wave_type 4: a Wavetable, or a sequence
+    of 1024 16-bit samples.
 
-    # reset vibrato
-    vib_phase = 0.0;
-    vib_speed = p_vib_speed ** 2.0 * 0.01;
-    vib_amp = p_vib_strength * 0.5;
+    oversample is the number of times each sample is supersampled: 8 (the
+    default) for full quality, or 4, 2 or 1 to render proportionally
+    faster, with more aliasing, for previews.
 
-    # reset envelope
-    env_vol = 0.0;
-    env_stage = 0;
-    env_time = 0;
-    env_length[0] = <int> (p_env_attack * p_env_attack * 100000.0);
-    env_length[1] = <int> (p_env_sustain * p_env_sustain * 100000.0);
-    env_length[2] = <int> (p_env_decay * p_env_decay * 100000.0);
+    """
+    cdef SFXParams p
+    p.wave_type = wave_type
+    p.base_freq = p_base_freq
+    p.freq_limit = p_freq_limit
+    p.freq_ramp = p_freq_ramp
+    p.freq_dramp = p_freq_dramp
+    p.duty = p_duty
+    p.duty_ramp = p_duty_ramp
+    p.vib_strength = p_vib_strength
+    p.vib_speed = p_vib_speed
+    p.vib_delay = p_vib_delay
+    p.env_attack = p_env_attack
+    p.env_sustain = p_env_sustain
+    p.env_decay = p_env_decay
+    p.env_punch = p_env_punch
+    p.lpf_resonance = p_lpf_resonance
+    p.lpf_freq = p_lpf_freq
+    p.lpf_ramp = p_lpf_ramp
+    p.hpf_freq = p_hpf_freq
+    p.hpf_ramp = p_hpf_ramp
+    p.pha_offset = p_pha_offset
+    p.pha_ramp = p_pha_ramp
+    p.repeat_speed = p_repeat_speed
+    p.arp_speed = p_arp_speed
+    p.arp_mod = p_arp_mod
+    p.seed = random_seed() if seed is None else seed
+    p.sample_rate = sample_rate
+    p.oversample = oversample
+    return render_sfx(&p, wavetable, format, arena)
+
+
+def sfx_vector(
+    floats,
+    ints,
+    wavetable=None,
+    str format='h',
+    SoundArena arena=None,
+):
+    """Generate a sound effect from a packed parameter vector.
 
-    cdef size_t n_samples = env_length[0] + env_length[1] + env_length[2];
-    cdef SoundBuffer s = SoundBuffer(n_samples)
+    floats is a buffer of the 23 float parameters of sfx() as doubles, in
+    order, and ints a buffer of wave_type, seed, sample_rate and
+    oversample as 64-bit unsigned ints. Other arguments are as for sfx().
+    """
+    cdef const double[::1] f = floats
+    cdef const uint64_t[::1] n = ints
+    cdef const double *fp[N_FLOAT_PARAMS]
+    cdef const uint64_t *ip[N_INT_PARAMS]
+    cdef size_t k
+    cdef SFXParams p
+
+    if f.shape[0] != N_FLOAT_PARAMS or n.shape[0] != N_INT_PARAMS:
+        raise ValueError(
+            f"A parameter vector has {N_FLOAT_PARAMS} floats and "
+            f"{N_INT_PARAMS} ints"
+        )
+    for k in range(N_FLOAT_PARAMS):
+        fp[k] = &f[k]
+    for k in range(N_INT_PARAMS):
+        ip[k] = &n[k]
+    unpack_params(&p, fp, ip, 0)
+    return render_sfx(&p, wavetable, format, arena)
+
+
+cdef SoundBuffer render_sfx(
+    SFXParams *p,
+    wavetable,
+    str format,
+    SoundArena arena,
+):
+    """Render the sound effect p."""
+    check_sfx_params(p)
+
+    cdef SFXState state
+    cdef Wavetable table = sfx_wavetable(p.wave_type, wavetable)
+    cdef const int16_t *table_ptr = table.wavetable if table else NULL
+    cdef int64_t start = perf_counter_ns()
+    cdef SoundBuffer s = new_buffer(
+        K_SFX, arena, sfx_length(p), parse_format(format), p.sample_rate
+    )
 
     with nogil:
-        fphase = p_pha_offset ** 2.0 * 1020.0;
-        if p_pha_offset < 0.0:
-            fphase = -fphase
-        fdphase = p_pha_ramp ** 2.0
-        if p_pha_ramp < 0.0:
-            fdphase = -fdphase
-        iphase = abs(<int> fphase)
-        ipp = 0
-        for i in range(1024):
-            phaser_buffer[i] = 0.0
-
-        # Fill noise buffer
-        fill_noise(noise_buffer)
-
-        # reset repeats
-        rep_time = 0
-        rep_limit = <int> ((1.0 - p_repeat_speed) ** 2.0) * 20000 + 32
-        if p_repeat_speed == 0.0:
-            rep_limit = 0
-
-        for i in range(n_samples):
-            rep_time += 1
-
-            if rep_limit and rep_time >= rep_limit:
-                rep_time = 0
-                reset_sample(
-                    p_base_freq,
-                    p_freq_limit,
-                    p_freq_ramp,
-                    p_freq_dramp,
-                    p_duty,
-                    p_duty_ramp,
-                    p_arp_mod,
-                    p_arp_speed,
-
-                    &fperiod,
-                    &period,
-                    &fmaxperiod,
-                    &fslide,
-                    &fdslide,
-                    &square_duty,
-                    &square_slide,
-                    &arp_mod,
-                    &arp_time,
-                    &arp_limit
+        sfx_reset(&state, p, table_ptr)
+        sfx_render_padded(&state, p, s.data, s.fmt, s.n_samples)
+    record_sfx_render(p, start, s.n_samples)
+    return s
+
+
+cdef void record_sfx_render(
+    const SFXParams *p,
+    int64_t start,
+    size_t n_samples
+) except *:
+    """Count a render of the sound effect p."""
+    cdef int64_t ns = record_render(K_SFX, start, n_samples)
+    if render_hook is not None:
+        call_render_hook(K_SFX, ns, n_samples, p[0])
+
+
+cdef class SFXRenderer:
+    """Render a sound effect incrementally, a block at a time.
+
+    This allows playback to begin before the whole sound has been generated,
+    and avoids holding the whole sound in memory.
+
+    params is a dict giving every parameter of the sound, as for sfx_batch().
+
+    """
+    cdef SFXParams params
+    cdef SFXState state
+    cdef Wavetable wavetable
+
+    def __init__(self, params):
+        self.params = params
+        check_sfx_params(&self.params)
+        self.wavetable = sfx_wavetable(
+            self.params.wave_type, params.get('wavetable')
+        )
+        self.reset()
+
+    def reset(self):
+        """Rewind to the start of the sound."""
+        sfx_reset(
+            &self.state,
+            &self.params,
+            self.wavetable.wavetable if self.wavetable else NULL
+        )
+
+    @property
+    def done(self) -> bool:
+        """True if the sound has been rendered to the end."""
+        return self.state.done
+
+    @property
+    def position(self) -> int:
+        """The number of samples rendered so far."""
+        return self.state.pos
+
+    def __len__(self):
+        """Get the maximum length of the sound, in samples.
+
+        The sound may end earlier than this.
+        """
+        return self.state.length
+
+    def render_into(self, buffer, n_frames=None) -> int:
+        """Render the next n_frames frames of the sound into buffer.
+
+        buffer may be any writable, contiguous, mono buffer of samples in
+        one of the SoundBuffer formats, such as a mono SoundBuffer; as sound
+        effects are mono, each frame is a single sample. If n_frames is not
+        given, fill the whole buffer.
+
+        Return the number of frames written. If this is less than n_frames,
+        the sound has finished, and the remainder of the block is filled
+        with silence.
+
+        """
+        cdef Py_buffer view
+        cdef size_t n, size, written
+        cdef char fmt
+
+        if isinstance(buffer, SoundBuffer) and buffer.channels != 1:
+            raise ValueError("SFXRenderer can only render into mono buffers")
+        PyObject_GetBuffer(
+            buffer,
+            &view,
+            PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS | PyBUF_FORMAT
+        )
+        try:
+            if view.ndim > 1:
+                raise ValueError(
+                    "SFXRenderer can only render into 1D mono buffers"
+                )
+            fmt = buffer_format(&view)
+            size = view.len // format_size(fmt)
+            n = size if n_frames is None else n_frames
+            if n > size:
+                raise ValueError(
+                    f"n_frames ({n}) is larger than the buffer ({size})"
                 )
 
-            # frequency envelopes/arpeggios
-            arp_time += 1
-            if 0 != arp_limit < arp_time:
-                arp_limit = 0
-                fperiod *= arp_mod
-
-            fslide += fdslide
-            fperiod *= fslide
-            if fperiod > fmaxperiod:
-                fperiod = fmaxperiod
-                if p_freq_limit > 0.0:
-                    break
-
-            rfperiod = fperiod
-            if vib_amp > 0.0:
-                vib_phase += vib_speed
-                rfperiod = fperiod * (1.0 + sin(vib_phase) * vib_amp)
-
-            period = <int> rfperiod
-            if period < 8:
-                period = 8
-            square_duty += square_slide
-            clamp(&square_duty, 0.0, 0.5)
-
-            # volume envelope
-            env_time += 1
-            if env_time > env_length[env_stage]:
-                env_time = 0
-                env_stage += 1
-                if env_stage == 3:
-                    break
-
-            if env_stage == 0:
-                env_vol = <float> env_time / env_length[0]
-            elif env_stage == 1:
-                # TODO: removed a pow(1.0 - x / y, 1.0) here. Why?
-                env_vol = 1.0 + (1.0 - <float> env_time / env_length[1]) * 2.0 * p_env_punch
-            elif env_stage == 2:
-                env_vol = 1.0 - <float> env_time / env_length[2]
-
-            # phaser step
-            fphase += fdphase;
-            iphase = abs(<int> fphase)
-            if iphase > 1023:
-                iphase = 1023
-
-            if flthp_d != 0.0:
-                flthp *= flthp_d
-                clamp(&flthp, 0.00001, 0.1)
-
-            ssample = 0.0
-            for si in range(8):  # 8x supersampling
-                sample = 0.0
-                phase += 1
-                if phase >= period:
-                    phase %= period
-                    if wave_type == 3:
-                        fill_noise(noise_buffer)
-
-                # base waveform
-                fp = <float> phase / period;
-                if wave_type == 0:  # square
-                    sample = 0.5 if fp < square_duty else -0.5
-                elif wave_type == 1:  # sawtooth
-                    sample = 1.0 - fp * 2
-                elif wave_type == 2:  # sine
-                    sample = <float> sin(fp * 2 * pi);
-                elif wave_type == 3:  # noise
-                    sample = noise_buffer[<size_t> (phase * 32 / period)]
-
-                # lp filter
-                pp = fltp
-                fltw *= fltw_d
-                clamp(&fltw, 0.0, 0.1)
-                if p_lpf_freq != 1.0:
-                    fltdp += (sample - fltp) * fltw;
-                    fltdp -= fltdp * fltdmp;
-                    fltp += fltdp
-                else:
-                    fltp = sample
-                    fltdp = 0.0
+            with nogil:
+                written = sfx_render_padded(
+                    &self.state, &self.params, view.buf, fmt, n
+                )
+        finally:
+            PyBuffer_Release(&view)
+        return written
 
-                # hp filter
-                fltphp += fltp - pp;
-                fltphp -= fltphp * flthp;
-                sample = fltphp;
 
-                # phaser
-                phaser_buffer[ipp & 1023] = sample
-                sample += phaser_buffer[(ipp - iphase + 1024) & 1023]
-                ipp = (ipp + 1) & 1023
+cdef class SFXBatch:
+    """A batch of sound effects to render in parallel.
 
-                # final accumulation and envelope application
-                ssample += sample * env_vol
+    Each job renders a range of the batch with the GIL released, so jobs can
+    be distributed across threads.
 
-            ssample /= 8
-            clamp(&ssample, -1.0, 1.0)
-            s.samples[i] = samp(ssample)
-    return s
+    """
+    cdef SFXParams *params
+    cdef const int16_t **tables
+    cdef void **outputs
+    cdef size_t *lengths
+    cdef int64_t *ns
+    cdef char fmt
+    cdef readonly list buffers
+
+    # References to the wavetables that tables points into
+    cdef list wavetables
+
+    def __cinit__(self, size_t n, str format='h'):
+        self.fmt = parse_format(format)
+        self.params = <SFXParams*> PyMem_Malloc(n * sizeof(SFXParams))
+        self.tables = <const int16_t**> PyMem_Malloc(n * sizeof(int16_t*))
+        self.outputs = <void**> PyMem_Malloc(n * sizeof(void*))
+        self.lengths = <size_t*> PyMem_Malloc(n * sizeof(size_t))
+        self.ns = <int64_t*> PyMem_Malloc(n * sizeof(int64_t))
+        if not (
+            self.params and self.tables and self.outputs and self.lengths
+            and self.ns
+        ):
+            raise MemoryError()
+
+        self.buffers = []
+        self.wavetables = []
+
+    cdef int prepare(self, size_t i, wavetable, SoundArena arena) except -1:
+        """Prepare to render sound i, once params[i] has been filled in.
+
+        Sounds must be prepared in order.
+        """
+        cdef Wavetable table = sfx_wavetable(
+            self.params[i].wave_type, wavetable
+        )
+        cdef SoundBuffer buf
+
+        self.tables[i] = table.wavetable if table else NULL
+        self.wavetables.append(table)
+        self.lengths[i] = sfx_length(&self.params[i])
+        check_sfx_params(&self.params[i])
+        buf = new_buffer(
+            K_SFX,
+            arena,
+            self.lengths[i],
+            self.fmt,
+            self.params[i].sample_rate
+        )
+        self.outputs[i] = buf.data
+        self.buffers.append(buf)
+        return 0
+
+    def __dealloc__(self):
+        PyMem_Free(self.params)
+        PyMem_Free(self.tables)
+        PyMem_Free(self.outputs)
+        PyMem_Free(self.lengths)
+        PyMem_Free(self.ns)
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def render(self, size_t start, size_t stop):
+        """Render the sounds with indexes in [start, stop).
+
+        The whole range is rendered without the GIL; each sound is timed in
+        C, and the statistics are recorded once at the end.
+        """
+        cdef size_t i, n_samples = 0
+        cdef SFXState state
+        cdef int64_t t, total_ns = 0
+        stop = min(stop, len(self.buffers))
+        if start >= stop:
+            return
+        with nogil:
+            for i in range(start, stop):
+                t = monotonic_ns()
+                sfx_reset(&state, &self.params[i], self.tables[i])
+                sfx_render_padded(
+                    &state,
+                    &self.params[i],
+                    self.outputs[i],
+                    self.fmt,
+                    self.lengths[i]
+                )
+                self.ns[i] = monotonic_ns() - t
+                total_ns += self.ns[i]
+                n_samples += self.lengths[i]
+
+        add_render_stats(K_SFX, stop - start, n_samples, total_ns)
+        if render_hook is not None:
+            for i in range(start, stop):
+                call_render_hook(
+                    K_SFX, self.ns[i], self.lengths[i], self.params[i]
+                )
+
+
+def sfx_batch(
+    params,
+    workers=None,
+    str format='h',
+    SoundArena arena=None,
+):
+    """Render many sound effects in parallel.
+
+    params is a sequence of dicts, each giving every parameter of the sound
+    (wave_type, seed, sample_rate, oversample, and the sfx() parameters
+    without their ``p_`` prefix, plus wavetable for wave type 4).
+
+    The sounds are rendered with the GIL released on a pool of up to
+    *workers* threads (default: the number of CPUs). The SoundBuffers are
+    returned in the same order as params, with the given sample format. If
+    arena is given, they are allocated from it.
+
+    """
+    cdef size_t i
+    cdef SFXBatch batch
+
+    params = list(params)
+    batch = SFXBatch(len(params), format)
+    for i in range(len(params)):
+        batch.params[i] = params[i]
+        batch.prepare(i, params[i].get('wavetable'), arena)
+    return run_batch(batch, workers)
+
+
+def sfx_bank(
+    floats,
+    ints,
+    workers=None,
+    str format='h',
+    SoundArena arena=None,
+):
+    """Render many sound effects from columns of parameters, in parallel.
+
+    floats is a sequence of 23 buffers of doubles, and ints a sequence of 4
+    buffers of 64-bit unsigned ints, with one column for each entry of a
+    packed parameter vector (see sfx_vector()). Entry i of every column
+    gives the parameters of sound i. Wave type 4 is not supported.
+
+    Other arguments and the result are as for sfx_batch().
+    """
+    cdef const double *fp[N_FLOAT_PARAMS]
+    cdef const uint64_t *ip[N_INT_PARAMS]
+    cdef const double[::1] fcol
+    cdef const uint64_t[::1] icol
+    cdef size_t i, k, n
+    cdef SFXBatch batch
+
+    floats = list(floats)
+    ints = list(ints)
+    if len(floats) != N_FLOAT_PARAMS or len(ints) != N_INT_PARAMS:
+        raise ValueError(
+            f"Expected {N_FLOAT_PARAMS} float columns "
+            f"and {N_INT_PARAMS} int columns"
+        )
+
+    # Keep the columns' buffers acquired while we hold pointers into them
+    views = []
+    n = len(memoryview(floats[0]))
+    for k in range(N_FLOAT_PARAMS):
+        fcol = floats[k]
+        if fcol.shape[0] != n:
+            raise ValueError("The columns must all have the same length")
+        fp[k] = &fcol[0] if n else NULL
+        views.append(fcol)
+    for k in range(N_INT_PARAMS):
+        icol = ints[k]
+        if icol.shape[0] != n:
+            raise ValueError("The columns must all have the same length")
+        ip[k] = &icol[0] if n else NULL
+        views.append(icol)
+
+    batch = SFXBatch(n, format)
+    for i in range(n):
+        unpack_params(&batch.params[i], fp, ip, i)
+        batch.prepare(i, None, arena)
+    return run_batch(batch, workers)
+
+
+cdef list run_batch(SFXBatch batch, workers):
+    """Render a batch on a pool of up to *workers* threads."""
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    cdef size_t n = len(batch), chunk
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    workers = min(workers, n)
+    if workers <= 1:
+        batch.render(0, n)
+        return batch.buffers
+
+    # Split into several chunks per worker so that threads which get short
+    # sounds can pick up more work.
+    chunk = max(1, n // (workers * 4))
+    with ThreadPoolExecutor(workers) as pool:
+        for f in [
+            pool.submit(batch.render, start, start + chunk)
+            for start in range(0, n, chunk)
+        ]:
+            f.result()
+    return batch.buffers
+
+
+# Indexes of the float parameters in a packed parameter vector
+cdef enum:
+    P_BASE_FREQ, P_FREQ_LIMIT, P_FREQ_RAMP, P_FREQ_DRAMP,
+    P_DUTY, P_DUTY_RAMP,
+    P_VIB_STRENGTH, P_VIB_SPEED, P_VIB_DELAY,
+    P_ENV_ATTACK, P_ENV_SUSTAIN, P_ENV_DECAY, P_ENV_PUNCH,
+    P_LPF_RESONANCE, P_LPF_FREQ, P_LPF_RAMP, P_HPF_FREQ, P_HPF_RAMP,
+    P_PHA_OFFSET, P_PHA_RAMP,
+    P_REPEAT_SPEED, P_ARP_SPEED, P_ARP_MOD
+
+
+cdef inline double uniform(Rng *rng, double a, double b) noexcept nogil:
+    """Get a random number in [a, b), like random.uniform()."""
+    return a + (b - a) * (rng_next(rng) * (1.0 / 4294967296.0))
+
+
+cdef inline bint one_in(Rng *rng, uint64_t n) noexcept nogil:
+    """Return True with probability 1 / (n + 1), like pyfxr.one_in()."""
+    return (rng_next(rng) * (n + 1)) >> 32 == 0
+
+
+cdef inline uint64_t choice(Rng *rng, uint64_t n) noexcept nogil:
+    """Get a random index in [0, n)."""
+    return (rng_next(rng) * n) >> 32
+
+
+cdef inline double round3(double x) noexcept nogil:
+    """Round to 3 decimal places, halves away from zero.
+
+    Small negative numbers round to 0.0 rather than -0.0, so that they
+    compare equal to the defaults in a packed parameter vector.
+    """
+    if x <= -0.0005:
+        return -floor(-x * 1000.0 + 0.5) / 1000.0
+    return floor(x * 1000.0 + 0.5) / 1000.0
+
+
+ctypedef void (*preset_func)(Rng*, double*, uint64_t*) noexcept nogil
+
+
+# Each of these mirrors the generator function of the same name in pyfxr.py,
+# drawing every parameter from the same distribution.
+
+cdef void preset_pickup(Rng *r, double *f, uint64_t *wave) noexcept nogil:
+    f[P_BASE_FREQ] = uniform(r, 0.4, 0.9)
+    f[P_ENV_ATTACK] = 0.0
+    f[P_ENV_SUSTAIN] = uniform(r, 0.0, 0.1)
+    f[P_ENV_DECAY] = uniform(r, 0.1, 0.5)
+    f[P_ENV_PUNCH] = uniform(r, 0.3, 0.6)
+    if one_in(r, 2):
+        f[P_ARP_MOD] = uniform(r, 0.2, 0.6)
+
+
+cdef void preset_laser(Rng *r, double *f, uint64_t *wave) noexcept nogil:
+    wave[0] = choice(r, 5) // 2  # one of 0, 0, 1, 1, 2
+    f[P_BASE_FREQ] = uniform(r, 0.5, 1.0)
+    f[P_FREQ_LIMIT] = max(0.2, f[P_BASE_FREQ] - uniform(r, 0.2, 0.8))
+    f[P_FREQ_RAMP] = uniform(r, -0.35, -0.15)
+    if one_in(r, 3):
+        f[P_BASE_FREQ] = uniform(r, 0.3, 0.9)
+        f[P_FREQ_LIMIT] = uniform(r, 0.0, 0.1)
+        f[P_FREQ_RAMP] = uniform(r, -0.65, -0.35)
+    if one_in(r, 2):
+        f[P_DUTY] = uniform(r, 0.0, 0.5)
+        f[P_DUTY_RAMP] = uniform(r, 0.0, 0.2)
+    else:
+        f[P_DUTY] = uniform(r, 0.4, 0.9)
+        f[P_DUTY_RAMP] = uniform(r, -0.7, 0.0)
+    f[P_ENV_ATTACK] = 0.0
+    f[P_ENV_SUSTAIN] = uniform(r, 0.1, 0.3)
+    f[P_ENV_DECAY] = uniform(r, 0.0, 0.4)
+    if one_in(r, 2):
+        f[P_ENV_PUNCH] = uniform(r, 0.0, 0.3)
+    if one_in(r, 3):
+        f[P_PHA_OFFSET] = uniform(r, 0.0, 0.2)
+        f[P_PHA_RAMP] = uniform(r, -0.2, 0.0)
+    if one_in(r, 2):
+        f[P_HPF_FREQ] = uniform(r, 0.0, 0.3)
+
+
+cdef void preset_explosion(Rng *r, double *f, uint64_t *wave) noexcept nogil:
+    wave[0] = 3
+    if one_in(r, 2):
+        f[P_BASE_FREQ] = uniform(r, 0.1, 0.5) ** 2
+        f[P_FREQ_RAMP] = uniform(r, -0.1, 0.3)
+    else:
+        f[P_BASE_FREQ] = uniform(r, 0.2, 0.7) ** 2
+        f[P_FREQ_RAMP] = uniform(r, -0.4, -0.2)
+    if one_in(r, 5):
+        f[P_FREQ_RAMP] = 0.0
+    if one_in(r, 3):
+        f[P_REPEAT_SPEED] = uniform(r, 0.3, 0.8)
+    f[P_ENV_ATTACK] = 0.0
+    f[P_ENV_SUSTAIN] = uniform(r, 0.1, 0.4)
+    f[P_ENV_DECAY] = uniform(r, 0.0, 0.5)
+    if one_in(r, 2):
+        f[P_PHA_OFFSET] = uniform(r, -0.3, 0.6)
+        f[P_PHA_RAMP] = uniform(r, -0.3, 0.0)
+    f[P_ENV_PUNCH] = uniform(r, 0.2, 0.6)
+    if one_in(r, 2):
+        f[P_VIB_STRENGTH] = uniform(r, 0.0, 0.7)
+        f[P_VIB_SPEED] = uniform(r, 0.0, 0.6)
+    if one_in(r, 3):
+        f[P_ARP_SPEED] = uniform(r, 0.6, 0.9)
+        f[P_ARP_MOD] = uniform(r, -0.8, 0.8)
+
+
+cdef void preset_powerup(Rng *r, double *f, uint64_t *wave) noexcept nogil:
+    if one_in(r, 2):
+        wave[0] = 1
+    else:
+        f[P_DUTY] = uniform(r, 0.0, 0.6)
+    f[P_BASE_FREQ] = uniform(r, 0.2, 0.5)
+    if one_in(r, 2):
+        f[P_FREQ_RAMP] = uniform(r, 0.1, 0.5)
+        f[P_REPEAT_SPEED] = uniform(r, 0.4, 0.8)
+    else:
+        f[P_FREQ_RAMP] = uniform(r, 0.05, 0.25)
+        if one_in(r, 2):
+            f[P_VIB_STRENGTH] = uniform(r, 0.0, 0.7)
+            f[P_VIB_SPEED] = uniform(r, 0.0, 0.6)
+    f[P_ENV_ATTACK] = 0.0
+    f[P_ENV_SUSTAIN] = uniform(r, 0.0, 0.4)
+    f[P_ENV_DECAY] = uniform(r, 0.1, 0.5)
+
+
+cdef void preset_hurt(Rng *r, double *f, uint64_t *wave) noexcept nogil:
+    wave[0] = choice(r, 3)
+    if wave[0] == 2:  # one of 0, 1, 3
+        wave[0] = 3
+    if wave[0] == 0:
+        f[P_DUTY] = uniform(r, 0.0, 0.6)
+    f[P_BASE_FREQ] = uniform(r, 0.2, 0.8)
+    f[P_FREQ_RAMP] = uniform(r, -0.7, -0.3)
+    f[P_ENV_ATTACK] = 0.0
+    f[P_ENV_SUSTAIN] = uniform(r, 0.0, 0.1)
+    f[P_ENV_DECAY] = uniform(r, 0.1, 0.3)
+    if one_in(r, 2):
+        f[P_HPF_FREQ] = uniform(r, 0.0, 0.3)
+
+
+cdef void preset_jump(Rng *r, double *f, uint64_t *wave) noexcept nogil:
+    wave[0] = 0
+    f[P_DUTY] = uniform(r, 0.0, 0.6)
+    f[P_BASE_FREQ] = uniform(r, 0.3, 0.6)
+    f[P_FREQ_RAMP] = uniform(r, 0.1, 0.3)
+    f[P_ENV_ATTACK] = 0.0
+    f[P_ENV_SUSTAIN] = uniform(r, 0.1, 0.4)
+    f[P_ENV_DECAY] = uniform(r, 0.1, 0.3)
+    if one_in(r, 2):
+        f[P_HPF_FREQ] = uniform(r, 0.0, 0.3)
+    if one_in(r, 2):
+        f[P_LPF_FREQ] = uniform(r, 0.4, 1.0)
+
+
+cdef void preset_select(Rng *r, double *f, uint64_t *wave) noexcept nogil:
+    wave[0] = choice(r, 2)
+    if wave[0] == 0:
+        f[P_DUTY] = uniform(r, 0.0, 0.6)
+    f[P_BASE_FREQ] = uniform(r, 0.2, 0.6)
+    f[P_ENV_ATTACK] = 0.0
+    f[P_ENV_SUSTAIN] = uniform(r, 0.1, 0.2)
+    f[P_ENV_DECAY] = uniform(r, 0.0, 0.2)
+    f[P_HPF_FREQ] = 0.1
+
+
+#: The kinds of preset that generate_presets() can generate
+PRESET_KINDS = (
+    'pickup', 'laser', 'explosion', 'powerup', 'hurt', 'jump', 'select'
+)
+cdef preset_func preset_funcs[7]
+preset_funcs[:] = [
+    preset_pickup, preset_laser, preset_explosion, preset_powerup,
+    preset_hurt, preset_jump, preset_select,
+]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def generate_presets(str kind, floats, ints, uint64_t seed):
+    """Fill columns of parameters with random presets of the given kind.
+
+    floats and ints are writable columns as for sfx_bank(), which should
+    hold the default parameters; each row is overwritten with a preset drawn
+    from the same distributions as the generator function named kind, with
+    float parameters rounded to 3 decimal places. The same seed always
+    generates the same presets.
+    """
+    cdef double *fp[N_FLOAT_PARAMS]
+    cdef double row[N_FLOAT_PARAMS]
+    cdef double[::1] fcol
+    cdef uint64_t[::1] wave_col
+    cdef uint64_t wave
+    cdef size_t i, k, n
+    cdef preset_func func
+    cdef Rng rng
+
+    try:
+        func = preset_funcs[PRESET_KINDS.index(kind)]
+    except ValueError:
+        raise ValueError(f"Unknown kind of preset {kind!r}") from None
+
+    floats = list(floats)
+    ints = list(ints)
+    if len(floats) != N_FLOAT_PARAMS or len(ints) != N_INT_PARAMS:
+        raise ValueError(
+            f"Expected {N_FLOAT_PARAMS} float columns "
+            f"and {N_INT_PARAMS} int columns"
+        )
+    wave_col = ints[0]
+    n = wave_col.shape[0]
+    if n == 0:
+        return
+
+    # Keep the columns' buffers acquired while we hold pointers into them
+    views = [wave_col]
+    for k in range(N_FLOAT_PARAMS):
+        fcol = floats[k]
+        if fcol.shape[0] != n:
+            raise ValueError("The columns must all have the same length")
+        fp[k] = &fcol[0]
+        views.append(fcol)
+
+    rng_seed(&rng, seed)
+    with nogil:
+        for i in range(n):
+            for k in range(N_FLOAT_PARAMS):
+                row[k] = fp[k][i]
+            wave = wave_col[i]
+            func(&rng, row, &wave)
+            for k in range(N_FLOAT_PARAMS):
+                fp[k][i] = round3(row[k])
+            wave_col[i] = wave
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
 @cython.cdivision(True)
-def pluck(float duration, float pitch, float release=0.1):
-    """Generate a pluck sound using the Karplus-Strong algorithm."""
+def pluck(
+    float duration,
+    float pitch,
+    float release=0.1,
+    seed=None,
+    str format='h',
+    uint32_t sample_rate=SAMPLE_RATE,
+    SoundArena arena=None,
+):
+    """Generate a pluck sound using the Karplus-Strong algorithm.
+
+    seed seeds the random number generator used for the initial burst of
+    noise; if it is None, a random seed is used.
+    """
     cdef size_t delay, i, n_samples, release_samples, pos
     cdef int16_t randval, prev
+    cdef int16_t *samples
     cdef float fsample
-    n_samples = <size_t> (SAMPLE_RATE * duration)
-    release_samples = min(<size_t> (SAMPLE_RATE * release), n_samples)
+    cdef Rng rng
+    cdef int64_t start = perf_counter_ns()
 
-    delay = <size_t> (SAMPLE_RATE / pitch)
+    check_rate(sample_rate)
+    n_samples = <size_t> (sample_rate * duration)
+    release_samples = min(<size_t> (sample_rate * release), n_samples)
+
+    delay = <size_t> (sample_rate / pitch)
     if n_samples < delay:
         raise ValueError(
             f"n_samples must be at least {delay} for pitch {pitch}"
         )
 
-    cdef SoundBuffer s = SoundBuffer(n_samples)
+    cdef char fmt = parse_format(format)
+
+    # The delay line is inherently 16-bit, so other formats are converted
+    # after rendering.
+    cdef SoundBuffer s = new_buffer(
+        K_PLUCK, arena if fmt == c'h' else None, n_samples, c'h', sample_rate
+    )
+    cdef SoundBuffer out
+    samples = <int16_t*> s.data
+
+    if seed is None:
+        seed = random_seed()
+    rng_seed(&rng, seed)
 
     with nogil:
         prev = 0
         for i in range(delay):
-            randval = 1 << 15 if rand() % 2 else -(1 << 15)
-            prev = s.samples[i] = (randval >> 1) + (prev >> 1)
+            randval = 32767 if rng_next(&rng) >> 31 else -32768
+            prev = samples[i] = (randval >> 1) + (prev >> 1)
 
         for i in range(delay, n_samples):
-            prev = s.samples[i] = (s.samples[i - delay] >> 1) + (prev >> 1)
+            prev = samples[i] = (samples[i - delay] >> 1) + (prev >> 1)
 
         # Apply attack and release envelopes
         for pos in range(delay):
-            fsample = s.samples[pos] / <float> (1 << 15)
-            s.samples[pos] = samp(i * fsample / delay)
+            fsample = samples[pos] / <float> (1 << 15)
+            samples[pos] = samp(pos * fsample / delay)
         for i in range(release_samples):
             pos = n_samples - i - 1
-            fsample = s.samples[pos] / <float> (1 << 15)
-            s.samples[pos] = samp(i * fsample / release_samples)
+            fsample = samples[pos] / <float> (1 << 15)
+            samples[pos] = samp(i * fsample / release_samples)
 
-    return s
+    if fmt == c'h':
+        out = s
+    else:
+        out = new_buffer(K_PLUCK, arena, n_samples, fmt, sample_rate)
+        with nogil:
+            convert_any(s.data, c'h', out.data, fmt, n_samples)
+
+    cdef int64_t ns = record_render(K_PLUCK, start, n_samples)
+    if render_hook is not None:
+        call_render_hook(K_PLUCK, ns, n_samples, {
+            'duration': duration,
+            'pitch': pitch,
+            'release': release,
+            'seed': seed,
+            'sample_rate': sample_rate,
+        })
+    return out
+
+
+cdef list as_buffers(sounds):
+    """Convert a sequence of sounds to a list of SoundBuffers.
+
+    CachedSound objects are built if necessary.
+    """
+    sounds = list(sounds)
+    for i, snd in enumerate(sounds):
+        if isinstance(snd, CachedSound):
+            sounds[i] = snd._get()
+        elif not isinstance(snd, SoundBuffer):
+            raise TypeError(
+                f"Invalid type for mixing: {snd!r}"
+            )
+    return sounds
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-@cython.nonecheck(False)
-@cython.cdivision(True)
+cdef void mix_into(
+    float *acc,
+    sample_t *samples,
+    size_t n_frames,
+    uint32_t in_channels,
+    uint32_t out_channels,
+    const float *gains
+) noexcept nogil:
+    """Add samples, scaled by gains, to the float accumulator acc.
+
+    acc has out_channels interleaved channels, and gains has a gain for
+    each of them. The input must have either the same number of channels,
+    or one channel, which is mixed into every output channel.
+
+    The accumulator is on the scale of 16-bit samples, whatever the format
+    of the input.
+    """
+    cdef size_t i
+    cdef uint32_t ch
+    cdef float gain
+    cdef sample_t *src
+
+    if out_channels == 1:
+        gain = gains[0]
+        for i in range(n_frames):
+            acc[i] += to_units(samples[i]) * gain
+        return
+
+    for ch in range(out_channels):
+        gain = gains[ch]
+        if gain == 0.0:
+            continue
+        src = samples if in_channels == 1 else samples + ch
+        for i in range(n_frames):
+            acc[i * out_channels + ch] += to_units(src[i * in_channels]) * gain
+
+
+cdef void mix_into_any(
+    float *acc,
+    void *samples,
+    char fmt,
+    size_t n_frames,
+    uint32_t in_channels,
+    uint32_t out_channels,
+    const float *gains
+) noexcept nogil:
+    if fmt == c'h':
+        mix_into(
+            acc, <int16_t*> samples, n_frames, in_channels, out_channels, gains
+        )
+    elif fmt == c'f':
+        mix_into(
+            acc, <float*> samples, n_frames, in_channels, out_channels, gains
+        )
+    else:
+        mix_into(
+            acc, <uint8_t*> samples, n_frames, in_channels, out_channels, gains
+        )
+
+
+cdef list pan_gains(float pan):
+    """Get the left and right gains to pan a sound, with constant power.
+
+    pan is from -1.0 (hard left) to 1.0 (hard right).
+    """
+    if not -1.0 <= pan <= 1.0:
+        raise ValueError("pan must be between -1.0 and 1.0")
+    cdef double theta = (pan + 1.0) * pi / 4.0
+    return [cos(theta), sin(theta)]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void quantise(const float *acc, sample_t *out, size_t n_samples) noexcept nogil:
+    """Round and clip the float accumulator acc into samples."""
+    cdef size_t i
+    for i in range(n_samples):
+        put_units(out, i, acc[i])
+
+
+cdef void quantise_any(
+    const float *acc,
+    void *out,
+    char fmt,
+    size_t n_samples
+) noexcept nogil:
+    if fmt == c'h':
+        quantise(acc, <int16_t*> out, n_samples)
+    elif fmt == c'f':
+        quantise(acc, <float*> out, n_samples)
+    else:
+        quantise(acc, <uint8_t*> out, n_samples)
+
+
+def mix(
+    sounds: "List[Union[SoundBuffer, SFX]]",
+    offsets=None,
+    gains=None,
+    str format='h',
+    pan=None,
+    channels=None,
+) -> SoundBuffer:
+    """Mix several sounds together into one.
+
+    offsets gives the time in seconds at which each sound starts (default
+    0.0), and gains a factor by which each sound is scaled (default 1.0).
+    All the sounds must have the same sample rate.
+
+    The result has *channels* channels. Each gain may be a sequence with a
+    gain for each channel rather than a number. pan, if given, positions
+    each sound from -1.0 (left) to 1.0 (right) in a stereo result, with
+    constant power. Mono sounds are mixed into every channel; other sounds
+    must have the same number of channels as the result. By default the
+    result is stereo if pan is given, and otherwise has as many channels as
+    the widest sound or per-channel gain.
+
+    The sounds are summed at full precision and the result is clipped only
+    once, so a large number of sounds can be layered efficiently. The sounds
+    may have any sample format; the result has the given format.
+
+    """
+    return mix_sounds(sounds, offsets, gains, format, pan, channels, K_MIX)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef SoundBuffer mix_sounds(
+    sounds,
+    offsets,
+    gains,
+    str format,
+    pan,
+    channels,
+    int kernel,
+):
+    """Implement mix(), counting the render as the given kernel."""
+    cdef:
+        size_t n, i, n_frames = 0
+        uint32_t ch, n_channels
+        float *acc = NULL
+        float *c_gains = NULL
+        size_t *c_offsets = NULL
+        void **inputs = NULL
+        char *formats = NULL
+        size_t *lengths = NULL
+        uint32_t *in_channels = NULL
+        SoundBuffer s, current
+        uint32_t sample_rate
+        int64_t start = perf_counter_ns(), ns
+
+    sounds = as_buffers(sounds)
+    if not sounds:
+        raise ValueError("No sounds given.")
+    n = len(sounds)
+    sample_rate = sounds[0].sample_rate
+    if any(snd.sample_rate != sample_rate for snd in sounds):
+        raise ValueError("Sounds must all have the same sample rate.")
+
+    offsets = [0.0] * n if offsets is None else list(offsets)
+    gains = [1.0] * n if gains is None else list(gains)
+    if pan is not None:
+        pan = list(pan)
+    if (
+        len(offsets) != n or len(gains) != n
+        or (pan is not None and len(pan) != n)
+    ):
+        raise ValueError(
+            "offsets, gains and pan must have one entry per sound."
+        )
+
+    if channels is None:
+        if pan is not None:
+            channels = 2
+        else:
+            channels = max(
+                [snd.channels for snd in sounds]
+                + [len(g) for g in gains if not isinstance(g, Real)]
+            )
+    n_channels = channels
+    if n_channels == 0:
+        raise ValueError("channels must be at least 1")
+    if pan is not None and n_channels != 2:
+        raise ValueError("pan requires a stereo result")
+
+    for i in range(n):
+        if isinstance(gains[i], Real):
+            gains[i] = [gains[i]] * n_channels
+        else:
+            gains[i] = list(gains[i])
+            if len(gains[i]) != n_channels:
+                raise ValueError(
+                    f"Per-channel gains must have {n_channels} entries."
+                )
+        if pan is not None:
+            gains[i] = [g * p for g, p in zip(gains[i], pan_gains(pan[i]))]
+
+    try:
+        c_gains = <float*> PyMem_Malloc(n * n_channels * sizeof(float))
+        c_offsets = <size_t*> PyMem_Malloc(n * sizeof(size_t))
+        inputs = <void**> PyMem_Malloc(n * sizeof(void*))
+        formats = <char*> PyMem_Malloc(n * sizeof(char))
+        lengths = <size_t*> PyMem_Malloc(n * sizeof(size_t))
+        in_channels = <uint32_t*> PyMem_Malloc(n * sizeof(uint32_t))
+        if not (
+            c_gains and c_offsets and inputs and formats and lengths
+            and in_channels
+        ):
+            raise MemoryError()
+
+        for i in range(n):
+            if offsets[i] < 0:
+                raise ValueError("offsets must not be negative.")
+            current = sounds[i]
+            if current.channels not in (1, n_channels):
+                raise ValueError(
+                    f"Cannot mix a sound with {current.channels} channels "
+                    f"into {n_channels} channels."
+                )
+            c_offsets[i] = <size_t> round(offsets[i] * sample_rate)
+            for ch in range(n_channels):
+                c_gains[i * n_channels + ch] = gains[i][ch]
+            inputs[i] = current.data
+            formats[i] = current.fmt
+            lengths[i] = len(current)
+            in_channels[i] = current.channels
+            n_frames = max(n_frames, c_offsets[i] + lengths[i])
+
+        s = new_buffer(
+            kernel, None, n_frames, parse_format(format), sample_rate,
+            n_channels
+        )
+        acc = <float*> PyMem_Malloc(s.n_samples * sizeof(float))
+        if not acc and s.n_samples:
+            raise MemoryError()
+
+        with nogil:
+            memset(acc, 0, s.n_samples * sizeof(float))
+            for i in range(n):
+                mix_into_any(
+                    acc + c_offsets[i] * n_channels,
+                    inputs[i],
+                    formats[i],
+                    lengths[i],
+                    in_channels[i],
+                    n_channels,
+                    c_gains + i * n_channels
+                )
+            quantise_any(acc, s.data, s.fmt, s.n_samples)
+    finally:
+        PyMem_Free(acc)
+        PyMem_Free(c_gains)
+        PyMem_Free(c_offsets)
+        PyMem_Free(inputs)
+        PyMem_Free(formats)
+        PyMem_Free(lengths)
+        PyMem_Free(in_channels)
+
+    ns = record_render(kernel, start, s.n_samples)
+    if render_hook is not None:
+        call_render_hook(kernel, ns, s.n_samples, {
+            'sounds': n,
+            'channels': n_channels,
+            'sample_rate': sample_rate,
+        })
+    return s
+
+
 def chord(
     sounds: "List[Union[SoundBuffer, SFX]]",
-    double stagger = 0.0
+    double stagger = 0.0,
+    str format='h',
+    pan=None,
+    gains=None,
 ) -> SoundBuffer:
     """Generate a chord by combining several sounds.
 
     If stagger is given, the start of each additional sound will be delayed
     by *stagger* seconds.
 
-    """
-    cdef:
-        size_t n_samples, n, offset, i, istagger
-        int16_t *out_samples
-        int16_t *in_samples
-        int32_t samp, div
-        SoundBuffer s, longest, current
+    Each sound is scaled by 1 / the number of sounds so that the chord
+    cannot clip. The result has the given sample format.
 
-    istagger = <size_t> (stagger * SAMPLE_RATE)
+    If pan is given, the result is stereo; pan may be a position from -1.0
+    (left) to 1.0 (right) for the whole chord, or a sequence giving a
+    position for each sound, to spread the chord out. gains may be a
+    sequence giving a gain for each channel of the result.
 
-    sounds = list(sounds)
+    """
+    sounds = as_buffers(sounds)
     if not sounds:
         raise ValueError("No sounds given.")
+    n = len(sounds)
+    if isinstance(pan, Real):
+        pan = [pan] * n
+    if gains is None:
+        gains = 1.0 / n
+    else:
+        gains = [g / n for g in gains]
+    return mix_sounds(
+        sounds,
+        [i * stagger for i in range(n)],
+        [gains] * n,
+        format,
+        pan,
+        None,
+        K_CHORD,
+    )
 
-    for i, snd in enumerate(sounds):
-        if isinstance(snd, CachedSound):
-            sounds[i] = snd._get()
-        elif not isinstance(snd, SoundBuffer):
-            raise TypeError(
-                f"Invalid type for chord: {snd!r}"
+
+cdef struct Voice:
+    # A sound playing in a VoiceMixer; id is 0 if the voice is free
+    uint64_t id
+    const void *data
+    char fmt
+    uint32_t channels
+    size_t length, position
+
+
+cdef class VoiceMixer:
+    """Mix many sounds in real time, for fire-and-forget playback.
+
+    Sounds started with :meth:`play` are mixed together into each block of
+    output requested with :meth:`fill`, which is intended to be called from
+    an audio stream callback. At most *max_voices* sounds play at once; if
+    all the voices are busy, the sound that has been playing the longest is
+    stopped to make room for a new one.
+
+    play() and fill() may be called from different threads.
+
+    """
+    cdef Voice *voices
+    cdef float *gains
+    cdef float *acc
+    cdef size_t acc_size
+    cdef uint64_t next_id
+    cdef PyThread_type_lock lock
+    cdef readonly uint32_t max_voices, channels, sample_rate
+
+    # References to the SoundBuffers that the voices are playing
+    cdef list sounds
+
+    def __cinit__(
+        self,
+        uint32_t max_voices=32,
+        uint32_t channels=2,
+        uint32_t sample_rate=SAMPLE_RATE,
+    ):
+        if max_voices == 0 or channels == 0:
+            raise ValueError("max_voices and channels must be at least 1")
+        check_rate(sample_rate)
+        self.max_voices = max_voices
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.next_id = 1
+        self.sounds = [None] * max_voices
+        self.voices = <Voice*> PyMem_Malloc(max_voices * sizeof(Voice))
+        self.gains = <float*> PyMem_Malloc(
+            max_voices * channels * sizeof(float)
+        )
+        self.lock = PyThread_allocate_lock()
+        if not (self.voices and self.gains and self.lock):
+            raise MemoryError()
+        memset(self.voices, 0, max_voices * sizeof(Voice))
+
+    def __dealloc__(self):
+        PyMem_Free(self.voices)
+        PyMem_Free(self.gains)
+        PyMem_Free(self.acc)
+        if self.lock:
+            PyThread_free_lock(self.lock)
+
+    cdef void acquire(self) noexcept:
+        with nogil:
+            PyThread_acquire_lock(self.lock, WAIT_LOCK)
+
+    @property
+    def active(self) -> int:
+        """The number of voices that are currently playing."""
+        cdef uint32_t i, n = 0
+        for i in range(self.max_voices):
+            if self.voices[i].id:
+                n += 1
+        return n
+
+    def play(self, sound, float gain=1.0, pan=None) -> int:
+        """Start playing a sound, and return an ID for its voice.
+
+        sound must have the same sample rate as the mixer, and either one
+        channel or as many as the mixer. pan positions the sound from -1.0
+        (left) to 1.0 (right) in a stereo mixer, with constant power.
+        """
+        cdef SoundBuffer buf = as_buffers([sound])[0]
+        cdef uint32_t i, ch, slot = 0
+        cdef uint64_t oldest = <uint64_t> -1, voice_id
+
+        if buf.sample_rate != self.sample_rate:
+            raise ValueError(
+                "The sound must have the same sample rate as the mixer."
+            )
+        if buf.channels not in (1, self.channels):
+            raise ValueError(
+                f"Cannot mix a sound with {buf.channels} channels "
+                f"into {self.channels} channels."
             )
+        if pan is None:
+            gains = [gain] * self.channels
+        elif self.channels != 2:
+            raise ValueError("pan requires a stereo mixer")
+        else:
+            gains = [gain * g for g in pan_gains(pan)]
+        if not len(buf):
+            return 0
+
+        self.acquire()
+        try:
+            # Free voices have ID 0, so this finds a free voice if there is
+            # one, and otherwise the oldest voice.
+            for i in range(self.max_voices):
+                if self.voices[i].id < oldest:
+                    oldest = self.voices[i].id
+                    slot = i
+            voice_id = self.next_id
+            self.next_id += 1
+            self.voices[slot] = Voice(
+                voice_id, buf.data, buf.fmt, buf.channels, len(buf), 0
+            )
+            for ch in range(self.channels):
+                self.gains[slot * self.channels + ch] = gains[ch]
+            self.sounds[slot] = buf
+        finally:
+            PyThread_release_lock(self.lock)
+        return voice_id
+
+    def stop(self, uint64_t voice_id):
+        """Stop the voice with the given ID, if it is still playing."""
+        cdef uint32_t i
+        if not voice_id:
+            return
+        self.acquire()
+        try:
+            for i in range(self.max_voices):
+                if self.voices[i].id == voice_id:
+                    self.voices[i].id = 0
+                    self.sounds[i] = None
+        finally:
+            PyThread_release_lock(self.lock)
+
+    def stop_all(self):
+        """Stop all the voices."""
+        cdef uint32_t i
+        self.acquire()
+        try:
+            for i in range(self.max_voices):
+                self.voices[i].id = 0
+                self.sounds[i] = None
+        finally:
+            PyThread_release_lock(self.lock)
+
+    @cython.cdivision(True)
+    cdef uint32_t render(
+        self,
+        void *out,
+        char fmt,
+        size_t n_frames
+    ) noexcept nogil:
+        """Mix the next n_frames of every voice into out.
+
+        Return the number of voices still playing afterwards.
+        """
+        cdef uint32_t i, playing = 0
+        cdef size_t n
+        cdef Voice *v
+
+        memset(self.acc, 0, n_frames * self.channels * sizeof(float))
+        for i in range(self.max_voices):
+            v = &self.voices[i]
+            if not v.id:
+                continue
+            n = min(n_frames, v.length - v.position)
+            mix_into_any(
+                self.acc,
+                <char*> v.data + v.position * v.channels * format_size(v.fmt),
+                v.fmt,
+                n,
+                v.channels,
+                self.channels,
+                self.gains + i * self.channels
+            )
+            v.position += n
+            if v.position < v.length:
+                playing += 1
+            else:
+                v.id = 0
+        quantise_any(self.acc, out, fmt, n_frames * self.channels)
+        return playing
 
-    n = len(sounds)
-    div = n
-    longest = max(sounds, key=len)
-    n_samples = longest.n_samples + istagger * n
-    s = SoundBuffer(n_samples)
-    out_samples = s.samples
-
-    memset(out_samples, 0, n_samples * sizeof(int16_t))
-    for offset, current in enumerate(sounds):
-        offset *= istagger
-        in_samples = current.samples
-        out_samples = s.samples + offset
-        for i in range(current.n_samples):
-            samp = <int32_t> out_samples[i]
-            samp += in_samples[i] / div
-
-            if samp > (1 << 15) - 1:
-                samp = (1 << 15) - 1
-            elif samp < -(1 << 15):
-                samp = -(1 << 15)
-            out_samples[i] = <int16_t> samp
+    def fill(self, out, format=None) -> int:
+        """Fill out with the next block of mixed output.
 
-    return s
+        out is a writable buffer, such as the buffer given to an audio stream
+        callback or a SoundBuffer, which receives interleaved samples for
+        each channel of the mixer; its size gives the number of frames. The
+        sample format is taken from the buffer unless format is given.
+
+        Return the number of voices still playing.
+        """
+        cdef Py_buffer view
+        cdef char fmt
+        cdef size_t n_samples, n_frames
+        cdef float *acc
+        cdef uint32_t i, playing
+
+        PyObject_GetBuffer(
+            out, &view, PyBUF_WRITABLE | PyBUF_FORMAT | PyBUF_C_CONTIGUOUS
+        )
+        try:
+            if format is None:
+                fmt = buffer_format(&view)
+            else:
+                fmt = parse_format(format)
+            n_samples = view.len // format_size(fmt)
+            if n_samples % self.channels:
+                raise ValueError(
+                    f"The buffer size is not a whole number of "
+                    f"{self.channels}-channel frames."
+                )
+            n_frames = n_samples // self.channels
+
+            self.acquire()
+            try:
+                if n_samples > self.acc_size:
+                    acc = <float*> PyMem_Realloc(
+                        self.acc, n_samples * sizeof(float)
+                    )
+                    if not acc:
+                        raise MemoryError()
+                    self.acc = acc
+                    self.acc_size = n_samples
+                with nogil:
+                    playing = self.render(view.buf, fmt, n_frames)
+
+                # Drop the sounds that have finished
+                for i in range(self.max_voices):
+                    if not self.voices[i].id:
+                        self.sounds[i] = None
+            finally:
+                PyThread_release_lock(self.lock)
+        finally:
+            PyBuffer_Release(&view)
+        return playing
@@ -0,0 +1,286 @@
+"""Benchmarks for the pyfxr synthesis kernels.
+
+Each benchmark reports its throughput in samples per second, and the peak
+memory allocated while it runs. Run all the benchmarks with::
+
+    python bench_pyfxr.py
+
+or a subset with ``-k``, which selects the benchmarks whose names contain
+the given text.
+
+To catch performance regressions, save a baseline on the machine that you
+release from, and compare against it later::
+
+    python bench_pyfxr.py --save-baseline
+    ... make changes ...
+    python bench_pyfxr.py --threshold 0.1
+
+Any benchmark whose throughput falls by more than the threshold (a fraction;
+the default is 0.2) compared to the baseline is flagged, and the script
+exits with a non-zero status.
+
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from math import sin
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import pyfxr
+import _pyfxr
+from pyfxr import SFX, WaveType, Wavetable
+
+#: The default location of the stored baseline
+BASELINE = Path(__file__).with_name('bench_baseline.json')
+
+#: Benchmarks by name. Each renders something once and returns the number
+#: of samples that it generated or processed.
+BENCHMARKS: Dict[str, Callable[[], int]] = {}
+
+#: The number of CPUs that each benchmark needs to give meaningful results
+CPUS: Dict[str, int] = {}
+
+
+def benchmark(name: str, func: Callable[[], int], cpus: int = 1):
+    """Register a benchmark.
+
+    Results of benchmarks needing more CPUs than the machine has are not
+    saved to the baseline, as they would not show how the code scales.
+    """
+    BENCHMARKS[name] = func
+    CPUS[name] = cpus
+
+
+def bench_sfx(sfx: SFX) -> Callable[[], int]:
+    """Benchmark rendering an SFX, bypassing the caches."""
+    def render() -> int:
+        return len(sfx._render())
+    return render
+
+
+# The base SFX has a long sustain so that the per-sample cost dominates
+_BASE = dict(base_freq=0.4, env_sustain=0.5, env_decay=0.3)
+
+for wave_type in WaveType:
+    params = dict(_BASE, wave_type=wave_type)
+    if wave_type is WaveType.WAVETABLE:
+        params['wavetable'] = Wavetable.triangle()
+    benchmark(f'sfx/{wave_type.name.lower()}', bench_sfx(SFX(**params)))
+
+_FEATURES = {
+    'lpf': dict(lpf_freq=0.4, lpf_resonance=0.5, lpf_ramp=0.1),
+    'hpf': dict(hpf_freq=0.2, hpf_ramp=0.1),
+    'phaser': dict(pha_offset=0.2, pha_ramp=-0.1),
+    'vibrato': dict(vib_strength=0.5, vib_speed=0.5),
+    'repeat': dict(repeat_speed=0.6),
+    'arpeggio': dict(arp_speed=0.7, arp_mod=0.5),
+    'slide': dict(freq_ramp=0.2, freq_dramp=-0.1, duty_ramp=0.2),
+}
+for feature, params in _FEATURES.items():
+    benchmark(f'sfx/square+{feature}', bench_sfx(SFX(**_BASE, **params)))
+
+_ALL_FEATURES = {k: v for p in _FEATURES.values() for k, v in p.items()}
+benchmark('sfx/square+all', bench_sfx(SFX(**_BASE, **_ALL_FEATURES)))
+benchmark(
+    'sfx/square+all,oversample=1',
+    bench_sfx(SFX(**_BASE, **_ALL_FEATURES, oversample=1)),
+)
+benchmark(
+    'sfx/square,22050Hz',
+    bench_sfx(SFX(**_BASE, sample_rate=22050)),
+)
+
+benchmark('tone', lambda: len(pyfxr.tone('A4')))
+benchmark(
+    'tone,float',
+    lambda: len(pyfxr.tone('A4', format='f')),
+)
+benchmark('pluck', lambda: len(pyfxr.pluck(1.0, 'A4', seed=1)))
+
+_NOTES = [pyfxr.tone(440.0 + 20 * i, sustain=0.25) for i in range(64)]
+
+
+def bench_chord(n: int) -> Callable[[], int]:
+    """Benchmark mixing n tones into a chord."""
+    sounds = _NOTES[:n]
+
+    def render() -> int:
+        pyfxr.chord(sounds, stagger=0.01)
+        return sum(len(s) for s in sounds)
+    return render
+
+
+for n in (2, 4, 16, 64):
+    benchmark(f'chord/{n}', bench_chord(n))
+
+
+def bench_render_many(workers: int) -> Callable[[], int]:
+    """Benchmark rendering a batch of SFX on a number of threads.
+
+    This calls the batch renderer behind render_many() directly, so that
+    the sounds are not found in the caches.
+    """
+    params = [
+        SFX(**dict(_BASE, base_freq=0.2 + 0.01 * i), seed=i)._all_params()
+        for i in range(32)
+    ]
+
+    def render() -> int:
+        return sum(len(b) for b in _pyfxr.sfx_batch(params, workers))
+    return render
+
+
+for workers in (1, 2, 4, 8):
+    benchmark(
+        f'render_many/workers={workers}',
+        bench_render_many(workers),
+        cpus=workers,
+    )
+
+benchmark(
+    'wavetable/from_function',
+    lambda: len(bytes(Wavetable.from_function(sin))) // 2,
+)
+
+
+def bench_save() -> Callable[[], int]:
+    """Benchmark writing a WAV file."""
+    sound = pyfxr.tone('A4', sustain=2.0)
+    path = str(Path(tempfile.mkdtemp()) / 'bench.wav')
+
+    def render() -> int:
+        sound.save(path)
+        return len(sound)
+    return render
+
+
+benchmark('soundbuffer/save', bench_save())
+
+
+def measure(func: Callable[[], int], min_time: float) -> dict:
+    """Run a benchmark repeatedly and measure it.
+
+    The throughput is taken from the fastest run, which is the least affected
+    by other activity on the machine.
+    """
+    func()  # warm up
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = float('inf')
+    runs = 0
+    start = time.perf_counter()
+    while runs < 3 or time.perf_counter() - start < min_time:
+        t = time.perf_counter_ns()
+        samples = func()
+        best = min(best, time.perf_counter_ns() - t)
+        runs += 1
+    return {
+        'samples_per_sec': samples / best * 1e9,
+        'peak_bytes': peak,
+        'runs': runs,
+    }
+
+
+def compare(
+    results: Dict[str, dict],
+    baseline: Dict[str, dict],
+    threshold: float,
+) -> list:
+    """Return the names of the benchmarks that regressed from the baseline."""
+    return [
+        name
+        for name, result in results.items()
+        if name in baseline
+        and result['samples_per_sec']
+        < baseline[name]['samples_per_sec'] * (1.0 - threshold)
+    ]
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '-k',
+        dest='pattern',
+        default='',
+        help="Only run benchmarks whose names contain this text",
+    )
+    parser.add_argument(
+        '--min-time',
+        type=float,
+        default=0.5,
+        help="Minimum time in seconds to spend on each benchmark",
+    )
+    parser.add_argument(
+        '--baseline',
+        type=Path,
+        default=BASELINE,
+        help="The baseline file to compare against or save to",
+    )
+    parser.add_argument(
+        '--save-baseline',
+        action='store_true',
+        help="Save the results as the new baseline",
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.2,
+        help="Flag benchmarks that are slower than the baseline by more "
+             "than this fraction",
+    )
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+
+    results = {}
+    print(f"{'benchmark':32} {'Msamples/s':>10} {'change':>8} {'peak KiB':>9}")
+    for name, func in BENCHMARKS.items():
+        if args.pattern not in name:
+            continue
+        result = results[name] = measure(func, args.min_time)
+        rate = result['samples_per_sec']
+        change = ''
+        if name in baseline:
+            change = f"{rate / baseline[name]['samples_per_sec'] - 1:+.1%}"
+        print(
+            f"{name:32} {rate / 1e6:10.2f} {change:>8} "
+            f"{result['peak_bytes'] / 1024:9.1f}"
+        )
+
+    if args.save_baseline:
+        cpus = os.cpu_count() or 1
+        for name in list(results):
+            if CPUS[name] > cpus:
+                print(f"Not saving {name}: it needs {CPUS[name]} CPUs")
+                del results[name]
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2) + '\n')
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(
+            f"\n{len(regressions)} benchmark(s) slower than the baseline by "
+            f"more than {args.threshold:.0%}:"
+        )
+        for name in regressions:
+            print(f"  {name}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
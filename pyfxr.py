@@ -1,20 +1,39 @@
+import os
 import re
+import sys
+import json
 import math
+import mmap
 import random
-from functools import lru_cache
-from typing import Tuple, Union, Optional, Dict
+import asyncio
+import hashlib
+import tempfile
+import threading
+from array import array
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Tuple, Union, Optional, Dict, Iterable, List
 from enum import Enum
 
 import _pyfxr
-from _pyfxr import SoundBuffer, Wavetable, sfx, CachedSound, chord
+from _pyfxr import (
+    SoundBuffer, Wavetable, sfx, CachedSound, chord, mix, SFXRenderer,
+    SoundArena, save_many, VoiceMixer, render_stats, reset_render_stats,
+    set_render_hook, memory_stats, set_memory_alert,
+)
 
 __all__ = (
     'SAMPLE_RATE',
 
     'SoundBuffer',
+    'SoundArena',
     'Wavetable',
+    'save_many',
 
     'SFX',
+    'SFXRenderer',
     'pickup',
     'laser',
     'explosion',
@@ -22,19 +41,64 @@ __all__ = (
     'hurt',
     'jump',
     'select',
+    'generate',
+    'render_many',
+    'SFXBank',
+    'DiskCache',
+    'set_disk_cache',
+    'SoundCache',
+    'sound_cache',
 
     'tone',
+    'tone_async',
+    'tones',
+    'sequence',
     'pluck',
+    'pluck_async',
     'note_to_hertz',
 
     'chord',
+    'chord_async',
     'simple_chord',
+    'mix',
+    'VoiceMixer',
+
+    'render_stats',
+    'reset_render_stats',
+    'set_render_hook',
+    'memory_stats',
+    'set_memory_alert',
 )
 
 
-#: The sample rate for all sounds generated by pyfxr
+#: The default sample rate for sounds generated by pyfxr
 SAMPLE_RATE: int = 44100
 
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Get the executor shared by all the async APIs, creating it if needed.
+
+    Sounds are rendered with the GIL released, so renders on its threads
+    run in parallel.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(thread_name_prefix='pyfxr')
+        return _executor
+
+
+async def _run_async(func, *args, **kwargs):
+    """Call func on the shared executor and await the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), partial(func, *args, **kwargs)
+    )
+
+
 NOTE_PATTERN = re.compile(r'^([A-G])([b#]?)([0-8])$')
 
 A4 = 440.0
@@ -96,6 +160,7 @@ def simple_chord(
     release: float = 0.25,
     wavetable: Wavetable = Wavetable.sine(),
     stagger: float = 0.0,
+    sample_rate: int = SAMPLE_RATE,
 ) -> SoundBuffer:
     """Construct a chord using a chord name like
 
@@ -120,17 +185,15 @@ def simple_chord(
     value = note_value(key, accidental, 3)
     tones = CHORDS[type]
     pitches = [A4 * math.pow(TWELFTH_ROOT, value + i) for i in tones]
-    sounds = [
-        _pyfxr.tone(
-            wavetable,
-            pitch,
-            attack * 44100,
-            decay * 44100,
-            sustain * 44100,
-            release * 44100,
-        )
-        for pitch in pitches
-    ]
+    sounds = _pyfxr.tones(
+        wavetable,
+        pitches,
+        attack * sample_rate,
+        decay * sample_rate,
+        sustain * sample_rate,
+        release * sample_rate,
+        sample_rate=sample_rate,
+    )
     random.shuffle(sounds)
     return chord(sounds, stagger=stagger)
 
@@ -161,18 +224,33 @@ def validate_note(note: str) -> Tuple[str, str, int]:
 def pluck(
     duration: float,
     pitch: Union[float, str],
-    release: float = 0.1
+    release: float = 0.1,
+    seed: Optional[int] = None,
+    format: str = 'h',
+    sample_rate: int = SAMPLE_RATE,
+    arena: Optional[SoundArena] = None,
 ) -> SoundBuffer:
     """Generate a pluck sound, like a harp or guitar."""
     # This is a wrapper to handle converting a note string to a pitch
     if isinstance(pitch, str):
         pitch = note_to_hertz(pitch)
-    return _pyfxr.pluck(duration, pitch, release)
+    return _pyfxr.pluck(
+        duration, pitch, release, seed, format, sample_rate, arena
+    )
 
 
 pluck.__doc__ = _pyfxr.pluck.__doc__
 
 
+async def pluck_async(*args, **kwargs) -> SoundBuffer:
+    """Generate a pluck sound without blocking the event loop.
+
+    This takes the same arguments as :func:`pluck`, but renders the sound on
+    a shared thread pool.
+    """
+    return await _run_async(pluck, *args, **kwargs)
+
+
 def tone(
     pitch: Union[float, str] = 440.0,  # Hz, default = A
     attack: float = 0.1,
@@ -180,6 +258,9 @@ def tone(
     sustain: float = 0.75,
     release: float = 0.25,
     wavetable: Wavetable = Wavetable.sine(),
+    format: str = 'h',
+    sample_rate: int = SAMPLE_RATE,
+    arena: Optional[SoundArena] = None,
 ) -> SoundBuffer:
     """Generate a tone using a wavetable.
 
@@ -195,6 +276,10 @@ def tone(
     :param decay: Decay time in seconds
     :param sustain: Sustain time in seconds
     :param release: Release time in seconds
+    :param format: The sample format of the generated sound; see
+                   :attr:`SoundBuffer.format`.
+    :param sample_rate: The sample rate of the generated sound, in Hz.
+    :param arena: A :class:`SoundArena` to allocate the sound from.
 
     """
     # This is a wrapper to handle converting a note string to a pitch
@@ -203,13 +288,119 @@ def tone(
     return _pyfxr.tone(
         wavetable,
         pitch,
-        attack * 44100,
-        decay * 44100,
-        sustain * 44100,
-        release * 44100,
+        attack * sample_rate,
+        decay * sample_rate,
+        sustain * sample_rate,
+        release * sample_rate,
+        format,
+        sample_rate,
+        arena,
+    )
+
+
+async def tone_async(*args, **kwargs) -> SoundBuffer:
+    """Generate a tone without blocking the event loop.
+
+    This takes the same arguments as :func:`tone`, but renders the sound on
+    a shared thread pool.
+    """
+    return await _run_async(tone, *args, **kwargs)
+
+
+async def chord_async(*args, **kwargs) -> SoundBuffer:
+    """Combine sounds into a chord without blocking the event loop.
+
+    This takes the same arguments as :func:`chord`, but renders the sound on
+    a shared thread pool. Any SFX objects among the sounds are built there
+    too.
+    """
+    return await _run_async(chord, *args, **kwargs)
+
+
+def tones(
+    pitches: Iterable[Union[float, str]],
+    attack: float = 0.1,
+    decay: float = 0.1,
+    sustain: float = 0.75,
+    release: float = 0.25,
+    wavetable: Wavetable = Wavetable.sine(),
+    format: str = 'h',
+    sample_rate: int = SAMPLE_RATE,
+    arena: Optional[SoundArena] = None,
+) -> List[SoundBuffer]:
+    """Generate a tone for each of several pitches.
+
+    This is equivalent to calling :func:`tone` for each pitch, with the same
+    envelope and wavetable, but is much faster for chords and arpeggios
+    because all the tones are generated in a single pass.
+
+    """
+    pitches = [
+        note_to_hertz(p) if isinstance(p, str) else p
+        for p in pitches
+    ]
+    return _pyfxr.tones(
+        wavetable,
+        pitches,
+        attack * sample_rate,
+        decay * sample_rate,
+        sustain * sample_rate,
+        release * sample_rate,
+        format,
+        sample_rate,
+        arena,
     )
 
 
+def sequence(
+    events: Iterable[tuple],
+    envelope: Tuple[float, float, float] = (0.1, 0.1, 0.25),
+    wavetable: Wavetable = Wavetable.sine(),
+    gain: float = 1.0,
+    format: str = 'h',
+    sample_rate: int = SAMPLE_RATE,
+) -> SoundBuffer:
+    """Render a sequence of notes, such as a melody, into a single sound.
+
+    Each event is a tuple ``(start, pitch, duration[, envelope[,
+    wavetable]])``:
+
+    * ``start`` is the time in seconds at which the note starts.
+    * ``pitch`` is a float in Hz or a note name like ``Bb4``.
+    * ``duration`` is how long the note is held, in seconds; it then takes
+      the release time to fade out.
+    * ``envelope`` is an ``(attack, decay, release)`` tuple in seconds; the
+      note sustains for the rest of its duration. The default is the
+      *envelope* argument.
+    * ``wavetable`` is the Wavetable to play the note with; the default is
+      the *wavetable* argument.
+
+    All the notes are rendered into the one result in a single pass.
+    Overlapping notes are summed; pass a gain less than 1.0 to avoid
+    clipping where many notes overlap.
+
+    """
+    notes = []
+    for event in events:
+        start, pitch, duration, *rest = event
+        attack, decay, release = rest[0] if rest and rest[0] else envelope
+        if isinstance(pitch, str):
+            pitch = note_to_hertz(pitch)
+        if start < 0:
+            raise ValueError("Notes must not start before 0.0.")
+        sustain = max(duration - attack - decay, 0.0)
+        notes.append((
+            round(start * sample_rate),
+            pitch,
+            int(attack * sample_rate),
+            int(decay * sample_rate),
+            int(sustain * sample_rate),
+            int(release * sample_rate),
+            rest[1] if len(rest) > 1 else None,
+        ))
+    return _pyfxr.sequence(notes, wavetable, format, sample_rate, gain)
+
+
 class FloatParam:
     """A parameter for a sound effect."""
     name: str
@@ -218,6 +409,9 @@ class FloatParam:
     #: If True, then accept negative numbers for the parameter
     bipolar: bool
 
+    #: The position of the parameter in the packed parameter vector
+    index: int
+
     def __init__(
         self,
         default: float = 0.0,
@@ -232,19 +426,25 @@ class FloatParam:
         self.name = name
 
     def __get__(self, inst: 'SFX', cls: type) -> float:
-        return inst._params.get(self.name, self.default)
+        if inst is None:
+            return self
+        return inst._floats[self.index]
 
     def __set__(self, inst: 'SFX', value: float):
-        value = float(value)
+        # Adding 0.0 turns -0.0 into 0.0, so that SFX objects that render
+        # identically have identical packed vectors, and so compare equal
+        value = float(value) + 0.0
         if value < 0.0 and not self.bipolar:
             raise ValueError(
                 f"Negative values are not value for {self.name}"
             )
-        inst._params[self.name] = value
+        inst._floats[self.index] = value
+        inst._set |= 1 << self.index
         inst._clear()
 
     def __delete__(self, inst: 'SFX'):
-        inst._params.pop(self.name, None)
+        inst._floats[self.index] = self.default
+        inst._set &= ~(1 << self.index)
         inst._clear()
 
 
@@ -267,6 +467,9 @@ class WaveType(Enum):
     #: Random noise
     NOISE = 3
 
+    #: A custom waveform, given by :attr:`SFX.wavetable`
+    WAVETABLE = 4
+
 
 class SFX(CachedSound):
     """Build a sound effect using a set of parameters.
@@ -284,6 +487,11 @@ class SFX(CachedSound):
     In any of these case the size is much smaller than the generated
     SoundBuffer.
 
+    The parameters are stored in a packed vector of fixed layout. SFX
+    objects with the same parameters are equal, and can be hashed cheaply;
+    don't change the parameters of an SFX while it is used as a dict key.
+    To store a large number of presets, use an :class:`SFXBank`.
+
     SFX supports the buffer protocol much like :class:`SoundBuffer`; accessing
     the object as a buffer generates and caches a sound.
     """
@@ -343,25 +551,163 @@ class SFX(CachedSound):
     #: Arpeggio mod
     arp_mod: float = FloatParam(0.0, bipolar=True)
 
-    __slots__ = '_params'
+    __slots__ = (
+        '_floats', '_ints', '_set', '_wavetable', '_wavetable_key', '_table'
+    )
 
     def __init__(self, **kwargs):
-        self._params = {}
+        self._floats = _FLOAT_DEFAULTS[:]
+        self._ints = _INT_DEFAULTS[:]
+        # A bit mask of the parameters that have been set, by their
+        # position in _PACKED_PARAMS
+        self._set = 0
+        self._wavetable = None
+        # A digest of the wavetable, so that keys stay cheap to build
+        self._wavetable_key = None
+        # The wavetable converted to a Wavetable, created when first needed
+        self._table = None
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+    @classmethod
+    def _from_vectors(cls, floats: array, ints: array) -> 'SFX':
+        """Construct an SFX from packed parameter vectors.
+
+        The parameters that differ from their defaults are treated as set.
+        """
+        sfx = cls()
+        # Normalise -0.0 to 0.0, as when setting parameters
+        sfx._floats = array('d', [v + 0.0 for v in floats])
+        sfx._ints = ints
+        values = sfx._floats.tolist() + ints.tolist()
+        for i, default in enumerate(_PACKED_DEFAULTS):
+            if values[i] != default:
+                sfx._set |= 1 << i
+        return sfx
+
+    def _set_int(self, name: str, v: int):
+        """Set one of the int parameters."""
+        i = _INT_PARAMS.index(name)
+        self._ints[i] = v
+        self._set |= 1 << (len(_FLOAT_PARAMS) + i)
+        self._clear()
+
+    def _key(self) -> tuple:
+        """Get a hashable key identifying the parameters of the sound."""
+        return (
+            self._floats.tobytes(),
+            self._ints.tobytes(),
+            self._wavetable_key,
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, SFX):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __reduce__(self):
+        return _restore_sfx, (type(self), self.as_dict())
+
+    @property
+    def seed(self) -> int:
+        """The seed for the random numbers used to generate noise.
+
+        An SFX always generates the same sound; change the seed to get a
+        different variation of a noisy sound.
+        """
+        return self._ints[1]
+
+    @seed.setter
+    def seed(self, v: int):
+        """Set the seed."""
+        v = int(v)
+        if not 0 <= v < 1 << 64:
+            raise ValueError("seed must be between 0 and 2 ** 64 - 1")
+        self._set_int('seed', v)
+
+    @property
+    def sample_rate(self) -> int:
+        """The sample rate at which to generate the sound, in Hz.
+
+        The sound has the same duration and pitch at any sample rate, but
+        lower rates are cheaper to generate and store.
+        """
+        return self._ints[2]
+
+    @sample_rate.setter
+    def sample_rate(self, v: int):
+        """Set the sample rate."""
+        v = int(v)
+        if not 0 < v < 1 << 32:
+            raise ValueError("sample_rate must be between 1 and 2 ** 32 - 1")
+        self._set_int('sample_rate', v)
+
+    @property
+    def oversample(self) -> int:
+        """The number of times each sample is supersampled: 1, 2, 4 or 8.
+
+        The default of 8 gives the best quality. Lower values render
+        proportionally faster, with more aliasing, which is useful to
+        preview sounds while editing them.
+        """
+        return self._ints[3]
+
+    @oversample.setter
+    def oversample(self, v: int):
+        """Set the oversampling factor."""
+        v = int(v)
+        if v not in (1, 2, 4, 8):
+            raise ValueError("oversample must be 1, 2, 4 or 8")
+        self._set_int('oversample', v)
+
+    @property
+    def wavetable(self) -> Optional[Wavetable]:
+        """The waveform for the :attr:`WaveType.WAVETABLE` wave type.
+
+        This may be set to a :class:`Wavetable` or a sequence of 1024 16-bit
+        samples; it is stored as a tuple of samples so that it can be
+        serialised.
+        """
+        samples = self._wavetable
+        return None if samples is None else _pyfxr.as_wavetable(samples)
+
+    @wavetable.setter
+    def wavetable(self, v: Union[Wavetable, Iterable[int]]):
+        """Set the wavetable."""
+        if isinstance(v, Wavetable):
+            v = array('h', bytes(v))
+        v = tuple(int(s) for s in v)
+        if len(v) != 1024:
+            raise ValueError("A wavetable must have exactly 1024 samples")
+        if not all(-32768 <= s <= 32767 for s in v):
+            raise ValueError("Wavetable samples must be 16-bit")
+        self._wavetable = v
+        self._wavetable_key = hashlib.sha256(array('h', v).tobytes()).digest()
+        self._table = None
+        self._clear()
+
+    @wavetable.deleter
+    def wavetable(self):
+        """Remove the wavetable."""
+        self._wavetable = None
+        self._wavetable_key = None
+        self._table = None
+        self._clear()
+
     @property
     def wave_type(self) -> WaveType:
         """Get the wave type."""
-        return WaveType(self._params.get('wave_type', 0))
+        return WaveType(self._ints[0])
 
     @wave_type.setter
     def wave_type(self, v: Union[str, int, WaveType]):
         """Set the wave type."""
         if isinstance(v, str):
             v = WaveType[v.upper()]
-        self._params['wave_type'] = WaveType(v).value
-        self._clear()
+        self._set_int('wave_type', WaveType(v).value)
 
     def as_dict(self) -> dict:
         """Get the parameters as a dict.
@@ -374,7 +720,15 @@ class SFX(CachedSound):
         >>> s2 = SFX(**params)
 
         """
-        return self._params.copy()
+        values = self._floats.tolist() + self._ints.tolist()
+        params = {
+            name: values[i]
+            for i, name in enumerate(_PACKED_PARAMS)
+            if self._set >> i & 1
+        }
+        if self._wavetable is not None:
+            params['wavetable'] = self._wavetable
+        return params
 
     def __repr__(self):
         """Generate a repr for this sound effect.
@@ -384,13 +738,11 @@ class SFX(CachedSound):
 
         """
         params = [f'{type(self).__module__}.{type(self).__qualname__}(']
+        values = self.as_dict()
 
-        for k, desc in vars(type(self)).items():
-            if k != 'wave_type' and not isinstance(desc, FloatParam):
-                continue
-
+        for k in vars(type(self)):
             try:
-                value = self._params[k]
+                value = values[k]
             except KeyError:
                 continue
 
@@ -413,16 +765,64 @@ class SFX(CachedSound):
         return self._get().get_queue_source()
 
     def _build(self) -> SoundBuffer:
+        """Generate the sound, or load it from the disk cache if enabled."""
+        cache = _disk_cache
+        if cache is None:
+            return self._render()
+
+        key = cache.key(self)
+        buf = cache.get(key, self.sample_rate)
+        if buf is None:
+            buf = self._render()
+            cache.put(key, buf)
+        return buf
+
+    def _render(self) -> SoundBuffer:
         """Actually generate the sound using the current parameters."""
-        return sfx(**{
-            f'p_{k}' if k != 'wave_type' else k: v
-            for k, v in self._params.items()
-        })
+        return _pyfxr.sfx_vector(self._floats, self._ints, self._get_table())
+
+    def _get_table(self) -> Optional[Wavetable]:
+        """Get the wavetable as a Wavetable, converting it only once."""
+        if self._table is None and self._wavetable is not None:
+            self._table = _pyfxr.as_wavetable(self._wavetable)
+        return self._table
+
+    def _get(self) -> SoundBuffer:
+        # Sounds are shared between all SFX instances with the same
+        # parameters through the process-wide sound cache, rather than
+        # being held by each instance.
+        return sound_cache.get(self)
 
     def build(self) -> SoundBuffer:
-        """Get the generated sound (memoised)."""
+        """Get the generated sound (memoised in :data:`sound_cache`)."""
         return self._get()
 
+    async def build_async(self) -> SoundBuffer:
+        """Get the generated sound without blocking the event loop.
+
+        The sound is rendered on a shared thread pool. Concurrent calls for
+        SFX with the same parameters share a single render.
+        """
+        future = asyncio.wrap_future(sound_cache.get_future(self))
+        # Shield the shared render from the cancellation of one awaiter
+        return await asyncio.shield(future)
+
+    def renderer(self) -> SFXRenderer:
+        """Get a renderer to generate this sound a block at a time.
+
+        This does not use or populate the cached sound.
+        """
+        return SFXRenderer(
+            dict(self._all_params(), wavetable=self._get_table())
+        )
+
+    def _all_params(self) -> Dict[str, float]:
+        """Get every parameter, including defaults, keyed by name."""
+        values = self._floats.tolist() + self._ints.tolist()
+        params = dict(zip(_PACKED_PARAMS, values))
+        params['wavetable'] = self._wavetable
+        return params
+
     def envelope(
         self,
         attack: float = 0.0,
@@ -438,6 +838,296 @@ class SFX(CachedSound):
         return self
 
 
+def _restore_sfx(cls: type, params: dict) -> SFX:
+    """Reconstruct a pickled SFX."""
+    return cls(**params)
+
+
+#: The float parameters of an SFX, in the order of the packed parameter
+#: vector. This is the order of the sfx() parameters.
+_FLOAT_PARAMS: Tuple[str, ...] = tuple(
+    k for k, desc in vars(SFX).items() if isinstance(desc, FloatParam)
+)
+for i, k in enumerate(_FLOAT_PARAMS):
+    vars(SFX)[k].index = i
+del i, k
+
+#: The int parameters of an SFX, in the order of the packed parameter vector
+_INT_PARAMS: Tuple[str, ...] = (
+    'wave_type', 'seed', 'sample_rate', 'oversample'
+)
+
+#: The names of every entry of the packed parameter vectors
+_PACKED_PARAMS = _FLOAT_PARAMS + _INT_PARAMS
+
+_FLOAT_DEFAULTS = array('d', [vars(SFX)[k].default for k in _FLOAT_PARAMS])
+_INT_DEFAULTS = array('Q', [WaveType.SQUARE.value, 0, SAMPLE_RATE, 8])
+_PACKED_DEFAULTS = _FLOAT_DEFAULTS.tolist() + _INT_DEFAULTS.tolist()
+
+
+def render_many(
+    sounds: Iterable[Union[SFX, Dict[str, float]]],
+    workers: Optional[int] = None,
+    arena: Optional[SoundArena] = None,
+) -> List[SoundBuffer]:
+    """Render many sound effects in parallel.
+
+    sounds may contain :class:`SFX` instances or dicts of parameters as
+    returned by :meth:`SFX.as_dict()`. The sounds are rendered with the GIL
+    released on up to *workers* threads (by default, one per CPU).
+
+    Return a list of SoundBuffers in the same order as the input. Sounds
+    already in :data:`sound_cache` are not rendered again, and newly
+    rendered sounds are added to it.
+
+    If arena is given, newly rendered sounds are allocated from it; sounds
+    found in the caches are not.
+
+    """
+    sfxs = [s if isinstance(s, SFX) else SFX(**s) for s in sounds]
+    keys = [sound_cache.key(s) for s in sfxs]
+    buffers = [sound_cache.lookup(k) for k in keys]
+
+    disk = _disk_cache
+    if disk is not None:
+        disk_keys = {
+            i: disk.key(sfxs[i])
+            for i, buf in enumerate(buffers)
+            if buf is None
+        }
+        for i, k in disk_keys.items():
+            buffers[i] = disk.get(k, sfxs[i].sample_rate)
+
+    missing = [i for i, buf in enumerate(buffers) if buf is None]
+    rendered = _pyfxr.sfx_batch(
+        [
+            dict(sfxs[i]._all_params(), wavetable=sfxs[i]._get_table())
+            for i in missing
+        ],
+        workers,
+        arena=arena,
+    )
+    for i, buf in zip(missing, rendered):
+        if disk is not None:
+            disk.put(disk_keys[i], buf)
+        buffers[i] = buf
+
+    return [sound_cache.put(k, buf) for k, buf in zip(keys, buffers)]
+
+
+class SFXBank:
+    """A bank of many sound effect presets, stored as columns of parameters.
+
+    Each parameter is held in an :class:`array.array` with an entry for
+    every preset, so a bank of tens of thousands of presets is compact, and
+    can be rendered or saved in bulk without creating an :class:`SFX` for
+    each preset. Presets using :attr:`WaveType.WAVETABLE` are not
+    supported.
+
+    """
+
+    #: Identifies the files written by save()
+    MAGIC = b'pyfxr-bank\x00\x01'
+
+    def __init__(self, n: int = 0):
+        """Construct a bank of n presets with the default parameters."""
+        self._floats = [array('d', [v]) * n for v in _FLOAT_DEFAULTS]
+        self._ints = [array('Q', [v]) * n for v in _INT_DEFAULTS]
+
+    @classmethod
+    def from_sfx(cls, sounds: Iterable[SFX]) -> 'SFXBank':
+        """Construct a bank from SFX objects."""
+        bank = cls()
+        for sfx in sounds:
+            bank.append(sfx)
+        return bank
+
+    def append(self, sfx: SFX):
+        """Add a preset to the end of the bank."""
+        if sfx.wave_type is WaveType.WAVETABLE:
+            raise ValueError("SFXBank does not support wavetables")
+        for col, v in zip(self._floats, sfx._floats):
+            col.append(v)
+        for col, v in zip(self._ints, sfx._ints):
+            col.append(v)
+
+    def __len__(self) -> int:
+        return len(self._ints[0])
+
+    def __getitem__(self, i: int) -> SFX:
+        """Get preset i as an SFX."""
+        return SFX._from_vectors(
+            array('d', [col[i] for col in self._floats]),
+            array('Q', [col[i] for col in self._ints]),
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def columns(self) -> Dict[str, array]:
+        """The columns of parameters, keyed by parameter name.
+
+        Modifying the arrays modifies the bank, but they must all keep the
+        same length.
+        """
+        return dict(zip(_PACKED_PARAMS, self._floats + self._ints))
+
+    def render(
+        self,
+        workers: Optional[int] = None,
+        format: str = 'h',
+        arena: Optional[SoundArena] = None,
+    ) -> List[SoundBuffer]:
+        """Render every preset in the bank, in parallel.
+
+        This is like :func:`render_many`, but the parameters are read
+        directly from the columns, and the sounds are not cached.
+        """
+        return _pyfxr.sfx_bank(
+            self._floats, self._ints, workers, format, arena
+        )
+
+    def save(self, path: Union[str, os.PathLike]):
+        """Save the bank to a file, in a compact binary format."""
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(len(self).to_bytes(8, 'little'))
+            for col in self._floats + self._ints:
+                if sys.byteorder != 'little':
+                    col = array(col.typecode, col)
+                    col.byteswap()
+                col.tofile(f)
+
+    @classmethod
+    def load(cls, path: Union[str, os.PathLike]) -> 'SFXBank':
+        """Load a bank saved with :meth:`save`."""
+        bank = cls()
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"{path} is not an SFXBank file")
+            n = int.from_bytes(f.read(8), 'little')
+            for col in bank._floats + bank._ints:
+                col.fromfile(f, n)
+                if sys.byteorder != 'little':
+                    col.byteswap()
+        return bank
+
+
+class DiskCache:
+    """A persistent cache of rendered sounds, stored in a directory.
+
+    Sounds are stored as raw 16-bit samples, after a header giving their
+    number, in files named by a hash of the SFX parameters and the engine
+    version, so a cache directory can be kept across upgrades of pyfxr.
+    Cached sounds are memory-mapped rather than read, so loading them is
+    very cheap.
+
+    """
+
+    #: The size of the header, which holds the number of samples
+    HEADER_SIZE = 8
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(sfx: SFX) -> str:
+        """Get the cache key for an SFX."""
+        data = json.dumps(
+            {
+                'engine': _pyfxr.ENGINE_VERSION,
+                'byteorder': sys.byteorder,
+                'params': sfx._all_params(),
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(data.encode('ascii')).hexdigest()
+
+    def _file(self, key: str) -> Path:
+        return self.path / f'{key}.raw'
+
+    def get(
+        self,
+        key: str,
+        sample_rate: int = SAMPLE_RATE,
+    ) -> Optional[SoundBuffer]:
+        """Load the sound with the given key, or return None if missing.
+
+        The raw file does not record the sample rate; it must be given.
+        Files whose size does not match the number of samples in their
+        header are corrupt; they are deleted and treated as missing.
+        """
+        path = self._file(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            header = f.read(self.HEADER_SIZE)
+            n_samples = int.from_bytes(header, 'little')
+            if (
+                len(header) != self.HEADER_SIZE
+                or size != self.HEADER_SIZE + 2 * n_samples
+            ):
+                f.close()
+                path.unlink(missing_ok=True)
+                return None
+            if not n_samples:
+                return SoundBuffer(0, 'h', sample_rate)
+            # Map copy-on-write, so the SoundBuffer can be modified without
+            # corrupting the cache
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        return SoundBuffer.from_buffer(
+            memoryview(mapping)[self.HEADER_SIZE:], 'h', sample_rate
+        )
+
+    def put(self, key: str, buf: SoundBuffer):
+        """Store a sound under the given key."""
+        # Write to a uniquely named file and rename it into place, so that
+        # readers and concurrent writers never see a partial file
+        with tempfile.NamedTemporaryFile(
+            dir=self.path, suffix='.tmp', delete=False
+        ) as f:
+            try:
+                f.write(len(buf).to_bytes(self.HEADER_SIZE, 'little'))
+                f.write(buf)
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, self._file(key))
+
+    def clear(self):
+        """Delete all sounds from the cache."""
+        for path in self.path.glob('*.raw'):
+            path.unlink()
+
+
+_disk_cache: Optional[DiskCache] = None
+
+
+def set_disk_cache(
+    path: Union[str, os.PathLike, None]
+) -> Optional[DiskCache]:
+    """Store sounds generated from SFX objects in a directory on disk.
+
+    Subsequently, SFX objects with identical parameters will load the
+    generated sound from disk rather than generating it again, even in a
+    different process. Pass None to disable the disk cache.
+
+    Return the new DiskCache, if any.
+
+    """
+    global _disk_cache
+    _disk_cache = None if path is None else DiskCache(path)
+    return _disk_cache
+
+
 def one_in(n: int) -> bool:
     """Return True with odds of 1 in n."""
     return not random.randint(0, n)
@@ -593,3 +1283,216 @@ def select() -> SFX:
     env_decay = random.uniform(0.0, 0.2)
     hpf_freq = 0.1
     return _mksfx(locals())
+
+
+def generate(kind: str, n: int, seed: Optional[int] = None) -> SFXBank:
+    """Generate n random presets of a kind, in bulk.
+
+    kind is the name of one of the generator functions above, such as
+    ``'laser'``. The parameters of every preset are drawn from the same
+    distributions as that function uses, but all at once in native code,
+    so this is much faster than calling it n times. The presets are
+    returned as an :class:`SFXBank`, ready to render in parallel.
+
+    The same seed always generates the same presets; if seed is None, a
+    random seed is used.
+    """
+    if seed is None:
+        seed = random.getrandbits(64)
+    bank = SFXBank(n)
+    _pyfxr.generate_presets(kind, bank._floats, bank._ints, seed)
+    return bank
+
+
+class SoundCache:
+    """A cache of generated sounds, keyed by their SFX parameters.
+
+    The cache holds at most *max_bytes* of sample data; when it is full, the
+    least recently used sounds are evicted. Pinned sounds are never evicted
+    (but do count towards the budget).
+
+    There is a single process-wide instance, :data:`sound_cache`.
+
+    """
+
+    #: The number of lookups that found a cached sound
+    hits: int
+
+    #: The number of lookups that did not find a cached sound
+    misses: int
+
+    #: The total size of the cached sounds in bytes
+    nbytes: int
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self._lock = threading.Lock()
+        self._sounds: OrderedDict = OrderedDict()
+        self._pins: Dict[tuple, int] = {}
+        self._pending: Dict[tuple, Future] = {}
+        self._max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self) -> int:
+        """The byte budget for the cache."""
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value: int):
+        with self._lock:
+            self._max_bytes = value
+            self._evict()
+
+    def __len__(self) -> int:
+        return len(self._sounds)
+
+    @staticmethod
+    def key(sfx: SFX) -> tuple:
+        """Get the cache key for an SFX."""
+        return sfx._key()
+
+    def lookup(self, key: tuple) -> Optional[SoundBuffer]:
+        """Get the cached sound for key, or None if it is not cached."""
+        with self._lock:
+            try:
+                buf, size = self._sounds[key]
+            except KeyError:
+                self.misses += 1
+                _pyfxr.count_cache_lookup(False)
+                return None
+            self._sounds.move_to_end(key)
+            self.hits += 1
+            _pyfxr.count_cache_lookup(True)
+            return buf
+
+    def put(self, key: tuple, buf: SoundBuffer) -> SoundBuffer:
+        """Add a sound to the cache.
+
+        If a sound is already cached for this key, it is kept and returned
+        instead, so that all users share the same buffer.
+        """
+        with self._lock:
+            try:
+                existing, size = self._sounds[key]
+            except KeyError:
+                pass
+            else:
+                self._sounds.move_to_end(key)
+                return existing
+
+            size = memoryview(buf).nbytes
+            self._sounds[key] = buf, size
+            self.nbytes += size
+            self._evict()
+        return buf
+
+    def get(self, sfx: SFX) -> SoundBuffer:
+        """Get the sound for sfx, generating and caching it if necessary."""
+        key = self.key(sfx)
+        buf = self.lookup(key)
+        if buf is None:
+            # Build without holding the lock so that other threads can use
+            # the cache meanwhile
+            buf = self.put(key, sfx._build())
+        return buf
+
+    def get_future(self, sfx: SFX) -> Future:
+        """Get a future for the sound for sfx.
+
+        If the sound is not cached, it is generated on the shared thread pool
+        used by :meth:`SFX.build_async`. While it is being generated, further
+        requests for the same sound return the same future.
+        """
+        key = self.key(sfx)
+        with self._lock:
+            try:
+                buf, size = self._sounds[key]
+            except KeyError:
+                pass
+            else:
+                self._sounds.move_to_end(key)
+                self.hits += 1
+                _pyfxr.count_cache_lookup(True)
+                future = Future()
+                future.set_result(buf)
+                return future
+
+            future = self._pending.get(key)
+            if future is None:
+                self.misses += 1
+                _pyfxr.count_cache_lookup(False)
+                # Copy the SFX so that changes to it don't affect the render
+                sfx = type(sfx)(**sfx.as_dict())
+                future = _get_executor().submit(self._build, key, sfx)
+                self._pending[key] = future
+            return future
+
+    def _build(self, key: tuple, sfx: SFX) -> SoundBuffer:
+        """Generate and cache the sound for a pending future."""
+        try:
+            return self.put(key, sfx._build())
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+    def pin(self, sfx: SFX) -> SoundBuffer:
+        """Generate the sound for sfx and keep it until unpinned.
+
+        Pins are counted; a sound pinned twice must be unpinned twice.
+        """
+        key = self.key(sfx)
+        # Pin before rendering, so the new sound can't be evicted as soon
+        # as it is added, but roll the pin back if the render fails
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            return self.get(sfx)
+        except BaseException:
+            self._unpin(key)
+            raise
+
+    def unpin(self, sfx: SFX):
+        """Allow the sound for sfx to be evicted again.
+
+        Raise ValueError if sfx is not pinned.
+        """
+        if not self._unpin(self.key(sfx)):
+            raise ValueError(f"{sfx!r} is not pinned")
+
+    def _unpin(self, key) -> bool:
+        """Remove one pin from key, returning False if it wasn't pinned."""
+        with self._lock:
+            count = self._pins.pop(key, 0)
+            if not count:
+                return False
+            if count > 1:
+                self._pins[key] = count - 1
+            self._evict()
+        return True
+
+    def clear(self):
+        """Evict all sounds that are not pinned."""
+        with self._lock:
+            for key in list(self._sounds):
+                if key not in self._pins:
+                    self.nbytes -= self._sounds.pop(key)[1]
+
+    def _evict(self):
+        """Evict least recently used sounds until we are within budget.
+
+        Must be called with the lock held.
+        """
+        if self.nbytes <= self._max_bytes:
+            return
+        for key in list(self._sounds):
+            if key in self._pins:
+                continue
+            self.nbytes -= self._sounds.pop(key)[1]
+            if self.nbytes <= self._max_bytes:
+                return
+
+
+#: The process-wide cache of generated sounds
+sound_cache = SoundCache()
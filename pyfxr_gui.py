@@ -1,6 +1,7 @@
 from math import sin, pi, copysign, cos
 import random
 import sys
+import threading
 from functools import lru_cache
 import inspect
 
@@ -400,9 +401,15 @@ class Slider:
         xpos = slider_newx - self.rect.left
         track_width = self.rect.width - self.WIDTH
         if self.bipolar:
-            self.value = 2 * (xpos / track_width) - 1.0
+            value = 2 * (xpos / track_width) - 1.0
         else:
-            self.value = xpos / track_width
+            value = xpos / track_width
+
+        if round(value, 2) != round(self.value, 2):
+            # Preview the sound live while dragging
+            setattr(sfx, self.param_name, round(value, 2))
+            previewer.request(sfx, full=False)
+        self.value = value
 
     def on_release(self, pos):
         self.on_drag(pos)
@@ -410,13 +417,90 @@ class Slider:
         playfx()
 
 
+# Posted by the Previewer when a sound has been rendered
+SOUND_READY = pygame.event.custom_type()
+
+
+class Previewer:
+    """Render sounds on a background thread, so that the UI stays responsive.
+
+    For each request, a fast low-quality preview is rendered and played
+    first. Then, unless there is a newer request, the full-quality sound is
+    rendered and swapped in if the preview is still playing.
+
+    Rendered sounds are posted to the event loop as SOUND_READY events.
+    """
+    #: The oversampling factor for previews
+    PREVIEW_OVERSAMPLE = 1
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = None
+        self.generation = 0
+        self.channel = None
+        self.started = 0.0
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def request(self, sfx, full=True):
+        """Request that a copy of sfx be rendered and played."""
+        with self.cond:
+            self.generation += 1
+            self.pending = self.generation, pyfxr.SFX(**sfx.as_dict()), full
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                generation, sfx, full = self.pending
+                self.pending = None
+
+            preview = pyfxr.SFX(**sfx.as_dict())
+            preview.oversample = self.PREVIEW_OVERSAMPLE
+            self.post(generation, preview.build(), full=False)
+
+            if full and self.pending is None:
+                self.post(generation, sfx.build(), full=True)
+
+    def post(self, generation, buf, full):
+        pygame.event.post(pygame.event.Event(
+            SOUND_READY,
+            generation=generation,
+            buffer=buf,
+            full=full,
+        ))
+
+    def on_ready(self, ev):
+        """Play a rendered sound, if it is for the latest request."""
+        if ev.generation != self.generation:
+            return
+
+        buf = ev.buffer
+        if ev.full:
+            # Swap in for the rest of the preview, if it is still playing
+            if not (self.channel and self.channel.get_busy()):
+                return
+            pos = round((time.perf_counter() - self.started) * buf.sample_rate)
+            if pos >= len(buf):
+                return
+            buf = buf[pos:]
+        else:
+            self.started = time.perf_counter()
+
+        if self.channel:
+            self.channel.stop()
+        s = pygame.mixer.Sound(buffer=buf)
+        s.set_volume(0.5)
+        self.channel = s.play()
+
+
+previewer = None
+
+
 def playfx():
     print(f"sfx = {sfx!r}")
-    s = pygame.mixer.Sound(
-        buffer=sfx.build()
-    )
-    s.set_volume(0.5)
-    s.play()
+    previewer.request(sfx)
 
 
 def clamp(v, min, max):
@@ -611,6 +695,9 @@ def main():
     screen = pygame.display.set_mode((800, 600))
     font = pygame.font.SysFont('sans-serif', 24, bold=False)
 
+    global previewer
+    previewer = Previewer()
+
     while True:
         draw()
         pygame.display.flip()
@@ -632,6 +719,8 @@ def main():
                 if clicked:
                     clicked.on_release(ev.pos)
                     clicked = None
+        elif ev.type == SOUND_READY:
+            previewer.on_ready(ev)
         elif ev.type == pygame.KEYDOWN:
             if ev.key == pygame.K_F1:
                 tones_tab()
@@ -1,8 +1,20 @@
+import sys
+import wave
+import pickle
+import asyncio
+from array import array
+from fractions import Fraction
 from math import sin, pi, floor
 
-from pytest import approx
+from pytest import approx, raises
 
-from pyfxr import Wavetable, tone
+from pyfxr import (
+    Wavetable, tone, tones, SFX, SoundBuffer, render_many, set_disk_cache,
+    SoundCache, sound_cache, pluck, mix, chord, SoundArena, save_many,
+    WaveType, sequence, VoiceMixer, tone_async, chord_async, render_stats,
+    reset_render_stats, set_render_hook, memory_stats, set_memory_alert,
+    SFXBank, generate,
+)
 
 
 tau = 2 * pi
@@ -27,6 +39,26 @@ def test_wavetable_generator():
         assert w[i] < w[i + 1]
 
 
+def test_wavetable_from_buffer():
+    """We can construct wavetables from buffers and harmonics."""
+    def f(t):
+        return 0.75 * sin(t) + 0.25 * sin(3 * t + 0.5)
+
+    expected = bytes(Wavetable.from_function(f))
+    values = array('d', (f(i * pi / 512) for i in range(1024)))
+    assert bytes(Wavetable.from_buffer(values)) == expected
+    assert bytes(Wavetable.from_buffer(array('f', values))) == expected
+    assert bytes(Wavetable.from_buffer(array('h', expected))) == expected
+
+    harmonics = Wavetable.from_harmonics([0.75, 0, 0.25], [0, 0, 0.5])
+    assert list(memoryview(harmonics)) == approx(
+        list(memoryview(Wavetable.from_function(f))), abs=1
+    )
+
+    with raises(ValueError):
+        Wavetable.from_buffer(array('d', [0.0] * 1000))
+
+
 def test_adsr_envelope():
     """Tones are modulated by an ADSR envelope."""
     w = Wavetable.from_function(lambda t: 1)
@@ -75,3 +107,631 @@ def test_sine_tone():
 
     assert samples == approx(expected, abs=0.05)
 
+
+def test_render_many():
+    """We can render a batch of sounds in parallel, in order."""
+    sounds = [
+        SFX(base_freq=0.2 + i / 100, env_sustain=0.1 + i / 200)
+        for i in range(20)
+    ]
+    expected = [bytes(SFX(**s.as_dict()).build()) for s in sounds]
+    params = [s.as_dict() for s in sounds[:10]]
+    bufs = render_many(params + sounds[10:], workers=4)
+    assert [bytes(b) for b in bufs] == expected
+    assert sounds[15].build() is bufs[15]
+
+
+def test_render_blocks():
+    """We can render a sound a block at a time."""
+    fx = SFX(base_freq=0.4, freq_ramp=-0.2, env_decay=0.3, pha_offset=0.1)
+    renderer = fx.renderer()
+    block = SoundBuffer(256)
+    blocks = []
+    while not renderer.done:
+        n = renderer.render_into(block)
+        blocks.append(bytes(block)[:n * 2])
+    assert b''.join(blocks) == bytes(fx.build())
+    assert renderer.render_into(block) == 0
+    assert not any(memoryview(block))
+
+    with raises(ValueError):
+        fx.renderer().render_into(SoundBuffer(100, channels=2))
+
+
+def test_disk_cache(tmp_path):
+    """Generated sounds can be cached on disk."""
+    fx = SFX(base_freq=0.5, env_decay=0.2)
+    cache = set_disk_cache(tmp_path)
+    try:
+        buf = fx.build()
+        assert (tmp_path / f'{cache.key(fx)}.raw').exists()
+
+        sound_cache.clear()
+        loaded = SFX(**fx.as_dict()).build()
+        assert loaded is not buf
+        assert bytes(loaded) == bytes(buf)
+    finally:
+        set_disk_cache(None)
+
+
+def test_disk_cache_corrupt(tmp_path):
+    """Corrupt files in the disk cache are discarded and re-rendered."""
+    fx = SFX(base_freq=0.55, env_decay=0.2)
+    cache = set_disk_cache(tmp_path)
+    try:
+        path = tmp_path / f'{cache.key(fx)}.raw'
+        path.write_bytes(b'\x00' * 101)
+        assert cache.get(cache.key(fx)) is None
+        assert not path.exists()
+
+        buf = fx.build()
+        assert path.read_bytes()[8:] == bytes(buf)
+
+        # A truncated file is detected even if it holds whole samples
+        data = path.read_bytes()
+        path.write_bytes(data[:-100])
+        assert cache.get(cache.key(fx)) is None
+        assert not path.exists()
+        assert not list(tmp_path.glob('*.tmp'))
+    finally:
+        set_disk_cache(None)
+
+
+def test_sound_cache_shared():
+    """SFX instances with the same parameters share a cached sound."""
+    a = SFX(base_freq=0.45, env_decay=0.1)
+    b = SFX(base_freq=0.45, env_decay=0.1)
+    hits = sound_cache.hits
+    assert a.build() is b.build()
+    assert sound_cache.hits == hits + 1
+    assert memoryview(b).obj is a.build()
+
+
+def test_sound_cache_eviction():
+    """The sound cache evicts least recently used, unpinned sounds."""
+    cache = SoundCache(max_bytes=0)
+    sounds = [SFX(base_freq=i / 10, env_decay=0.1) for i in range(1, 4)]
+    pinned = cache.pin(sounds[0])
+    cache.max_bytes = cache.nbytes + 2 * len(sounds[1].build())
+    cache.get(sounds[1])
+    cache.get(sounds[2])
+    assert len(cache) == 2
+    assert cache.get(sounds[0]) is pinned
+
+    cache.unpin(sounds[0])
+    cache.max_bytes = 0
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+    with raises(ValueError):
+        cache.unpin(sounds[0])
+
+    # A failed render does not leave a pin behind
+    broken = SFX(wave_type=4)
+    with raises(ValueError):
+        cache.pin(broken)
+    with raises(ValueError, match='not pinned'):
+        cache.unpin(broken)
+
+
+def test_seeded_noise():
+    """Noise is generated deterministically from a seed."""
+    params = dict(wave_type='noise', base_freq=0.3, env_decay=0.2)
+    a = bytes(SFX(**params, seed=5)._build())
+    assert bytes(SFX(**params, seed=5)._build()) == a
+    assert bytes(SFX(**params, seed=6)._build()) != a
+    assert bytes(SFX(**params)._build()) == bytes(SFX(**params)._build())
+
+
+def test_seeded_pluck():
+    """Plucks are generated deterministically from a seed."""
+    a = bytes(pluck(0.2, 'A4', seed=1))
+    assert bytes(pluck(0.2, 'A4', seed=1)) == a
+    assert bytes(pluck(0.2, 'A4', seed=2)) != a
+
+
+def test_tones():
+    """We can generate several tones at once."""
+    pitches = ['C4', 'E4', 261.63]
+    sounds = tones(pitches, sustain=0.1)
+    assert [bytes(s) for s in sounds] == [
+        bytes(tone(p, sustain=0.1)) for p in pitches
+    ]
+
+
+def test_mix():
+    """Sounds are mixed at the given offsets and gains, then clipped."""
+    a = tone(440, attack=0.01, decay=0, sustain=0.05, release=0.01)
+    b = tone(660, attack=0.01, decay=0, sustain=0.05, release=0.01)
+    offset = 100 / 44100
+    mixed = mix([a, b], offsets=[0, offset], gains=[0.5, 2.0])
+    assert len(mixed) == len(b) + 100
+
+    for i in range(0, len(mixed), 97):
+        v = a[i] * 0.5 if i < len(a) else 0
+        if i >= 100:
+            v += b[i - 100] * 2.0
+        assert mixed[i] == max(-32768, min(32767, floor(v + 0.5)))
+
+
+def test_chord_stagger():
+    """A chord delays the start of each sound by the stagger."""
+    sounds = [tone(p, sustain=0.1) for p in (220, 330, 440)]
+    c = chord(sounds, stagger=0.1)
+    assert len(c) == len(sounds[0]) + 2 * 4410
+    assert c[4410 + 1000] == approx(
+        (sounds[0][4410 + 1000] + sounds[1][1000]) / 3,
+        abs=1
+    )
+
+
+def test_sample_formats():
+    """Sounds can be generated and mixed in float and 8-bit formats."""
+    ref = tone(440)
+    for format in ('f', 'B'):
+        sound = tone(440, format=format)
+        converted = ref.convert(format)
+        assert sound.format == memoryview(sound).format == format
+        assert list(memoryview(sound)) == approx(
+            list(memoryview(converted)), abs=1
+        )
+        assert mix([sound], format='h')[5000] == approx(ref[5000], abs=300)
+
+    assert tone(440, format='f')[5000] == approx(
+        ref[5000] / AMPLITUDE, abs=1 / AMPLITUDE
+    )
+    assert bytes(ref.convert('f').convert('h')) == bytes(ref)
+
+
+def test_sample_rate():
+    """Sounds can be generated at other sample rates with the same duration."""
+    t = tone(440, sample_rate=22050)
+    assert t.sample_rate == 22050
+    assert t.duration == approx(tone(440).duration, abs=1e-3)
+
+    s = SFX(base_freq=0.5, freq_ramp=-0.2, hpf_freq=0.1)
+    full = s.build()
+    s.sample_rate = 22050
+    half = s.build()
+    assert half.sample_rate == 22050
+    assert len(half) == approx(len(full) / 2, abs=1)
+    assert SFX(**s.as_dict()).sample_rate == 22050
+
+    with raises(ValueError):
+        mix([full, half])
+
+
+def test_stereo_chord(tmp_path):
+    """Chords can be panned into interleaved stereo sounds."""
+    a = tone(440, sustain=0.1)
+    b = tone(660, sustain=0.1)
+    c = chord([a, b], pan=[-1.0, 1.0])
+    assert c.channels == 2
+    assert len(c) == len(a)
+    assert memoryview(c).shape == (len(a), 2)
+    assert memoryview(c).strides == (4, 2)
+    part = c[10:20]
+    assert memoryview(part).shape == (10, 2)
+    assert memoryview(c).shape == (len(a), 2)
+    assert c[5000] == approx((a[5000] / 2, b[5000] / 2), abs=1)
+
+    centred = chord([a], gains=[1.0, 0.5])
+    assert centred[5000] == approx((a[5000], a[5000] / 2), abs=1)
+
+    # Any real number type, such as NumPy scalars, is accepted as a gain
+    half = mix([a, b], gains=[Fraction(1, 2), 0.5])
+    assert bytes(half) == bytes(mix([a, b], gains=[0.5, 0.5]))
+    assert bytes(chord([a], pan=Fraction(0))) == bytes(chord([a], pan=0.0))
+
+    path = tmp_path / 'chord.wav'
+    c.save(str(path))
+    with wave.open(str(path)) as wav:
+        assert wav.getnchannels() == 2
+        assert wav.getnframes() == len(c)
+
+
+def test_slice_view():
+    """Slicing a SoundBuffer gives a view sharing the same memory."""
+    t = tone(440)
+    view = t[1000:2000]
+    assert len(view) == 1000
+    assert view.base is t
+    assert view[0] == t[1000]
+    assert bytes(view) == bytes(memoryview(t)[1000:2000])
+
+    del t
+    assert len(mix([view, view[-100:]])) == 1000
+    assert len(view[500:100]) == 0
+    with raises(ValueError):
+        view[::2]
+
+
+def test_from_buffer():
+    """SoundBuffers can wrap other buffers without copying."""
+    samples = array('h', range(-500, 500))
+    buf = SoundBuffer.from_buffer(samples)
+    assert buf.format == 'h'
+    assert buf.base is samples
+    assert list(memoryview(buf)) == list(samples)
+    samples[0] = 1234
+    assert buf[0] == 1234
+    assert buf.__array_interface__['shape'] == (1000,)
+
+    frames = memoryview(samples).cast('B').cast('h', (500, 2))
+    stereo = SoundBuffer.from_buffer(frames)
+    assert stereo.channels == 2
+    assert stereo[1] == (samples[2], samples[3])
+
+    ro = SoundBuffer.from_buffer(bytes(4), format='f')
+    assert len(ro) == 1
+    assert memoryview(ro).readonly
+    assert ro.__array_interface__['data'][1]
+
+
+def test_arena():
+    """Sounds can be allocated from a single SoundArena."""
+    arena = SoundArena(1 << 20)
+    a = tone(440, sustain=0.1, arena=arena)
+    b = pluck(0.1, 'A4', seed=1, format='f', arena=arena)
+    assert a.base is arena and b.base is arena
+    assert bytes(a) == bytes(tone(440, sustain=0.1))
+    assert list(b) == list(pluck(0.1, 'A4', seed=1, format='f'))
+    assert arena.used >= memoryview(a).nbytes + memoryview(b).nbytes
+    assert memoryview(arena).nbytes == arena.used
+
+    with raises(MemoryError):
+        tone(440, sustain=20, arena=arena)
+
+
+def test_save_many_and_load(tmp_path):
+    """Sounds saved as WAV files can be loaded again, memory-mapped."""
+    sounds = {
+        tmp_path / 'tone.wav': tone(440),
+        tmp_path / 'byte.wav': tone(440, format='B', sample_rate=22050),
+        tmp_path / 'chord.wav': chord([tone(440), tone(660)], pan=0.5),
+        tmp_path / 'sfx.wav': SFX(),
+    }
+    save_many(sounds)
+
+    for path, snd in sounds.items():
+        snd = snd.build() if isinstance(snd, SFX) else snd
+        with wave.open(str(path)) as wav:
+            assert wav.getframerate() == snd.sample_rate
+            assert wav.readframes(len(snd)) == bytes(snd)
+
+        for mmap in (True, False):
+            loaded = SoundBuffer.load(str(path), mmap=mmap)
+            assert loaded.format == snd.format
+            assert loaded.channels == snd.channels
+            assert loaded.sample_rate == snd.sample_rate
+            assert bytes(loaded) == bytes(snd)
+
+    with raises(FileNotFoundError):
+        save_many({tmp_path / 'missing' / 'x.wav': tone(440)})
+
+
+def test_load_invalid(tmp_path):
+    """Truncated or unsupported WAV files raise ValueError."""
+    path = tmp_path / 'tone.wav'
+    tone(440).save(str(path))
+    data = path.read_bytes()
+
+    for size in (8, 30, 44, len(data) - 10):
+        path.write_bytes(data[:size])
+        for mmap in (True, False):
+            with raises(ValueError):
+                SoundBuffer.load(str(path), mmap=mmap)
+
+    # WAVE_FORMAT_EXTENSIBLE
+    path.write_bytes(data[:20] + b'\xfe\xff' + data[22:])
+    with raises(ValueError, match='EXTENSIBLE'):
+        SoundBuffer.load(str(path))
+
+
+def test_save_float(tmp_path):
+    """Float sounds are saved as 16-bit PCM."""
+    snd = tone(440, format='f')
+    path = tmp_path / 'float.wav'
+    snd.save(str(path))
+    with wave.open(str(path)) as wav:
+        assert wav.getsampwidth() == 2
+        assert wav.readframes(len(snd)) == bytes(snd.convert('h'))
+    assert SoundBuffer.load(str(path)).format == 'h'
+
+
+def test_wavetable_sfx():
+    """SFX can use a custom wavetable, as wave type 4."""
+    s = SFX(wave_type=2, env_sustain=0.1, env_decay=0.1)
+    sine = s.build()
+
+    s.wave_type = WaveType.WAVETABLE
+    s.wavetable = Wavetable.from_function(sin)
+    custom = s.build()
+    assert len(custom) == len(sine)
+    assert list(custom) == approx(list(sine), abs=40)
+
+    copy = SFX(**s.as_dict())
+    assert copy.wavetable is not None
+    assert bytes(copy.build()) == bytes(custom)
+
+    # Changing the wavetable replaces the converted table
+    s.wavetable = Wavetable.square()
+    assert bytes(s.build()) != bytes(custom)
+    assert bytes(s.build()) == bytes(SFX(**s.as_dict()).build())
+
+    with raises(ValueError):
+        SFX(wave_type=4).build()
+
+
+def test_oversample():
+    """Sounds can be rendered with less supersampling, for previews."""
+    s = SFX(base_freq=0.4, freq_ramp=-0.1, lpf_freq=0.5, env_decay=0.2)
+    full = s.build()
+    s.oversample = 2
+    preview = s.build()
+    assert len(preview) == len(full)
+    assert list(memoryview(preview)) != list(memoryview(full))
+
+    with raises(ValueError):
+        s.oversample = 3
+
+
+def test_sequence():
+    """We can render a sequence of notes into one buffer."""
+    a = tone('A4', sustain=0.5)
+    c = tone('C5', sustain=0.5, wavetable=Wavetable.square())
+    melody = sequence([
+        (0.0, 'A4', 0.7),
+        (0.5, 'C5', 0.7, None, Wavetable.square()),
+    ])
+    offset = round(0.5 * 44100)
+    assert len(melody) == offset + len(c)
+    assert list(melody[:offset]) == approx(list(a[:offset]), abs=1)
+
+    overlap = sequence([(0.0, 440.0, 0.7)] * 2, gain=0.5)
+    assert list(overlap) == approx(list(a), abs=1)
+
+
+def test_voice_mixer():
+    """A VoiceMixer mixes sounds into blocks of output."""
+    a = tone('A4')
+    c = tone('C5', sustain=0.1)
+    mixer = VoiceMixer(channels=1)
+    mixer.play(a)
+    mixer.play(c)
+    out = SoundBuffer(len(a))
+    assert mixer.fill(out[:1000]) == 2
+    assert mixer.fill(out[1000:]) == 0
+    assert mixer.active == 0
+    assert list(out) == approx(list(mix([a, c])), abs=1)
+
+
+def test_voice_stealing():
+    """When all the voices are busy, the oldest voice is stolen."""
+    a = tone('A4')
+    mixer = VoiceMixer(max_voices=2)
+    first = mixer.play(a, pan=-1.0)
+    mixer.play(a, pan=1.0)
+    mixer.play(a, gain=0.5)
+    assert mixer.active == 2
+
+    out = SoundBuffer(1000, channels=2)
+    mixer.fill(out)
+    expected = mix([a, a], gains=[[0.0, 1.0], [0.5, 0.5]])
+    assert list(out) == list(expected[:1000])
+
+    mixer.stop(first)
+    assert mixer.active == 2
+    mixer.stop_all()
+    assert mixer.active == 0
+
+
+def test_build_async():
+    """Concurrent async builds of the same sound share one render."""
+    renders = []
+
+    class CountingSFX(SFX):
+        def _render(self):
+            renders.append(self)
+            return super()._render()
+
+    s = CountingSFX(seed=20, env_sustain=0.2)
+
+    async def build():
+        return await asyncio.gather(
+            s.build_async(),
+            CountingSFX(**s.as_dict()).build_async(),
+            tone_async('A4'),
+        )
+
+    a, b, t = asyncio.run(build())
+    assert a is b
+    assert len(renders) == 1
+    assert bytes(t) == bytes(tone('A4'))
+    assert asyncio.run(s.build_async()) is a
+
+    c = asyncio.run(chord_async([t, a]))
+    assert bytes(c) == bytes(chord([t, a]))
+
+
+def test_render_stats():
+    """Renders are counted and timed, and passed to the render hook."""
+    renders = []
+    reset_render_stats()
+    set_render_hook(lambda *args: renders.append(args))
+    try:
+        s = SFX(seed=30, env_sustain=0.1)
+        buf = s.build()
+        s.build()
+        chord([tone('A4'), pluck(0.5, 'A4')])
+    finally:
+        set_render_hook(None)
+
+    stats = render_stats()
+    assert stats['sfx']['renders'] == 1
+    assert stats['sfx']['samples'] == len(buf)
+    assert stats['sfx']['ns'] > 0
+    assert stats['tone']['renders'] == stats['pluck']['renders'] == 1
+    assert stats['chord']['renders'] == 1
+    assert stats['mix']['renders'] == 0
+    assert stats['cache'] == {'hits': 1, 'misses': 1}
+
+    kernels = [kernel for kernel, ns, n_samples, params in renders]
+    assert kernels == ['sfx', 'tone', 'pluck', 'chord']
+    kernel, ns, n_samples, params = renders[0]
+    assert n_samples == len(buf)
+    assert bytes(SFX(**params).build()) == bytes(buf)
+
+    # Batches record every sound they render
+    reset_render_stats()
+    set_render_hook(lambda *args: renders.append(args))
+    try:
+        bufs = SFXBank.from_sfx(SFX(seed=i) for i in range(3)).render(2)
+    finally:
+        set_render_hook(None)
+    stats = render_stats()
+    assert stats['sfx']['renders'] == 3
+    assert stats['sfx']['samples'] == sum(len(b) for b in bufs)
+    assert [r[2] for r in renders[-3:]] == [len(b) for b in bufs]
+
+
+def test_render_hook_raises(monkeypatch):
+    """Exceptions from the render hook are reported, not propagated."""
+    unraisable = []
+    monkeypatch.setattr(sys, 'unraisablehook', unraisable.append)
+
+    def hook(*args):
+        raise RuntimeError("bad hook")
+
+    set_render_hook(hook)
+    try:
+        buf = tone('A4')
+    finally:
+        set_render_hook(None)
+    assert bytes(buf) == bytes(tone('A4'))
+    assert len(unraisable) == 1
+    assert isinstance(unraisable[0].exc_value, RuntimeError)
+
+
+def test_memory_stats():
+    """The memory used by live sounds is accounted by origin."""
+    before = memory_stats()
+    t = tone('A4')
+    p = pluck(0.5, 'A4', format='f')
+    u = SoundBuffer(100)
+    view = t[:100]
+    arenas = [SoundArena(1000), SoundArena(0)]
+
+    stats = memory_stats()
+    assert stats['tone']['count'] == before['tone']['count'] + 1
+    assert stats['tone']['bytes'] == before['tone']['bytes'] + 2 * len(t)
+    assert stats['pluck']['bytes'] == before['pluck']['bytes'] + 4 * len(p)
+    assert stats['user']['bytes'] == before['user']['bytes'] + 200
+    assert stats['arena']['count'] == before['arena']['count'] + 1
+    assert stats['arena']['bytes'] == before['arena']['bytes'] + 1000
+    assert stats['total']['peak'] >= stats['total']['bytes']
+
+    del t, p, u, view, arenas
+    after = memory_stats()
+    for origin in ('tone', 'pluck', 'user', 'arena'):
+        assert after[origin] == before[origin]
+
+
+def test_memory_alert():
+    """An alert is raised when sound memory exceeds a limit."""
+    alerts = []
+    set_memory_alert(memory_stats()['total']['bytes'] + 1000, alerts.append)
+    try:
+        small = SoundBuffer(100)
+        assert alerts == []
+        big = SoundBuffer(1000)
+        assert len(alerts) == 1
+        assert alerts[0]['user']['count'] >= 2
+        SoundBuffer(1000)
+        assert len(alerts) == 1
+    finally:
+        set_memory_alert(0, None)
+    del small, big
+
+
+def test_memory_alert_raises(monkeypatch):
+    """Exceptions from the memory alert are reported, not propagated."""
+    unraisable = []
+    monkeypatch.setattr(sys, 'unraisablehook', unraisable.append)
+
+    def alert(stats):
+        raise MemoryError("over budget")
+
+    set_memory_alert(memory_stats()['total']['bytes'] + 1000, alert)
+    try:
+        buf = tone('A4')
+    finally:
+        set_memory_alert(0, None)
+    assert bytes(buf) == bytes(tone('A4'))
+    assert len(unraisable) == 1
+    assert isinstance(unraisable[0].exc_value, MemoryError)
+
+
+def test_sfx_equality():
+    """SFX objects with the same parameters are equal and hash equal."""
+    a = SFX(base_freq=0.5, wave_type=WaveType.SINE, seed=3)
+    b = SFX(seed=3, wave_type=2, base_freq=0.5)
+    assert a == b
+    assert hash(a) == hash(b)
+    assert a == SFX(**a.as_dict(), env_sustain=0.3)
+    assert a != SFX(base_freq=0.5)
+
+    w = SFX(wave_type=4, wavetable=Wavetable.triangle())
+    assert w == SFX(**w.as_dict())
+    assert hash(w) == hash(SFX(**w.as_dict()))
+    assert w != SFX(wave_type=4, wavetable=Wavetable.square())
+
+    # -0.0 renders the same as 0.0, so it compares equal
+    assert SFX(freq_ramp=-0.0, duty=-0.0) == SFX()
+    assert hash(SFX(freq_ramp=-0.0)) == hash(SFX())
+
+    c = pickle.loads(pickle.dumps(a))
+    assert c == a
+    assert c.as_dict() == a.as_dict()
+
+
+def test_sfx_bank(tmp_path):
+    """SFXBank stores presets in columns and renders them in bulk."""
+    presets = [
+        SFX(base_freq=0.1 * i, seed=i, env_sustain=0.1) for i in range(5)
+    ]
+    bank = SFXBank.from_sfx(presets)
+    assert len(bank) == 5
+    assert list(bank.columns['seed']) == [0, 1, 2, 3, 4]
+    assert bank[2] == presets[2]
+    assert list(bank) == presets
+
+    rendered = bank.render(workers=2)
+    assert [bytes(b) for b in rendered] == [bytes(p.build()) for p in presets]
+
+    bank.save(tmp_path / 'bank.sfx')
+    loaded = SFXBank.load(tmp_path / 'bank.sfx')
+    assert list(loaded) == presets
+
+
+def test_generate():
+    """generate() makes reproducible banks of random presets."""
+    bank = generate('laser', 500, seed=3)
+    assert len(bank) == 500
+    assert bank.columns == generate('laser', 500, seed=3).columns
+    assert bank.columns != generate('laser', 500, seed=4).columns
+    assert set(bank.columns['wave_type']) == {0, 1, 2}
+    assert all(0.3 <= f <= 1.0 for f in bank.columns['base_freq'])
+    assert all(f >= 0.2 or f <= 0.1 for f in bank.columns['freq_limit'])
+    assert all(round(f, 3) == f for f in bank.columns['env_decay'])
+
+    # About 1 in 3 lasers have a high-pass filter
+    with_hpf = sum(1 for f in bank.columns['hpf_freq'] if f)
+    assert 100 < with_hpf < 230
+
+    bank = generate('explosion', 4, seed=1)
+    assert set(bank.columns['wave_type']) == {WaveType.NOISE.value}
+    assert all(len(s) for s in bank.render(workers=2))
+
+    with raises(ValueError):
+        generate('kaboom', 1)